@@ -0,0 +1,160 @@
+"""
+BATCH PROCESSING
+@Description: Runs eye detection, ROI tracking, ROI frame store and optical flow over every video found
+in a dataset folder (see "dataset_folder" in params.json) using a pool of processes (one video per worker).
+A failure in one video does not stop the rest of the batch.
+"""
+
+import os
+import json
+import time
+import traceback
+from multiprocessing import Pool, cpu_count
+
+from lib.config import get_config
+from lib.instrumentation import get_logger
+from lib.pipeline import run_video
+
+logger = get_logger(__name__)
+
+# Stages run per video (the phase plane compares two subjects, so it is not part of the batch)
+BATCH_STAGES = ('detection', 'roi_tracking', 'roi_frames', 'optical_flow')
+
+# Folders written by the pipeline next to each video (not searched for videos)
+OUTPUT_FOLDERS = ('eyes_detection', 'roi_frames', 'optical_flow', 'phase_planes_per_frame', 'features')
+
+
+def find_videos(dataset_folder, extensions):
+    """
+    Looks for every video inside a dataset folder (recursively).
+    :param dataset_folder: path to the dataset folder
+    :param extensions: list of video extensions (e.g. ['.mp4']). Case is ignored
+    :return: sorted list of paths to the videos
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    video_files = []
+
+    for folder, dirs, files in os.walk(dataset_folder):
+        dirs[:] = [d for d in dirs if d not in OUTPUT_FOLDERS]
+        for file in files:
+            if file.lower().endswith(extensions):
+                video_files.append(os.path.join(folder, file))
+
+    return sorted(video_files)
+
+
+def process_video(video_file):
+    """
+    Processes one video (worker function). Any error is caught and reported in the result.
+    :param video_file: path to the video
+    :return: dict with the video, status ('ok' or 'failed'), error, timings and number of frames tracked
+    """
+    start = time.time()
+    try:
+        result = run_video(video_file, stages=BATCH_STAGES, visualize=False)
+        n_frames = max(df['frame'].max() - df['frame'].min() + 1 for df in result['optical_flow'].values())
+        return {'video_file': video_file, 'status': 'ok', 'error': None,
+                'timings': result['timings'], 'n_frames': int(n_frames), 'time': time.time() - start}
+    except Exception:
+        return {'video_file': video_file, 'status': 'failed', 'error': traceback.format_exc(),
+                'timings': {}, 'n_frames': 0, 'time': time.time() - start}
+
+
+def run_batch(dataset_folder=None, n_workers=None):
+    """
+    Runs the batch processing over a dataset folder and writes "batch_summary.json" in it.
+    Videos that share a folder are not processed, since their outputs would overwrite each other.
+    :param dataset_folder: path to the dataset folder. If None, "dataset_folder" from params.json is used
+    :param n_workers: number of worker processes. If None, "batch/n_workers" from params.json is used
+    (0 means one per CPU)
+    :return: dict with the summary of the batch
+    """
+    jf = get_config()
+    if dataset_folder is None:
+        dataset_folder = jf['dataset_folder']
+    if n_workers is None:
+        n_workers = jf['batch']['n_workers']
+    extensions = jf['batch']['video_extensions']
+
+    if not os.path.isdir(dataset_folder):
+        raise IOError('Dataset folder not found: %s' % dataset_folder)
+
+    n_workers = n_workers or cpu_count()
+    video_files = find_videos(dataset_folder, extensions)
+    logger.info('%d videos found in %s' % (len(video_files), dataset_folder))
+
+    # Outputs are saved next to the video, so there must be one video per folder
+    by_folder = {}
+    for video_file in video_files:
+        by_folder.setdefault(os.path.dirname(video_file), []).append(video_file)
+
+    results = []
+    for folder, files in by_folder.items():
+        if len(files) > 1:
+            for video_file in files:
+                results.append({'video_file': video_file, 'status': 'failed',
+                                'error': 'Output folder shared with other videos: %s' % folder,
+                                'timings': {}, 'n_frames': 0, 'time': 0.})
+    to_process = [files[0] for files in by_folder.values() if len(files) == 1]
+
+    # Start processing!
+    start = time.time()
+    pool = Pool(n_workers, maxtasksperchild=1)
+    try:
+        for i, result in enumerate(pool.imap_unordered(process_video, to_process)):
+            log = logger.error if result['status'] == 'failed' else logger.info
+            log('(%d/%d) %s (%.1f s)' % (i + 1, len(to_process), result['video_file'], result['time']))
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+    wall_time = time.time() - start
+
+    summary = batch_summary(results, wall_time, n_workers)
+    summary['dataset_folder'] = dataset_folder
+
+    with open(os.path.join(dataset_folder, 'batch_summary.json'), 'w') as file_out:
+        json.dump(summary, file_out, sort_keys=True, indent=4)
+
+    print_summary(summary)
+    return summary
+
+
+def batch_summary(results, wall_time, n_workers):
+    """
+    Computes the throughput of a batch.
+    :param results: list of results (see process_video)
+    :param wall_time: total time of the batch in seconds
+    :param n_workers: number of worker processes
+    :return: dict with the summary
+    """
+    ok = [r for r in results if r['status'] == 'ok']
+    n_frames = sum(r['n_frames'] for r in ok)
+
+    return {
+        'n_workers': n_workers,
+        'n_videos': len(results),
+        'n_ok': len(ok),
+        'n_failed': len(results) - len(ok),
+        'wall_time': wall_time,
+        'videos_per_hour': 3600. * len(ok) / wall_time if wall_time > 0 else 0.,
+        'frames_per_second': n_frames / wall_time if wall_time > 0 else 0.,
+        'results': sorted(results, key=lambda r: r['video_file'])
+    }
+
+
+def print_summary(summary):
+    """
+    Prints the summary of a batch (see batch_summary).
+    :param summary: dict with the summary
+    """
+    print('[  INFO  ] Batch summary:')
+    print('\tVideos processed: %d (%d failed)' % (summary['n_videos'], summary['n_failed']))
+    print('\tWorkers: %d' % summary['n_workers'])
+    print('\tWall time: %.1f s' % summary['wall_time'])
+    print('\tThroughput: %.1f videos/hour, %.1f frames/s' % (summary['videos_per_hour'],
+                                                           summary['frames_per_second']))
+
+    for result in summary['results']:
+        if result['status'] == 'failed':
+            print('[  ERROR  ] %s\n%s' % (result['video_file'], result['error']))
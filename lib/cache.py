@@ -0,0 +1,179 @@
+"""
+STAGE CACHE
+@Description: Content-addressed cache of the results of the per-video stages. The key of a stage is
+a hash of the content of the video, the parameters the stage depends on and the key of the stage it
+reads from, so a change in the parameters of one stage invalidates that stage and the following ones
+only. The keys of the last results are kept in a manifest next to the video:
+
+    [video folder]/stage_cache.json
+
+Results themselves are the usual output files of each stage (eyes_detection.json, roi_track.csv,
+roi_frames, optical flow tracks). The hash of the video is memoized by file size and modification time.
+"""
+
+import hashlib
+import json
+import os
+
+from lib.eyes_extraction import load_eyes_detection
+from lib.instrumentation import get_logger
+from lib.optical_flow import get_opt_flow_data, uses_chunks
+from lib.roi_store import load_roi_store
+from lib.roi_tracking import roi_track_file
+
+logger = get_logger(__name__)
+
+MANIFEST_FILE = 'stage_cache.json'
+
+# Sections of params.json each stage depends on
+STAGE_PARAMS = {
+    'detection': ('detection',),
+    'roi_tracking': ('detection', 'roi_tracking'),
+    'roi_frames': ('reader',),
+    'optical_flow': ('camera', 'opt_flow', 'kinematics', 'horn_schunck', 'reader', 'phase_plane')
+}
+
+# Parameters that do not change the results (performance only)
+IGNORED_PARAMS = ('n_workers', 'segment_frames', 'queue_size', 'ffmpeg', 'ffprobe')
+
+# Parameters of the chunked optical flow (they only change the results when it is chunked)
+CHUNK_PARAMS = ('chunk_frames', 'chunk_overlap')
+
+
+def file_hash(filename, block_size=1 << 24):
+    """
+    SHA-1 of the content of a file.
+    :param filename: path to the file
+    :param block_size: bytes read at once
+    :return: hexadecimal digest
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as file_in:
+        for block in iter(lambda: file_in.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def hash_params(*values):
+    """
+    Hash of JSON-serializable values (dict keys are sorted, so it does not depend on their order).
+    """
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def stage_params(jf, stage, visualize=False):
+    """
+    Parameters a stage depends on.
+    :param jf: content of params.json
+    :param stage: 'detection', 'roi_tracking', 'roi_frames' or 'optical_flow'
+    :param visualize: the stages are run with preview (the optical flow is not chunked)
+    :return: dict {section: parameters}
+    """
+    params = {}
+    for section in STAGE_PARAMS[stage]:
+        values = jf.get(section, {})
+        if isinstance(values, dict):
+            values = {k: v for k, v in values.items() if k not in IGNORED_PARAMS}
+        params[section] = values
+
+    if stage == 'optical_flow':
+        # Tracks stitched from time chunks are not the same as the ones of a sequential run
+        chunked = uses_chunks(jf['opt_flow'], visualize)
+        params['opt_flow'] = {k: v for k, v in params['opt_flow'].items() if chunked or k not in CHUNK_PARAMS}
+        params['opt_flow']['chunked'] = chunked
+
+        # The optical flow saves the phase plane histograms (the phase plane video is rendered apart)
+        params['phase_plane'] = {k: v for k, v in params['phase_plane'].items() if k != 'video'}
+    return params
+
+
+class StageCache(object):
+    """
+    Keys of the cached results of one video.
+    Usage:
+        cache = StageCache(video_file, jf, visualize)
+        key = cache.key('detection')
+        if not cache.is_valid('detection', key):
+            ...  # run the stage
+            cache.store('detection', key)
+    """
+
+    def __init__(self, video_file, jf, visualize=False):
+        """
+        :param video_file: path to the video
+        :param jf: content of params.json
+        :param visualize: the stages are run with preview (see stage_params)
+        """
+        self.video_file = video_file
+        self.jf = jf
+        self.visualize = visualize
+        self.manifest_file = os.path.join(os.path.dirname(video_file), MANIFEST_FILE)
+
+        self.manifest = {'video': {}, 'stages': {}}
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r') as json_file:
+                self.manifest = json.load(json_file)
+
+    def video_hash(self):
+        """
+        Hash of the content of the video (computed once per file size and modification time).
+        """
+        stat = os.stat(self.video_file)
+        video = self.manifest['video']
+        if video.get('size') != stat.st_size or video.get('mtime') != stat.st_mtime:
+            logger.info('Hashing video: %s' % self.video_file)
+            self.manifest['video'] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                      'sha1': file_hash(self.video_file)}
+            self.manifest['stages'] = {}
+            self._save()
+        return self.manifest['video']['sha1']
+
+    def key(self, stage, upstream=None):
+        """
+        Key of the result of a stage.
+        :param stage: 'detection', 'roi_tracking', 'roi_frames' or 'optical_flow'
+        :param upstream: key of the result the stage reads from (None for the first stage)
+        :return: key
+        """
+        return hash_params(self.video_hash(), stage, stage_params(self.jf, stage, self.visualize), upstream)
+
+    def is_valid(self, stage, key):
+        """
+        Checks if the result of a stage for a key exists.
+        """
+        return self.manifest['stages'].get(stage) == key and outputs_exist(self.video_file, stage)
+
+    def store(self, stage, key):
+        """
+        Records the key of the result of a stage (after the stage has saved its outputs).
+        """
+        self.manifest['stages'][stage] = key
+        self._save()
+
+    def _save(self):
+        with open(self.manifest_file, 'w') as json_file:
+            json.dump(self.manifest, json_file, sort_keys=True, indent=4)
+
+
+def outputs_exist(video_file, stage):
+    """
+    Checks if the output files of a stage exist.
+    :param video_file: path to the video
+    :param stage: 'detection', 'roi_tracking', 'roi_frames' or 'optical_flow'
+    """
+    if stage == 'roi_tracking':
+        return os.path.isfile(roi_track_file(video_file))
+
+    try:
+        if stage == 'roi_frames':
+            return load_roi_store(video_file, load_eyes_detection(video_file)) is not None
+        elif stage == 'detection':
+            load_eyes_detection(video_file)
+        elif stage == 'optical_flow':
+            for eye in ('left', 'right'):
+                get_opt_flow_data(video_file, eye, columns=['frame'])
+        else:
+            return False
+    except (IOError, OSError, ValueError):
+        return False
+    return True
@@ -0,0 +1,307 @@
+"""
+CONFIG
+@Description: Parameters of the pipeline (params/params.json), loaded once per process and validated
+against SCHEMA (missing keys and wrong types are reported before any stage runs). Any value can be
+overridden per deployment without editing params.json:
+- environment: CP_SOFT_<SECTION>__<KEY>=<value>, nested sections separated by "__", e.g.
+      CP_SOFT_OPT_FLOW__N_WORKERS=8
+      CP_SOFT_OPT_FLOW__LUCAS_KANADE__MAX_LEVEL=4
+- command line: --set section.key=value (see add_config_arguments), e.g.
+      python main.py -b --set opt_flow.n_workers=8 --set detection.scale_factor=1.2
+Values are parsed as JSON ("8", "true", "null", "[0, 3000, 60]"), otherwise they are strings.
+Command line overrides are exported as environment variables, so worker processes see the same values.
+"""
+
+import os
+import json
+import logging
+
+# Set root folder
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+PARAMS_FILE = os.path.join(root, 'params', 'params.json')
+ENV_PREFIX = 'CP_SOFT_'
+
+NUMBER = (int, float)
+OPTIONAL_STR = (str, type(None))
+
+# Expected type of every parameter
+SCHEMA = {
+    'dataset_folder': str,
+    'eye_detection_json': str,
+    'detection': {
+        'mode': str,
+        'face_scale': float,
+        'upper_face': float,
+        'scale_factor': float,
+        'min_neighbors': int,
+        'n_workers': int,
+        'segment_frames': int
+    },
+    'roi_tracking': {
+        'redetect_every': int,
+        'search_margin': float,
+        'min_score': float,
+        'max_jump': int
+    },
+    'camera': {
+        'fps': NUMBER
+    },
+    'opt_flow': {
+        'csv_file': str,
+        'format': str,
+        'method': str,
+        'min_features': int,
+        'n_workers': int,
+        'chunk_frames': int,
+        'chunk_overlap': int,
+        'shi_tomasi': {
+            'max_corners': int,
+            'quality_level': float,
+            'min_distance': NUMBER,
+            'block_size': int
+        },
+        'lucas_kanade': {
+            'win_size': int,
+            'max_level': int,
+            'max_iter': int,
+            'epsilon': float
+        }
+    },
+    'lk_sweep': {
+        'n_frames': int,
+        'n_workers': int,
+        'fb_every': int,
+        'max_fb_error': float,
+        'min_survival': float,
+        'grid': dict
+    },
+    'horn_schunck': {
+        'alpha': float,
+        'n_iter': int,
+        'levels': int
+    },
+    'kinematics': {
+        'smoothing': OPTIONAL_STR,
+        'window': int,
+        'polyorder': int
+    },
+    'phase_plane': {
+        'vel_mag': list,
+        'accel_mag': list,
+        'phase_bins': int,
+        'video': {
+            'size': int,
+            'window': (int, float, type(None)),
+            'block_frames': int,
+            'n_workers': int
+        }
+    },
+    'streaming': {
+        'buffer_size': int
+    },
+    'roi_store': {
+        'enabled': bool
+    },
+    'reader': {
+        'queue_size': int,
+        'backend': str,
+        'ffmpeg': str,
+        'frame_index': bool,
+        'ffprobe': str
+    },
+    'batch': {
+        'n_workers': int,
+        'video_extensions': list
+    },
+    'features': {
+        'n_workers': int
+    },
+    'benchmark': {
+        'n_frames': int,
+        'width': int,
+        'height': int,
+        'head_amplitude': NUMBER,
+        'closed_frames': int
+    },
+    'cache': {
+        'enabled': bool
+    },
+    'instrumentation': {
+        'log_level': str,
+        'profile': bool,
+        'tracemalloc': bool
+    }
+}
+
+_config = None
+
+
+def parse_value(text):
+    """
+    Value of an override: JSON if possible, otherwise the text itself.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def check_type(value, expected, name):
+    """
+    Checks (and converts, e.g. 2 -> 2.0 for a float parameter) the type of a parameter.
+    :param value: value of the parameter
+    :param expected: type or tuple of types (see SCHEMA)
+    :param name: name of the parameter (for the error message)
+    :return: value
+    """
+    types = expected if isinstance(expected, tuple) else (expected,)
+    if isinstance(value, bool) and bool not in types:
+        raise ValueError('Parameter "%s" must be %s, not a boolean' % (name, ' or '.join(t.__name__ for t in types)))
+
+    if expected is float and isinstance(value, int):
+        return float(value)
+    if expected is int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    if not isinstance(value, types):
+        raise ValueError('Parameter "%s" must be %s, not %r' % (name, ' or '.join(t.__name__ for t in types), value))
+    return value
+
+
+def validate(config, schema=SCHEMA, prefix=''):
+    """
+    Checks that every parameter of the schema is in the configuration with the expected type.
+    Parameters that are not in the schema are kept as they are.
+    :param config: dict (it is modified in place, see check_type)
+    :param schema: dict {key: type or nested schema}
+    :param prefix: name of the section (for the error messages)
+    :return: config
+    """
+    for key, expected in schema.items():
+        name = prefix + key
+        if key not in config:
+            raise ValueError('Missing parameter "%s" in %s' % (name, PARAMS_FILE))
+        if isinstance(expected, dict):
+            if not isinstance(config[key], dict):
+                raise ValueError('Parameter "%s" must be a section' % name)
+            validate(config[key], expected, name + '.')
+        else:
+            config[key] = check_type(config[key], expected, name)
+    return config
+
+
+def set_value(config, path, value):
+    """
+    Sets a parameter of the configuration.
+    :param config: dict
+    :param path: list of keys, e.g. ['opt_flow', 'n_workers']
+    :param value: new value
+    """
+    section = config
+    for i, key in enumerate(path[:-1]):
+        if not isinstance(section.get(key), dict):
+            raise ValueError('Unknown section "%s"' % '.'.join(path[:i + 1]))
+        section = section[key]
+    if path[-1] not in section:
+        raise ValueError('Unknown parameter "%s"' % '.'.join(path))
+    section[path[-1]] = value
+
+
+def env_name(path):
+    """
+    :param path: list of keys, e.g. ['opt_flow', 'n_workers']
+    :return: name of the environment variable that overrides the parameter (CP_SOFT_OPT_FLOW__N_WORKERS)
+    """
+    return ENV_PREFIX + '__'.join(key.upper() for key in path)
+
+
+def env_overrides(config, environ=None):
+    """
+    Overrides from the environment (CP_SOFT_<SECTION>__<KEY>).
+    :param config: dict with the parameters (to map the names of the variables to the keys)
+    :param environ: environment (os.environ if None)
+    :return: list of (path, value)
+    """
+    environ = os.environ if environ is None else environ
+
+    names = {}
+
+    def collect(section, path):
+        for key, value in section.items():
+            names[env_name(path + [key])] = path + [key]
+            if isinstance(value, dict):
+                collect(value, path + [key])
+    collect(config, [])
+
+    overrides = []
+    for name, text in sorted(environ.items()):
+        if not name.startswith(ENV_PREFIX):
+            continue
+        if name not in names:
+            raise ValueError('Unknown parameter in environment variable %s' % name)
+        overrides.append((names[name], parse_value(text)))
+    return overrides
+
+
+def load_config(params_file=PARAMS_FILE, environ=None):
+    """
+    Loads params.json, applies the environment overrides and validates the result.
+    :param params_file: path to the parameters file
+    :param environ: environment (os.environ if None)
+    :return: dict with the parameters
+    """
+    with open(params_file, 'r') as json_file:
+        config = json.load(json_file)
+
+    for path, value in env_overrides(config, environ):
+        set_value(config, path, value)
+    return validate(config)
+
+
+def get_config():
+    """
+    Parameters of the pipeline, loaded the first time it is called (see load_config). The same
+    dict is returned to every caller, so it must not be modified (use set_overrides instead).
+    :return: dict with the parameters
+    """
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
+
+
+def set_overrides(assignments):
+    """
+    Overrides parameters for this process and its worker processes (exported as environment
+    variables, see the description of the module).
+    :param assignments: list of "section.key=value" strings
+    """
+    global _config
+    for assignment in assignments:
+        if '=' not in assignment:
+            raise ValueError('Overrides must be "section.key=value", not "%s"' % assignment)
+        name, text = assignment.split('=', 1)
+        os.environ[env_name(name.strip().split('.'))] = text.strip()
+
+    # Loaded again (and validated) on the next call of get_config
+    _config = None
+    config = get_config()
+
+    # The level of the "lib" logger is set when the modules are imported (see lib/instrumentation.py)
+    logging.getLogger('lib').setLevel(config['instrumentation']['log_level'])
+
+
+def add_config_arguments(parser):
+    """
+    Adds the --set option to an argparse parser (see apply_config_arguments).
+    """
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='Override a parameter of params.json (repeatable), e.g. --set opt_flow.n_workers=8')
+
+
+def apply_config_arguments(args):
+    """
+    Applies the --set options parsed by argparse (see add_config_arguments).
+    """
+    if args.set:
+        set_overrides(args.set)
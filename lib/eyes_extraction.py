@@ -3,22 +3,269 @@ import cv2
 import json
 import numpy as np
 import shutil
+from multiprocessing import Pool, current_process
+
 import matplotlib.pyplot as plt
 
+from lib.config import get_config
+from lib.frame_index import video_frame_count
+from lib.frame_source import FrameReader
+from lib.instrumentation import NullTimer, StageTimer, get_logger
+from lib.preview import Preview
+
+logger = get_logger(__name__)
+
+
+def select_eyes(eyes, frame_height):
+    """
+    Selects a pair of eyes (left and right) from the detections of the Haar cascade.
+    :param eyes: detections (x, y, w, h) of the eye cascade
+    :param frame_height: height of the video frame (pixels)
+    :return: dict with the coordinates of both eyes or {} if there is no valid pair
+    """
+    data = {}
+    xt, yt, wt, ht = ([], [], [], [])
+
+    for i, (x, y, w, h) in enumerate(eyes):
+        xt.append(int(x))
+        yt.append(int(y))
+        wt.append(int(w))
+        ht.append(int(h))
+
+        # Conditions for eye selection
+        # 1. Eye vertical separation less than 20% of the video height
+        # 2. Ordinate (y) length greater than 20% of the video height
+
+        if i == 1:
+            condition_1 = True
+            condition_2 = abs(yt[0] - yt[1]) < 0.2 * frame_height
+            condition_3 = yt[1] + ht[1] > 0.2 * frame_height
+        elif i >= 1:
+            condition_1 = True
+            condition_2 = abs(yt[1] - yt[2]) < 0.1 * frame_height
+            condition_3 = yt[1] + ht[1] > 0.2 * frame_height
+            logger.debug('More than two eyes')
+            del xt[0], yt[0], wt[0], ht[0]
+        else:
+            condition_1 = condition_2 = condition_3 = False
+
+        conditions = condition_1 and condition_2 and condition_3
+
+        if conditions:
+            # Detect eye side (left and right)
+            if xt[0] < xt[1]:
+                left, right = 1, 0
+            elif xt[0] > xt[1]:
+                left, right = 0, 1
+            else:
+                continue
+
+            data = {
+                'left_eye': {
+                    'x_min': xt[left],
+                    'x_max': xt[left] + wt[left],
+                    'y_min': yt[left],
+                    'y_max': yt[left] + ht[left]
+                },
+                'right_eye': {
+                    'x_min': xt[right],
+                    'x_max': xt[right] + wt[right],
+                    'y_min': yt[right],
+                    'y_max': yt[right] + ht[right]
+                }
+            }
+
+    return data
+
+
+def detect_eyes(gray, eye_cascade, face_cascade=None, face_scale=0.25, upper_face=0.6, scale_factor=1.3,
+                min_neighbors=5):
+    """
+    Detects eyes in a gray frame. If a face cascade is given, the face is first detected on a
+    downscaled copy of the frame and the eye cascade is run only inside the upper region of the
+    (largest) face, at full resolution.
+    :param gray: gray frame
+    :param eye_cascade: Haar cascade for the eyes
+    :param face_cascade: Haar cascade for the face (None to search the eyes in the whole frame)
+    :param face_scale: scale of the frame for the face detection
+    :param upper_face: fraction of the face height (from the top) where the eyes are searched
+    :param scale_factor: scale step of the cascades (detectMultiScale). Larger is faster but can miss eyes
+    :param min_neighbors: neighbor detections needed to keep a detection (detectMultiScale)
+    :return: eye detections (x, y, w, h) in full resolution coordinates
+    """
+    if face_cascade is None:
+        return eye_cascade.detectMultiScale(gray, scale_factor, min_neighbors)
+
+    # Detect the face (downscaled)
+    small = cv2.resize(gray, None, fx=face_scale, fy=face_scale, interpolation=cv2.INTER_AREA)
+    faces = face_cascade.detectMultiScale(small, scale_factor, min_neighbors)
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+
+    # Map the largest face back to full resolution
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    x_min = max(int(x / face_scale), 0)
+    y_min = max(int(y / face_scale), 0)
+    x_max = min(int((x + w) / face_scale), gray.shape[1])
+    y_max = min(int((y + upper_face * h) / face_scale), gray.shape[0])
+
+    # Detect the eyes inside the upper face region
+    eyes = eye_cascade.detectMultiScale(gray[y_min: y_max, x_min: x_max], scale_factor, min_neighbors)
+    if len(eyes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+
+    eyes = np.array(eyes)
+    eyes[:, 0] += x_min
+    eyes[:, 1] += y_min
+    return eyes
+
+
+def crop_roi(img, roi):
+    """
+    Extracts a region of interest from an image.
+    Remember: index have to be passed inverted (x and y)
+    :param img: image
+    :param roi: dict with the boundaries of the ROI ('x_min', 'x_max', 'y_min', 'y_max')
+    :return: ROI image
+    """
+    return img[roi['y_min']: roi['y_max'], roi['x_min']: roi['x_max']]
+
+
+def load_cascades(mode='eyes'):
+    """
+    Loads the Haar cascades for the eye detection.
+    :param mode: 'face' (face-gated eye detection) or 'eyes' (eye detection in the whole frame)
+    :return: eye cascade and face cascade (None if mode is 'eyes')
+    """
+    if mode not in ('face', 'eyes'):
+        raise ValueError('Unknown detection mode "%s". It must be "face" or "eyes"' % mode)
+
+    cascades_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'haarcascades')
+    eye_cascade = cv2.CascadeClassifier(os.path.join(cascades_folder, 'haarcascade_eye.xml'))
+
+    face_cascade = None
+    if mode == 'face':
+        face_cascade = cv2.CascadeClassifier(os.path.join(cascades_folder, 'haarcascade_frontalface_default.xml'))
+
+    return eye_cascade, face_cascade
+
+
+def scan_eyes(video_file, detection, queue_size=32, start=None, stop=None, visualize=False, timer=None):
+    """
+    Scans the frames of a video sequentially until a valid pair of eyes is found.
+    :param video_file: path to the video
+    :param detection: detection parameters (see "detection" in params.json)
+    :param queue_size: number of frames decoded in advance
+    :param start: frame to start the scan from (None for the beginning of the video)
+    :param stop: index of the last frame to be scanned (None for the end of the video)
+    :param visualize: show the detections while processing (in a separate thread)
+    :param timer: StageTimer (see lib/instrumentation.py). If None, nothing is timed
+    :return: frame index, eyes data (see select_eyes) and gray frame where the eyes were found.
+    (None, {}, None) if no valid pair of eyes is found
+    """
+    timer = timer or NullTimer()
+
+    # Create a Haar cascade (and a face cascade for the face-gated mode)
+    eye_cascade, face_cascade = load_cascades(detection['mode'])
+
+    # Create a frame reader (from video). Frames are converted to gray while decoding
+    reader = FrameReader(video_file, start=start, stop=stop, queue_size=queue_size,
+                         color_conversion=cv2.COLOR_RGB2GRAY, keep_frame=visualize,
+                         timer=timer)
+
+    # Start the preview (if any)
+    preview = Preview().start() if visualize else None
 
-def eye_extraction(video_file, show_plot=True):
+    result = (None, {}, None)
+    # Start processing!
+    for frame_index, crops, frame in reader:
+        gray = crops['frame']
+
+        # Detect eyes
+        with timer.frame():
+            with timer.section('detect'):
+                eyes = detect_eyes(gray, eye_cascade, face_cascade, detection['face_scale'], detection['upper_face'],
+                                   detection['scale_factor'], detection['min_neighbors'])
+            data = select_eyes(eyes, reader.frame_height)
+
+        if data != {}:
+            result = (frame_index, data, gray)
+            break
+
+        if preview is not None:
+            for (x, y, w, h) in eyes:
+                frame = cv2.rectangle(frame, (x, y), (x + h, y + w), (0, 255, 0), 2)
+            preview.show('Eye Segmentation', frame)
+
+            # Check for interruption
+            if preview.stopped:
+                break
+
+    # Close and release everything
+    if preview is not None:
+        preview.close()
+    reader.close()
+
+    return result
+
+
+def scan_segment(args):
+    """
+    Scans a segment of a video (worker function of search_eyes_parallel).
+    :param args: tuple (video_file, detection, queue_size, start, stop). See scan_eyes
+    :return: see scan_eyes
+    """
+    video_file, detection, queue_size, start, stop = args
+    return scan_eyes(video_file, detection, queue_size, start=start, stop=stop)
+
+
+def search_eyes_parallel(video_file, detection, queue_size=32):
+    """
+    Looks for the first frame with a valid pair of eyes using a pool of processes. The video is
+    split in segments of "detection/segment_frames" frames, and each worker scans one segment
+    sequentially from its start. Segments are collected in order, so the result is the same
+    frame that a sequential scan from the beginning finds.
+    :param video_file: path to the video
+    :param detection: detection parameters (see "detection" in params.json)
+    :param queue_size: number of frames decoded in advance (per worker)
+    :return: see scan_eyes
+    """
+    frame_count = video_frame_count(video_file)
+
+    segment_frames = detection['segment_frames']
+    segments = [(video_file, detection, queue_size, start, min(start + segment_frames, frame_count))
+                for start in range(0, frame_count, segment_frames)]
+    logger.info('Searching eyes in %d segments (%d workers)' % (len(segments), detection['n_workers']))
+
+    result = (None, {}, None)
+    pool = Pool(detection['n_workers'])
+    try:
+        # Earlier segments first: the first one with a valid pair has the earliest frame
+        for segment_result in pool.imap(scan_segment, segments):
+            if segment_result[1] != {}:
+                result = segment_result
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return result
+
+
+def eye_extraction(video_file, show_plot=True, visualize=False):
     """
     EYE EXTRACTION
     @Description: This program segments eyes in a frontal video. Saves as results:
     - left_eye.jpg  : Left eye segmentation
     - right_eye.jpg : Right eye segmentation
     - eyes_detection.json : File that contains the coordinates of the eye segmentation in the video
+    :param video_file: path to the video
+    :param show_plot: plot the segmented eyes
+    :param visualize: show the detections while processing (in a separate thread). If False, it runs headless
+    :return: dict with the coordinates of both eyes and the frame where they were found
     """
     folder_output = os.path.join(os.path.dirname(video_file), 'eyes_detection')
 
-    root = os.path.dirname(os.path.dirname(__file__))
-    print(root)
-
     # Check and create folder
     if not os.path.exists(folder_output):
         os.makedirs(folder_output)
@@ -26,150 +273,48 @@ def eye_extraction(video_file, show_plot=True):
         shutil.rmtree(folder_output)
         os.makedirs(folder_output)
 
-    # Create a capture object (from video)
-    cap = cv2.VideoCapture(video_file)
+    # JSON filename load: eyes_file
+    jf = get_config()
+    eyes_file = jf['eye_detection_json']
+    queue_size = jf['reader']['queue_size']
+    detection = jf['detection']
 
-    # Create a Haar cascade
-    eye_cascade_xml = os.path.join(root, 'lib', 'haarcascades', 'haarcascade_eye.xml')
-    eye_cascade = cv2.CascadeClassifier(eye_cascade_xml)
+    # Look for the first frame with a valid pair of eyes (in parallel, unless this is already
+    # a worker process of a pool, e.g. batch mode)
+    timer = StageTimer('detection')
+    if detection['n_workers'] > 1 and not visualize and not current_process().daemon:
+        with timer.section('search_parallel'):
+            frame_index, data, gray = search_eyes_parallel(video_file, detection, queue_size)
+    else:
+        frame_index, data, gray = scan_eyes(video_file, detection, queue_size, visualize=visualize, timer=timer)
+    timer.extra['frame_start'] = frame_index
+    timer.write_report(folder_output)
 
-    # JSON filename load: eyes_file
-    with open(os.path.join(root, 'params', 'params.json')) as json_file:
-        jf = json.load(json_file)
-        eyes_file = jf['eye_detection_json']
+    if data != {}:
+        logger.info('Extracting ROI')
 
-    data = {}
-    # Start processing!
-    while cap.isOpened():
-        print('[  OK  ] Checking for frames')
-        ret, frame = cap.read()
-        if ret:
-            print('[  OK  ] Frame found!')
-            # Convert frame to gray
-            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-
-            # Detect eyes
-            eyes = eye_cascade.detectMultiScale(gray, 1.3, 5)
-            xt, yt, wt, ht = ([], [], [], [])
-
-            for i, (x, y, w, h) in enumerate(eyes):
-                print(i)
-                xt.append(int(x))
-                yt.append(int(y))
-                wt.append(int(w))
-                ht.append(int(h))
+        # Extract eye data (images): left_eye.jpg / right_eye.jpg
+        left_eye = crop_roi(gray, data['left_eye'])
+        right_eye = crop_roi(gray, data['right_eye'])
 
-                frame = cv2.rectangle(frame, (x, y), (x + h, y + w), (0, 255, 0), 2)
+        data['frame_start'] = frame_index
+        logger.info('Eyes found at frame: %d' % frame_index)
 
-                # Conditions for eye selection
-                # 1. Eye vertical separation less than 20% of the video height
-                # 2. Ordinate (y) length greater than 20% of the video height
-
-                if i == 1:
-                    condition_1 = True
-                    condition_2 = abs(yt[0] - yt[1]) < 0.2 * cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                    condition_3 = yt[1] + ht[1] > 0.2 * cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                elif i >= 1:
-                    condition_1 = True
-                    condition_2 = abs(yt[1] - yt[2]) < 0.1 * cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                    condition_3 = yt[1] + ht[1] > 0.2 * cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                    print('More than two eyes')
-                    del xt[0], yt[0], wt[0], ht[0]
-                else:
-                    condition_1 = condition_2 = condition_3 = False
-
-                conditions = condition_1 and condition_2 and condition_3
-
-                if conditions:
-                    print('[  OK  ] Extracting ROI')
-
-                    # Detect eye side (left and right)
-                    if xt[0] < xt[1]:
-                        data = {
-                            'left_eye': {
-                                'x_min': xt[1],
-                                'x_max': xt[1] + wt[1],
-                                'y_min': yt[1],
-                                'y_max': yt[1] + ht[1]
-                            },
-                            'right_eye': {
-                                'x_min': xt[0],
-                                'x_max': xt[0] + wt[0],
-                                'y_min': yt[0],
-                                'y_max': yt[0] + ht[0]
-                            }
-                        }
-
-                        # Extract eye data (images): left_eye.jpg / right_eye.jpg
-                        left_eye = gray[
-                            data['left_eye']['y_min']: data['left_eye']['y_max'],  # X ROI boundary
-                            data['left_eye']['x_min']: data['left_eye']['x_max']   # Y ROI boundary
-                        ]
-                        right_eye = gray[
-                            data['right_eye']['y_min']: data['left_eye']['y_max'],  # X ROI boundary
-                            data['right_eye']['x_min']: data['right_eye']['x_max']  # Y ROI boundary
-                        ]
-                    elif xt[0] > xt[1]:
-                        data = {
-                            'left_eye': {
-                                'x_min': xt[0],
-                                'x_max': xt[0] + wt[0],
-                                'y_min': yt[0],
-                                'y_max': yt[0] + ht[0]
-                            },
-                            'right_eye': {
-                                'x_min': xt[1],
-                                'x_max': xt[1] + wt[1],
-                                'y_min': yt[1],
-                                'y_max': yt[1] + ht[1]
-                            }
-                        }
-
-                        # Extract eye data (images): left_eye.jpg / right_eye.jpg
-                        # Remember: index have to be passed inverted (x and y)
-                        left_eye = gray[
-                            data['left_eye']['y_min']: data['left_eye']['y_max'],  # X ROI boundary
-                            data['left_eye']['x_min']: data['left_eye']['x_max']  # Y ROI boundary
-                        ]
-                        right_eye = gray[
-                            data['right_eye']['y_min']: data['left_eye']['y_max'],  # X ROI boundary
-                            data['right_eye']['x_min']: data['right_eye']['x_max']  # Y ROI boundary
-                        ]
+        cv2.imwrite(os.path.join(folder_output, 'left_eye.jpg'), left_eye)
+        cv2.imwrite(os.path.join(folder_output, 'right_eye.jpg'), right_eye)
 
-        if data != {}:
-            try:
-                    # Visualise image
-                    frame_start = cap.get(cv2.CAP_PROP_POS_FRAMES)
-                    data['frame_start'] = frame_start
-                    print('[  INFO  ] Eyes found at frame: %d' % frame_start)
-                    print('[  SUCCESS  ] showing')
-
-                    cv2.imwrite(os.path.join(folder_output, 'left_eye.jpg'), left_eye)
-                    cv2.imwrite(os.path.join(folder_output, 'right_eye.jpg'), right_eye)
-
-                    # Save coordinates file (see params.json)
-                    try:
-                        with open(os.path.join(folder_output, eyes_file), 'w') as file_out:
-                            json.dump(data, file_out, sort_keys=True, indent=4)
-                    except Exception:
-                        print('[  ERROR  ] Cannot save JSON file')
-                        print(Exception)
-
-                    # Exit
-                    break
-            except TypeError as e:
-                print('[  ERROR  ] Cannot show or eyes not detected:\n %s' % e.strerror)
-
-        # Check for interruption
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        # Save coordinates file (see params.json)
+        try:
+            with open(os.path.join(folder_output, eyes_file), 'w') as file_out:
+                json.dump(data, file_out, sort_keys=True, indent=4)
+        except Exception as e:
+            logger.error('Cannot save JSON file: %s' % e)
 
-    # Close and release everything
-    cap.release()
-    cv2.destroyAllWindows()
+    if data == {}:
+        logger.error('Eyes not detected')
 
     # Show if you want
-    if show_plot:
+    elif show_plot:
         plt.style.use('ggplot')
 
         plt.subplot(1, 2, 1)
@@ -183,3 +328,17 @@ def eye_extraction(video_file, show_plot=True):
         plt.axis('on')
         plt.grid('on')
         plt.title('Left eye')
+
+    return data
+
+
+def load_eyes_detection(video_file):
+    """
+    Loads the eyes detection file (see params.json) generated by eye_extraction.
+    :param video_file: path to the video
+    :return: dict with the coordinates of both eyes and the frame where they were found
+    """
+    eyes_file = get_config()['eye_detection_json']
+
+    with open(os.path.join(os.path.dirname(video_file), 'eyes_detection', eyes_file), 'r') as json_file:
+        return json.load(json_file)
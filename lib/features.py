@@ -0,0 +1,255 @@
+"""
+FEATURES
+@Description: Kinematic descriptors of every subject (video) and eye of a dataset, stored as one
+matrix (rows: subject/eye, columns: FEATURES) so cohorts can be compared without processing the
+videos again. The matrix is saved inside the dataset folder:
+
+    [dataset folder]/features/features.npy   : float64 matrix (n_rows, n_features), memory-mappable
+    [dataset folder]/features/subjects.json  : index of the rows (video, eye) and feature names
+
+The matrix is updated incrementally: only the rows whose optical flow changed (or is new) are computed,
+using a pool of processes.
+"""
+
+import os
+import json
+import traceback
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+
+from lib.batch import find_videos
+from lib.cache import hash_params
+from lib.config import get_config
+from lib.histograms import PhasePlaneHistogram, phase_plane_file
+from lib.instrumentation import get_logger
+from lib.optical_flow import get_opt_flow_data
+
+logger = get_logger(__name__)
+
+EYES = ('left', 'right')
+
+FEATURES = (
+    'n_samples',            # Number of samples (feature/frame pairs) with velocity and acceleration
+    'n_tracks',             # Number of tracks
+    'mean_track_length',    # Mean number of samples per track
+    'vel_p50', 'vel_p90', 'vel_p99',            # Percentiles of the velocity magnitude
+    'accel_p50', 'accel_p90', 'accel_p99',      # Percentiles of the acceleration magnitude
+    'vel_phase_spread',     # Circular standard deviation of the velocity direction
+    'accel_phase_spread',   # Circular standard deviation of the acceleration direction
+    'hist_var',             # Variance of the (normalized) magnitude phase plane
+    'phase_hist_var',       # Variance of the (normalized) direction phase plane
+    'hist_outside'          # Fraction of samples out of the magnitude phase plane
+)
+
+COLUMNS = ['frame', 'feature_id', 'x_vel', 'y_vel', 'x_accel', 'y_accel']
+
+# Phase plane parameters the histogram features depend on (the video options are not used)
+HISTOGRAM_PARAMS = ('vel_mag', 'accel_mag', 'phase_bins')
+
+
+def circular_spread(angles):
+    """
+    Circular standard deviation of a set of angles (radians).
+    """
+    if len(angles) == 0:
+        return np.nan
+    resultant = np.abs(np.mean(np.exp(1j * angles)))
+    return np.sqrt(-2 * np.log(max(resultant, 1e-12)))
+
+
+def source_signature(video_file, eye, opt_flow_csv, phase_plane_params):
+    """
+    Signature (size and modification time) of the optical flow output of an eye and hash of the
+    phase plane parameters of the histograms, used to detect the rows that must be updated.
+    :param video_file: path to the video
+    :param eye: 'left' or 'right'
+    :param opt_flow_csv: name of the optical flow *.csv file (see "opt_flow/csv_file" in params.json)
+    :param phase_plane_params: see "phase_plane" in params.json
+    :return: list [size, mtime, params hash] or None if the eye has no optical flow
+    """
+    params_hash = hash_params({k: phase_plane_params[k] for k in HISTOGRAM_PARAMS})
+    folder = os.path.join(os.path.dirname(video_file), 'optical_flow')
+    for filename in (os.path.join(folder, eye + '_eye', 'frame.npy'),
+                     os.path.join(folder, eye + '_eye_' + opt_flow_csv)):
+        if os.path.isfile(filename):
+            stat = os.stat(filename)
+            return [stat.st_size, stat.st_mtime, params_hash]
+    return None
+
+
+def subject_features(video_file, eye, phase_plane_params):
+    """
+    Computes the descriptors of one eye of a subject.
+    :param video_file: path to the video
+    :param eye: 'left' or 'right'
+    :param phase_plane_params: see "phase_plane" in params.json
+    :return: array with the value of each feature (see FEATURES)
+    """
+    df = get_opt_flow_data(video_file, eye, columns=COLUMNS)
+
+    x_vel, y_vel = df['x_vel'].values.astype(np.float64), df['y_vel'].values.astype(np.float64)
+    x_accel, y_accel = df['x_accel'].values.astype(np.float64), df['y_accel'].values.astype(np.float64)
+    valid = np.isfinite(x_vel) & np.isfinite(y_vel) & np.isfinite(x_accel) & np.isfinite(y_accel)
+    x_vel, y_vel, x_accel, y_accel = x_vel[valid], y_vel[valid], x_accel[valid], y_accel[valid]
+
+    vel = np.hypot(x_vel, y_vel)
+    accel = np.hypot(x_accel, y_accel)
+    n_tracks = df['feature_id'].nunique()
+
+    values = {
+        'n_samples': len(vel),
+        'n_tracks': n_tracks,
+        'mean_track_length': len(df) / float(n_tracks) if n_tracks else np.nan,
+        'vel_phase_spread': circular_spread(np.arctan2(y_vel, x_vel)),
+        'accel_phase_spread': circular_spread(np.arctan2(y_accel, x_accel))
+    }
+    for q in (50, 90, 99):
+        values['vel_p%d' % q] = np.percentile(vel, q) if len(vel) else np.nan
+        values['accel_p%d' % q] = np.percentile(accel, q) if len(accel) else np.nan
+
+    for quantity, name in (('magnitude', 'hist_var'), ('phase', 'phase_hist_var')):
+        histogram = PhasePlaneHistogram.from_params(phase_plane_params, quantity)
+        filename = phase_plane_file(video_file, eye, quantity)
+        saved = PhasePlaneHistogram.load(filename) if os.path.isfile(filename) else None
+        if saved is not None and saved.compatible(histogram):
+            histogram = saved
+        else:
+            histogram.update(x_vel, y_vel, x_accel, y_accel)
+        values[name] = histogram.density().var()
+        if quantity == 'magnitude':
+            total = histogram.n_samples + histogram.n_outside
+            values['hist_outside'] = histogram.n_outside / float(total) if total else np.nan
+
+    return np.array([values[feature] for feature in FEATURES], dtype=np.float64)
+
+
+def compute_row(args):
+    """
+    Computes one row of the matrix (worker function). Any error is caught and reported in the result.
+    :param args: tuple (video_file, eye, signature, phase_plane_params)
+    :return: dict with the video, eye, signature, values (None if failed) and error
+    """
+    video_file, eye, signature, phase_plane_params = args
+    try:
+        values = subject_features(video_file, eye, phase_plane_params)
+        return {'video_file': video_file, 'eye': eye, 'signature': signature, 'values': values, 'error': None}
+    except Exception:
+        return {'video_file': video_file, 'eye': eye, 'signature': signature, 'values': None,
+                'error': traceback.format_exc()}
+
+
+def load_feature_matrix(dataset_folder, mmap=True):
+    """
+    Loads the feature matrix of a dataset.
+    :param dataset_folder: path to the dataset folder
+    :param mmap: memory-map the matrix instead of reading it into memory
+    :return: matrix (n_rows, n_features) and index (dict with 'features' and 'rows'). None, None if
+    there is no matrix
+    """
+    folder = os.path.join(dataset_folder, 'features')
+    matrix_file = os.path.join(folder, 'features.npy')
+    index_file = os.path.join(folder, 'subjects.json')
+    if not (os.path.isfile(matrix_file) and os.path.isfile(index_file)):
+        return None, None
+
+    with open(index_file, 'r') as json_file:
+        index = json.load(json_file)
+    return np.load(matrix_file, mmap_mode='r' if mmap else None), index
+
+
+def feature_table(dataset_folder):
+    """
+    Feature matrix of a dataset as a DataFrame (one row per subject/eye), e.g. for cohort queries:
+        df = feature_table(dataset_folder)
+        df[df['subject'].str.startswith('cp')].groupby('eye').mean()
+    :param dataset_folder: path to the dataset folder
+    :return: DataFrame with the columns subject (folder of the video, relative to the dataset folder),
+    video_file, eye and FEATURES
+    """
+    matrix, index = load_feature_matrix(dataset_folder)
+    if matrix is None:
+        raise IOError('No feature matrix in: %s' % dataset_folder)
+
+    df = pd.DataFrame(np.asarray(matrix), columns=index['features'])
+    df.insert(0, 'eye', [row['eye'] for row in index['rows']])
+    df.insert(0, 'video_file', [row['video_file'] for row in index['rows']])
+    df.insert(0, 'subject', [os.path.relpath(os.path.dirname(row['video_file']), dataset_folder)
+                             for row in index['rows']])
+    return df
+
+
+def build_feature_matrix(dataset_folder=None, n_workers=None):
+    """
+    Builds (or updates) the feature matrix of every video and eye with optical flow in a dataset.
+    :param dataset_folder: path to the dataset folder. If None, "dataset_folder" from params.json is used
+    :param n_workers: number of worker processes. If None, "features/n_workers" from params.json is used
+    (0 means one per CPU)
+    :return: matrix (memory-mapped) and index (see load_feature_matrix)
+    """
+    jf = get_config()
+    if dataset_folder is None:
+        dataset_folder = jf['dataset_folder']
+    if n_workers is None:
+        n_workers = jf['features']['n_workers']
+    extensions = jf['batch']['video_extensions']
+    phase_plane_params = jf['phase_plane']
+    opt_flow_csv = jf['opt_flow']['csv_file']
+
+    n_workers = n_workers or cpu_count()
+
+    # Rows of the previous matrix that are still valid (same features, optical flow and phase plane parameters)
+    matrix, index = load_feature_matrix(dataset_folder, mmap=False)
+    previous = {}
+    if matrix is not None and index['features'] == list(FEATURES):
+        previous = {(row['video_file'], row['eye']): (row['signature'], matrix[i])
+                    for i, row in enumerate(index['rows'])}
+
+    rows, tasks = [], []
+    for video_file in find_videos(dataset_folder, extensions):
+        for eye in EYES:
+            signature = source_signature(video_file, eye, opt_flow_csv, phase_plane_params)
+            if signature is None:
+                continue
+            old = previous.get((video_file, eye))
+            if old is not None and old[0] == signature:
+                rows.append({'video_file': video_file, 'eye': eye, 'signature': signature, 'values': old[1]})
+            else:
+                tasks.append((video_file, eye, signature, phase_plane_params))
+
+    logger.info('Feature matrix: %d rows up to date, %d to be computed' % (len(rows), len(tasks)))
+
+    if tasks:
+        pool = Pool(min(n_workers, len(tasks)))
+        try:
+            for result in pool.imap_unordered(compute_row, tasks):
+                if result['error'] is not None:
+                    logger.error('%s (%s eye)\n%s' % (result['video_file'], result['eye'], result['error']))
+                    continue
+                rows.append(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    rows.sort(key=lambda r: (r['video_file'], r['eye']))
+
+    # Save the matrix and its index
+    folder = os.path.join(dataset_folder, 'features')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    out = np.lib.format.open_memmap(os.path.join(folder, 'features.npy'), mode='w+', dtype=np.float64,
+                                    shape=(len(rows), len(FEATURES)))
+    for i, row in enumerate(rows):
+        out[i] = row['values']
+    out.flush()
+    del out
+
+    index = {'features': list(FEATURES),
+             'rows': [{'video_file': r['video_file'], 'eye': r['eye'], 'signature': r['signature']} for r in rows]}
+    with open(os.path.join(folder, 'subjects.json'), 'w') as json_file:
+        json.dump(index, json_file, indent=4)
+
+    logger.info('Feature matrix saved: %d rows x %d features' % (len(rows), len(FEATURES)))
+    return load_feature_matrix(dataset_folder)
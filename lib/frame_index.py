@@ -0,0 +1,236 @@
+"""
+FRAME INDEX
+@Description: Index of the frames of a video (presentation timestamp of each frame and whether it
+is a keyframe), probed once with ffprobe (only the packets are read, nothing is decoded) and cached
+next to the video:
+
+    [video folder]/frame_index.npz
+
+Setting cv2.CAP_PROP_POS_FRAMES is slow on long-GOP videos (e.g. GoPro MP4) and sometimes lands on
+the wrong frame. seek_capture jumps to the keyframe before the frame, grabs forward only the frames
+that are needed (no color conversion) and checks the timestamp of the landed position against the
+index. The index also gives the exact number of frames (cv2.CAP_PROP_FRAME_COUNT is an estimate).
+"""
+
+import os
+import json
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+from lib.config import get_config
+from lib.instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FILE = 'frame_index.npz'
+
+
+def frame_index_file(video_file):
+    """
+    :param video_file: path to the video
+    :return: path to the frame index of the video
+    """
+    return os.path.join(os.path.dirname(video_file), INDEX_FILE)
+
+
+def file_signature(filename):
+    """
+    :return: [size, mtime] of a file, None if it does not exist
+    """
+    if not os.path.isfile(filename):
+        return None
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime]
+
+
+def probe_video(video_file, ffprobe='ffprobe'):
+    """
+    Timestamps and keyframes of the frames of the first video stream (from its packets).
+    :param video_file: path to the video
+    :param ffprobe: path to the ffprobe executable
+    :return: array of timestamps (seconds from the start of the stream, as cv2.CAP_PROP_POS_MSEC) and
+    boolean array of keyframes, both in presentation order
+    """
+    output = subprocess.check_output([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                                      '-show_entries', 'stream=start_time:packet=pts_time,flags',
+                                      '-of', 'json', video_file])
+    data = json.loads(output.decode('utf-8'))
+
+    # Discarded packets (flag D, e.g. the pre-roll of an edit list) are not frames of the video
+    packets = [p for p in data.get('packets', [])
+               if p.get('pts_time', 'N/A') != 'N/A' and 'D' not in p.get('flags', '')]
+    if not packets:
+        raise ValueError('No video frames with timestamps in: %s' % video_file)
+
+    pts = np.array([float(p['pts_time']) for p in packets])
+    keyframes = np.array(['K' in p.get('flags', '') for p in packets])
+
+    # Packets are in decoding order (B-frames), frames are read in presentation order
+    order = np.argsort(pts, kind='stable')
+    streams = data.get('streams', [])
+    start_time = streams[0].get('start_time', 'N/A') if streams else 'N/A'
+    start_time = pts.min() if start_time == 'N/A' else float(start_time)
+    return pts[order] - start_time, keyframes[order]
+
+
+class VideoIndex(object):
+    """
+    Timestamps and keyframes of the frames of a video (frames are numbered from 0).
+    """
+
+    def __init__(self, pts, keyframes, signature=None):
+        """
+        :param pts: timestamp of each frame (seconds from the start of the stream)
+        :param keyframes: boolean array, True for the keyframes
+        :param signature: [size, mtime] of the video the index was built from (see file_signature)
+        """
+        self.pts = np.asarray(pts, dtype=np.float64)
+        self.keyframes = np.flatnonzero(keyframes)
+        self.signature = signature
+
+        # The first frame can always be decoded
+        if not len(self.keyframes) or self.keyframes[0] != 0:
+            self.keyframes = np.concatenate([[0], self.keyframes])
+
+    def __len__(self):
+        return len(self.pts)
+
+    @property
+    def frame_duration(self):
+        """
+        Median duration of a frame (seconds).
+        """
+        return float(np.median(np.diff(self.pts))) if len(self.pts) > 1 else 0.
+
+    def keyframe_before(self, frame):
+        """
+        :param frame: frame index
+        :return: last keyframe at or before the frame
+        """
+        i = np.searchsorted(self.keyframes, frame, side='right') - 1
+        return int(self.keyframes[max(i, 0)])
+
+    def matches(self, position_msec, frame):
+        """
+        Checks if a position of a capture (cv2.CAP_PROP_POS_MSEC) is the timestamp of a frame.
+        """
+        return abs(position_msec / 1e3 - self.pts[frame]) <= 0.5 * self.frame_duration
+
+    def save(self, filename):
+        # Written next to the final file and renamed, so other processes never load half an index
+        temp_file = '%s.%d.tmp' % (filename, os.getpid())
+        with open(temp_file, 'wb') as file_out:
+            np.savez(file_out, pts=self.pts, keyframes=self.keyframes,
+                     signature=np.array(self.signature or [], dtype=np.float64))
+        os.replace(temp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            keyframes = np.zeros(len(data['pts']), dtype=bool)
+            keyframes[data['keyframes']] = True
+            return cls(data['pts'], keyframes, data['signature'].tolist() or None)
+
+
+def load_video_index(video_file):
+    """
+    Loads the frame index of a video, probing the video the first time (or if it has changed).
+    Disabled with "reader/frame_index" in params.json.
+    :param video_file: path to the video
+    :return: VideoIndex, None if it is disabled, the video is not a file (e.g. a camera) or it
+    cannot be probed
+    """
+    params = get_config()['reader']
+    if not params['frame_index'] or not isinstance(video_file, str) or not os.path.isfile(video_file):
+        return None
+
+    filename = frame_index_file(video_file)
+    signature = file_signature(video_file)
+    if os.path.isfile(filename):
+        index = VideoIndex.load(filename)
+        if index.signature == signature:
+            return index
+
+    if shutil.which(params['ffprobe']) is None:
+        logger.warning('ffprobe not found (%s), seeking with OpenCV' % params['ffprobe'])
+        return None
+
+    logger.info('Indexing frames: %s' % video_file)
+    try:
+        pts, keyframes = probe_video(video_file, params['ffprobe'])
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.warning('Cannot index the frames of %s (seeking with OpenCV): %s' % (video_file, e))
+        return None
+
+    index = VideoIndex(pts, keyframes, signature)
+    index.save(filename)
+    logger.info('Frame index saved: %d frames, %d keyframes' % (len(index), len(index.keyframes)))
+    return index
+
+
+def video_frame_count(video_file):
+    """
+    Number of frames of a video: from the frame index (see load_video_index) if there is one,
+    otherwise the estimate of OpenCV.
+    :param video_file: path to the video
+    :return: number of frames
+    """
+    index = load_video_index(video_file)
+    if index is not None:
+        return len(index)
+
+    cap = cv2.VideoCapture(video_file)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frame_count
+
+
+def grab_frames(cap, n):
+    """
+    Decodes n frames without retrieving them.
+    :return: False if the video ends before
+    """
+    for _ in range(n):
+        if not cap.grab():
+            return False
+    return True
+
+
+def seek_capture(cap, index, frame, max_attempts=2):
+    """
+    Moves a capture so that the next read returns a frame (as setting cv2.CAP_PROP_POS_FRAMES to
+    the frame). The capture jumps to the keyframe before the previous frame and grabs forward up to
+    it, then the timestamp of the capture is checked against the index. If it does not match, it is
+    retried from an earlier keyframe and finally the video is decoded from the beginning.
+    :param cap: cv2.VideoCapture
+    :param index: VideoIndex of the video
+    :param frame: frame to be read next (from 0)
+    :param max_attempts: number of keyframes tried
+    :return: True if the landed position was validated
+    """
+    frame = min(int(frame), len(index))
+    if frame <= 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return True
+
+    # The previous frame is grabbed: its timestamp tells where the capture landed
+    target = frame - 1
+    key = index.keyframe_before(target)
+    for _ in range(max_attempts):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+        if grab_frames(cap, target - key + 1) and index.matches(cap.get(cv2.CAP_PROP_POS_MSEC), target):
+            return True
+        logger.debug('Seek to frame %d from keyframe %d landed at %.3f s (expected %.3f s)'
+                     % (frame, key, cap.get(cv2.CAP_PROP_POS_MSEC) / 1e3, index.pts[target]))
+        if key == 0:
+            break
+        key = index.keyframe_before(key - 1)
+
+    logger.warning('Cannot seek to frame %d, decoding from the beginning of the video' % frame)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    if not grab_frames(cap, frame):
+        raise IOError('Cannot seek to frame %d' % frame)
+    return index.matches(cap.get(cv2.CAP_PROP_POS_MSEC), target)
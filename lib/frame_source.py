@@ -0,0 +1,389 @@
+"""
+FRAME SOURCE
+@Description: Reads the frames of a video in a background thread, so decoding overlaps with
+the processing of the previous frames. The frames are cropped to the regions of interest and
+converted to gray scale in the same thread, and queued (bounded queue) together with their
+frame index.
+
+Two backends (see open_reader and "reader/backend" in params.json):
+- opencv: cv2.VideoCapture decodes full BGR frames, which are cropped and converted in Python (FrameReader)
+- ffmpeg: an ffmpeg process crops the region that contains the ROIs and converts it to gray while
+  decoding, and the raw frames are read from its output into preallocated buffers (FfmpegReader).
+  Only the pixels of the ROIs are copied and converted, instead of the whole color frame
+Both backends seek with the frame index of the video when there is one (see lib/frame_index.py).
+"""
+
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from lib.config import get_config
+from lib.frame_index import load_video_index, seek_capture
+from lib.instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+
+class FrameReader(object):
+    """
+    Prefetching frame reader for cv2.VideoCapture.
+    Usage:
+        reader = FrameReader(video_file, rois={'left_eye': {'x_min': 0, 'x_max': 10, 'y_min': 0, 'y_max': 10}})
+        for frame_index, crops, frame in reader:
+            left_eye_gray = crops['left_eye']
+        reader.close()
+
+    The frame index is the position of the capture after reading the frame (as given by
+    cv2.CAP_PROP_POS_FRAMES, corrected with the frame index of the video after seeking). If no ROIs
+    are given, the whole gray frame is returned in crops['frame'].
+    """
+
+    def __init__(self, video_file, rois=None, start=None, stop=None, queue_size=32,
+                 color_conversion=cv2.COLOR_BGR2GRAY, keep_frame=False, max_failed_reads=100, roi_track=None,
+                 timer=None, index=None):
+        """
+        :param video_file: path to the video (or camera index)
+        :param rois: dict {name: {'x_min', 'x_max', 'y_min', 'y_max'}} of the regions to be cropped
+        :param roi_track: RoiTrack (see lib/roi_tracking.py) with the regions per frame. If given,
+        it replaces the boundaries in rois (only the names of the regions are used)
+        :param start: frame to start reading from (None to start at the beginning)
+        :param stop: index of the last frame to be read (None to read until the end of the video)
+        :param queue_size: number of frames decoded in advance
+        :param color_conversion: cv2 color conversion code applied to each crop
+        :param keep_frame: also return the original (color) frame, e.g. for visualization. Otherwise None
+        :param max_failed_reads: consecutive frames that cannot be read before stopping
+        :param timer: StageTimer (see lib/instrumentation.py) where the seek, decode, crop and cvtColor
+        times are added (None to disable)
+        :param index: VideoIndex used to seek to start (see lib/frame_index.py). If None, the cached
+        index of the video is loaded (OpenCV seeks if there is none)
+        """
+        self.video_file = video_file
+        self.stop = stop
+        self.rois = rois
+        self.roi_track = roi_track
+        self.color_conversion = color_conversion
+        self.keep_frame = keep_frame
+        self.max_failed_reads = max_failed_reads
+        self.timer = timer
+
+        self.cap = cv2.VideoCapture(video_file)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.frame_width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.frame_height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+        # Difference between the frame numbers of the index and the ones of OpenCV
+        self._offset = 0
+        if start:
+            seek_start = time.perf_counter()
+            index = index or load_video_index(video_file)
+            if index is not None:
+                self.frame_count = len(index)
+                seek_capture(self.cap, index, start)
+                self._offset = int(start) - self.cap.get(cv2.CAP_PROP_POS_FRAMES)
+            else:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            if self.timer is not None:
+                self.timer.add('seek', time.perf_counter() - seek_start)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='frame_reader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stops the reading thread and releases the capture. It can be called more than once.
+        """
+        self._stop.set()
+
+        # Unblock the reading thread
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self._thread.join()
+        self.cap.release()
+
+    def _crop(self, frame, frame_index):
+        if self.rois is None:
+            return {'frame': self._convert(frame)}
+
+        crops = {}
+        for name, roi in self.rois.items():
+            start = time.perf_counter()
+            if self.roi_track is not None:
+                roi = self.roi_track.roi(name, frame_index)
+            crop = frame[roi['y_min']: roi['y_max'], roi['x_min']: roi['x_max']]
+            if self.timer is not None:
+                self.timer.add('crop', time.perf_counter() - start)
+            crops[name] = self._convert(crop)
+        return crops
+
+    def _convert(self, img):
+        start = time.perf_counter()
+        img = cv2.cvtColor(img, self.color_conversion)
+        if self.timer is not None:
+            self.timer.add('cvtColor', time.perf_counter() - start)
+        return img
+
+    def _put(self, item):
+        # Wait for room in the queue (unless the reader is stopped)
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            failed_reads = 0
+            while not self._stop.is_set() and self.cap.isOpened():
+                start = time.perf_counter()
+                ret, frame = self.cap.read()
+                if self.timer is not None:
+                    self.timer.add('decode', time.perf_counter() - start)
+                frame_index = self.cap.get(cv2.CAP_PROP_POS_FRAMES) + self._offset
+
+                if not ret:
+                    # If there is no frame, finish (unless it is a broken frame in the middle of the video)
+                    failed_reads += 1
+                    if frame_index >= self.frame_count or failed_reads >= self.max_failed_reads:
+                        break
+                    continue
+                failed_reads = 0
+
+                item = (frame_index, self._crop(frame, frame_index), frame if self.keep_frame else None)
+                if not self._put(item):
+                    break
+
+                if self.stop is not None and frame_index >= self.stop:
+                    break
+        except Exception as e:
+            self._put(e)
+        self._put(None)
+
+
+class FfmpegReader(FrameReader):
+    """
+    Prefetching frame reader that decodes with an ffmpeg process (same usage and items as FrameReader).
+    ffmpeg crops the bounding box of the ROIs (of every frame if there is a ROI track) and converts it
+    to gray (luma, full range) while decoding. Each raw frame is read into one of a ring of preallocated
+    buffers and the ROIs are returned as views of the buffer (no copy). A buffer is reused queue_size + 3
+    frames later: the crops of a frame can be kept while the next frame is processed (e.g. the previous
+    frame of the optical flow), but they must be copied to be kept longer.
+    The original frame is not available (keep_frame), and the frames are always converted to gray.
+    """
+
+    def __init__(self, video_file, rois=None, start=None, stop=None, queue_size=32, roi_track=None, timer=None,
+                 index=None, ffmpeg='ffmpeg'):
+        """
+        :param video_file: path to the video
+        :param rois: dict {name: {'x_min', 'x_max', 'y_min', 'y_max'}} of the regions to be cropped
+        :param roi_track: RoiTrack (see lib/roi_tracking.py) with the regions per frame. If given,
+        it replaces the boundaries in rois (only the names of the regions are used)
+        :param start: frame to start reading from (None to start at the beginning)
+        :param stop: index of the last frame to be read (None to read until the end of the video)
+        :param queue_size: number of frames decoded in advance
+        :param timer: StageTimer (see lib/instrumentation.py) where the decode and crop times are
+        added (None to disable)
+        :param index: VideoIndex with the timestamps of the frames (see lib/frame_index.py). If None,
+        the cached index of the video is loaded (the timestamp is estimated from the fps if there is none)
+        :param ffmpeg: path to the ffmpeg executable
+        """
+        self.video_file = video_file
+        self.stop = stop
+        self.rois = rois
+        self.roi_track = roi_track
+        self.timer = timer
+
+        # Properties of the video (same as FrameReader)
+        cap = cv2.VideoCapture(video_file)
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.frame_width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.frame_height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        cap.release()
+        if not self.frame_width or not self.frame_height:
+            raise IOError('Cannot open the video: %s' % video_file)
+
+        self.box = self._bounding_box()
+        x_min, x_max, y_min, y_max = self.box
+        self._buffers = [np.empty((y_max - y_min, x_max - x_min), np.uint8) for _ in range(queue_size + 3)]
+
+        # First frame: the frame after start (as cv2.CAP_PROP_POS_FRAMES)
+        self._frame_index = 0
+        command = [ffmpeg, '-nostdin', '-loglevel', 'error']
+        if start:
+            # Half a frame before the timestamp of the frame (ffmpeg decodes from the keyframe before it)
+            index = index or load_video_index(video_file)
+            if index is not None:
+                self.frame_count = len(index)
+                position = index.pts[min(int(start), len(index) - 1)] - 0.5 * index.frame_duration
+            elif self.fps:
+                position = (start - 0.5) / self.fps
+            else:
+                raise IOError('Unknown frame rate, cannot seek: %s' % video_file)
+            command += ['-ss', '%.6f' % max(position, 0.)]
+            self._frame_index = int(start)
+        command += ['-i', video_file, '-an', '-sn', '-vsync', 'passthrough',
+                    '-vf', 'crop=%d:%d:%d:%d:exact=1,scale=out_range=full,format=gray'
+                    % (x_max - x_min, y_max - y_min, x_min, y_min),
+                    '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1']
+
+        # Unbuffered output (frames are read directly into the buffers), errors to a file (a pipe could fill up)
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self._stderr, bufsize=0)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ffmpeg_reader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _bounding_box(self):
+        """
+        Region of the frame that contains every ROI (of every frame of the ROI track).
+        :return: (x_min, x_max, y_min, y_max)
+        """
+        width, height = int(self.frame_width), int(self.frame_height)
+        if self.rois is None:
+            return 0, width, 0, height
+
+        if self.roi_track is not None:
+            boxes = np.concatenate([self.roi_track.boxes[name] for name in self.rois])
+        else:
+            boxes = np.array([[roi['x_min'], roi['x_max'], roi['y_min'], roi['y_max']] for roi in self.rois.values()])
+        return (max(int(boxes[:, 0].min()), 0), min(int(boxes[:, 1].max()), width),
+                max(int(boxes[:, 2].min()), 0), min(int(boxes[:, 3].max()), height))
+
+    def close(self):
+        """
+        Stops the reading thread and the ffmpeg process. It can be called more than once.
+        """
+        self._stop.set()
+        if self._process.poll() is None:
+            self._process.kill()
+
+        # Unblock the reading thread
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self._thread.join()
+        self._process.wait()
+        self._process.stdout.close()
+        self._stderr.close()
+
+    def _crop(self, frame, frame_index):
+        if self.rois is None:
+            return {'frame': frame}
+
+        x_min, _, y_min, _ = self.box
+        crops = {}
+        for name, roi in self.rois.items():
+            start = time.perf_counter()
+            if self.roi_track is not None:
+                roi = self.roi_track.roi(name, frame_index)
+            crops[name] = frame[roi['y_min'] - y_min: roi['y_max'] - y_min, roi['x_min'] - x_min: roi['x_max'] - x_min]
+            if self.timer is not None:
+                self.timer.add('crop', time.perf_counter() - start)
+        return crops
+
+    def _read_into(self, buffer):
+        """
+        Reads a raw frame from ffmpeg.
+        :return: False at the end of the video
+        """
+        view = memoryview(buffer).cast('B')
+        n = 0
+        while n < len(view):
+            read = self._process.stdout.readinto(view[n:])
+            if not read:
+                return False
+            n += read
+        return True
+
+    def _run(self):
+        try:
+            i = 0
+            while not self._stop.is_set():
+                buffer = self._buffers[i % len(self._buffers)]
+                i += 1
+
+                start = time.perf_counter()
+                ret = self._read_into(buffer)
+                if self.timer is not None:
+                    self.timer.add('decode', time.perf_counter() - start)
+                if not ret:
+                    if self._process.wait() != 0 and not self._stop.is_set():
+                        self._stderr.seek(0)
+                        raise IOError('ffmpeg failed to decode %s: %s'
+                                      % (self.video_file, self._stderr.read().decode('utf-8', 'replace').strip()))
+                    break
+
+                self._frame_index += 1
+                frame_index = self._frame_index
+                if not self._put((frame_index, self._crop(buffer, frame_index), None)):
+                    break
+
+                if self.stop is not None and frame_index >= self.stop:
+                    break
+        except Exception as e:
+            self._put(e)
+        self._put(None)
+
+
+def open_reader(video_file, rois=None, backend=None, queue_size=32, color_conversion=cv2.COLOR_BGR2GRAY,
+                keep_frame=False, **kwargs):
+    """
+    Frame reader of the configured backend ("reader/backend" in params.json: 'opencv' or 'ffmpeg').
+    The ffmpeg backend only converts to gray and does not return the original frame: FrameReader is
+    used for other color conversions, when keep_frame is set or if ffmpeg is not installed.
+    :param video_file: path to the video
+    :param rois: dict {name: {'x_min', 'x_max', 'y_min', 'y_max'}} of the regions to be cropped
+    :param backend: 'opencv' or 'ffmpeg'. If None, "reader/backend" from params.json is used
+    :param kwargs: start, stop, roi_track, timer (see FrameReader)
+    :return: FrameReader or FfmpegReader
+    """
+    params = get_config()['reader']
+    backend = backend or params['backend']
+    if backend not in ('opencv', 'ffmpeg'):
+        raise ValueError('Unknown reader backend "%s" (opencv or ffmpeg)' % backend)
+
+    if backend == 'ffmpeg' and color_conversion == cv2.COLOR_BGR2GRAY and not keep_frame:
+        if shutil.which(params['ffmpeg']) is not None:
+            return FfmpegReader(video_file, rois=rois, queue_size=queue_size, ffmpeg=params['ffmpeg'], **kwargs)
+        logger.warning('ffmpeg not found (%s), decoding with OpenCV' % params['ffmpeg'])
+
+    return FrameReader(video_file, rois=rois, queue_size=queue_size, color_conversion=color_conversion,
+                       keep_frame=keep_frame, **kwargs)
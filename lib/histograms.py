@@ -0,0 +1,186 @@
+"""
+HISTOGRAMS
+@Description: Phase plane histograms (velocity vs acceleration) with fixed bins. The bin edges come
+from params.json ("phase_plane"), so the histograms of every eye, subject and cohort are on the
+same grid and can be merged by adding their counts. They are updated chunk by chunk (no need to
+keep the samples in memory, e.g. frame by frame in the live mode, see lib/streaming.py) and saved as
+compressed *.npz files:
+
+    [video folder]/optical_flow/left_eye_phase_plane_magnitude.npz
+    [video folder]/optical_flow/left_eye_phase_plane_phase.npz
+
+Quantities:
+    'magnitude' : |velocity| vs |acceleration| (pixels/s, pixels/s^2)
+    'phase'     : direction of the velocity vs direction of the acceleration (radians, [-pi, pi])
+"""
+
+import os
+
+import numpy as np
+
+QUANTITIES = ('magnitude', 'phase')
+
+
+def phase_plane_edges(params, quantity='magnitude'):
+    """
+    Bin edges of a phase plane.
+    :param params: phase plane parameters (see "phase_plane" in params.json)
+    :param quantity: 'magnitude' or 'phase'
+    :return: velocity edges, acceleration edges
+    """
+    if quantity == 'magnitude':
+        return np.linspace(*params['vel_mag']), np.linspace(*params['accel_mag'])
+    elif quantity == 'phase':
+        edges = np.linspace(-np.pi, np.pi, params['phase_bins'] + 1)
+        return edges, edges.copy()
+    raise ValueError('Unknown quantity "%s". It must be one of: %s' % (quantity, ', '.join(QUANTITIES)))
+
+
+class PhasePlaneHistogram(object):
+    """
+    Fixed-bin velocity/acceleration histogram.
+    Usage:
+        hist = PhasePlaneHistogram.from_params(jf['phase_plane'])
+        for df in chunks:
+            hist.update(df['x_vel'], df['y_vel'], df['x_accel'], df['y_accel'])
+        cohort = PhasePlaneHistogram.merge([hist_1, hist_2])
+    """
+
+    def __init__(self, vel_edges, accel_edges, quantity='magnitude', counts=None, n_outside=0):
+        """
+        :param vel_edges: bin edges of the velocity (increasing)
+        :param accel_edges: bin edges of the acceleration (increasing)
+        :param quantity: 'magnitude' or 'phase'
+        :param counts: initial counts (zeros if None)
+        :param n_outside: number of samples out of the edges
+        """
+        if quantity not in QUANTITIES:
+            raise ValueError('Unknown quantity "%s". It must be one of: %s' % (quantity, ', '.join(QUANTITIES)))
+
+        self.vel_edges = np.asarray(vel_edges, dtype=np.float64)
+        self.accel_edges = np.asarray(accel_edges, dtype=np.float64)
+        self.quantity = quantity
+
+        shape = (len(self.vel_edges) - 1, len(self.accel_edges) - 1)
+        self.counts = np.zeros(shape, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.n_outside = int(n_outside)
+
+    @classmethod
+    def from_params(cls, params, quantity='magnitude'):
+        """
+        :param params: phase plane parameters (see "phase_plane" in params.json)
+        :param quantity: 'magnitude' or 'phase'
+        """
+        vel_edges, accel_edges = phase_plane_edges(params, quantity)
+        return cls(vel_edges, accel_edges, quantity)
+
+    @property
+    def n_samples(self):
+        return int(self.counts.sum())
+
+    def update(self, x_vel, y_vel, x_accel, y_accel):
+        """
+        Adds samples to the histogram (samples with NaN are ignored).
+        :param x_vel: x velocity of each sample
+        :param y_vel: y velocity of each sample
+        :param x_accel: x acceleration of each sample
+        :param y_accel: y acceleration of each sample
+        :return: self
+        """
+        x_vel, y_vel = np.asarray(x_vel, dtype=np.float64), np.asarray(y_vel, dtype=np.float64)
+        x_accel, y_accel = np.asarray(x_accel, dtype=np.float64), np.asarray(y_accel, dtype=np.float64)
+
+        if self.quantity == 'magnitude':
+            vel, accel = np.hypot(x_vel, y_vel), np.hypot(x_accel, y_accel)
+        else:
+            vel, accel = np.arctan2(y_vel, x_vel), np.arctan2(y_accel, x_accel)
+
+        valid = np.isfinite(vel) & np.isfinite(accel)
+        vel, accel = vel[valid], accel[valid]
+
+        # Bin of each sample (the last edge is included in the last bin, as in np.histogram2d)
+        i = np.searchsorted(self.vel_edges, vel, side='right') - 1
+        j = np.searchsorted(self.accel_edges, accel, side='right') - 1
+        i[vel == self.vel_edges[-1]] -= 1
+        j[accel == self.accel_edges[-1]] -= 1
+
+        n_vel, n_accel = self.counts.shape
+        inside = (i >= 0) & (i < n_vel) & (j >= 0) & (j < n_accel)
+        self.n_outside += int(len(inside) - inside.sum())
+
+        self.counts += np.bincount(i[inside] * n_accel + j[inside], minlength=n_vel * n_accel).reshape(n_vel, n_accel)
+        return self
+
+    def update_df(self, df, chunk_size=1000000):
+        """
+        Adds the samples of a DataFrame of tracks (x_vel, y_vel, x_accel, y_accel) chunk by chunk.
+        :param df: DataFrame of tracks (e.g. memory-mapped, see lib/track_store.py)
+        :param chunk_size: number of samples per chunk
+        :return: self
+        """
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start: start + chunk_size]
+            self.update(chunk['x_vel'].values, chunk['y_vel'].values,
+                        chunk['x_accel'].values, chunk['y_accel'].values)
+        return self
+
+    def compatible(self, other):
+        return (self.quantity == other.quantity and np.array_equal(self.vel_edges, other.vel_edges)
+                and np.array_equal(self.accel_edges, other.accel_edges))
+
+    def __iadd__(self, other):
+        if not self.compatible(other):
+            raise ValueError('Phase plane histograms with different bins cannot be merged')
+        self.counts += other.counts
+        self.n_outside += other.n_outside
+        return self
+
+    @classmethod
+    def merge(cls, histograms):
+        """
+        Merges histograms with the same bins (e.g. both eyes, or every subject of a cohort).
+        :param histograms: list of PhasePlaneHistogram
+        :return: new PhasePlaneHistogram
+        """
+        histograms = list(histograms)
+        if not histograms:
+            raise ValueError('No histograms to merge')
+
+        merged = cls(histograms[0].vel_edges, histograms[0].accel_edges, histograms[0].quantity)
+        for histogram in histograms:
+            merged += histogram
+        return merged
+
+    def density(self):
+        """
+        :return: counts normalized to sum 1 (comparable between subjects with a different number of samples)
+        """
+        total = self.counts.sum()
+        return self.counts / float(total) if total else self.counts.astype(np.float64)
+
+    def variance(self):
+        """
+        :return: variance of the counts (spread of the phase plane)
+        """
+        return self.counts.var()
+
+    def save(self, filename):
+        np.savez_compressed(filename, counts=self.counts, vel_edges=self.vel_edges, accel_edges=self.accel_edges,
+                            quantity=self.quantity, n_outside=self.n_outside)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['vel_edges'], data['accel_edges'], str(data['quantity']), data['counts'],
+                       int(data['n_outside']))
+
+
+def phase_plane_file(video_file, eye, quantity='magnitude'):
+    """
+    :param video_file: path to the video
+    :param eye: 'left' or 'right'
+    :param quantity: 'magnitude' or 'phase'
+    :return: path to the phase plane histogram of an eye
+    """
+    return os.path.join(os.path.dirname(video_file), 'optical_flow',
+                        '%s_eye_phase_plane_%s.npz' % (eye, quantity))
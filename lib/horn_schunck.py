@@ -0,0 +1,168 @@
+"""
+HORN-SCHUNCK
+@Description: Dense optical flow (Horn-Schunck) for small images such as the eye ROIs.
+Coarse-to-fine (image pyramid): at each level the next frame is warped with the flow of the
+coarser levels and the flow increment is solved with Jacobi iterations. Derivatives and
+neighbourhood averages are convolutions, and every buffer (float32) is allocated once and
+reused for all the frames.
+"""
+
+import cv2
+import numpy as np
+
+# Weighted average of the neighbours (Horn and Schunck, 1981)
+AVERAGING_KERNEL = np.array([[1 / 12., 1 / 6., 1 / 12.],
+                             [1 / 6., 0., 1 / 6.],
+                             [1 / 12., 1 / 6., 1 / 12.]], dtype=np.float32)
+
+# Central differences
+DX_KERNEL = np.array([[-0.5, 0., 0.5]], dtype=np.float32)
+DY_KERNEL = DX_KERNEL.T.copy()
+
+BUFFERS = ('prev', 'next', 'warped', 'avg', 'Ix', 'Iy', 'It', 'denom', 'tmp', 'common',
+           'u', 'v', 'du', 'dv', 'du_avg', 'dv_avg', 'map_x', 'map_y')
+
+
+class HornSchunck(object):
+    """
+    Horn-Schunck optical flow between consecutive frames of the same size.
+    Usage:
+        hs = HornSchunck(roi_shape)
+        for gray in frames:
+            flow = hs.update(gray)  # (u, v) with respect to the previous frame (None for the first one)
+    """
+
+    def __init__(self, shape, alpha=15., n_iter=20, levels=3):
+        """
+        :param shape: shape of the frames (height, width)
+        :param alpha: weight of the smoothness term (intensity units, frames in [0, 255])
+        :param n_iter: Jacobi iterations per pyramid level
+        :param levels: number of pyramid levels
+        """
+        self.shape = tuple(shape)
+        self.alpha2 = np.float32(alpha ** 2)
+        self.n_iter = n_iter
+        self.has_prev = False
+
+        # Buffers per level (level 0 is the full resolution)
+        self.levels = []
+        h, w = self.shape
+        for level in range(levels):
+            if level > 0 and min(h, w) < 8:
+                break
+            buffers = {name: np.zeros((h, w), dtype=np.float32) for name in BUFFERS}
+            buffers['grid_x'], buffers['grid_y'] = np.meshgrid(np.arange(w, dtype=np.float32),
+                                                               np.arange(h, dtype=np.float32))
+            self.levels.append(buffers)
+            h, w = (h + 1) // 2, (w + 1) // 2
+
+    def _pyramid(self, gray, key):
+        np.copyto(self.levels[0][key], gray)
+        for upper, lower in zip(self.levels[:-1], self.levels[1:]):
+            h, w = lower[key].shape
+            cv2.pyrDown(upper[key], dst=lower[key], dstsize=(w, h))
+
+    def update(self, gray):
+        """
+        Flow from the previous frame to this one.
+        :param gray: gray frame (uint8 or float) with the shape given to the constructor
+        :return: u, v (views of internal buffers, valid until the next update) or None for the first frame
+        """
+        if gray.shape != self.shape:
+            raise ValueError('Frame shape %s does not match %s' % (gray.shape, self.shape))
+
+        self._pyramid(gray, 'next')
+        if not self.has_prev:
+            self.has_prev = True
+            self._swap()
+            return None
+
+        for i in range(len(self.levels) - 1, -1, -1):
+            b = self.levels[i]
+
+            # Initial flow: upsampled flow of the coarser level
+            if i == len(self.levels) - 1:
+                b['u'].fill(0)
+                b['v'].fill(0)
+            else:
+                h, w = b['u'].shape
+                coarse = self.levels[i + 1]
+                cv2.resize(coarse['u'], (w, h), dst=b['u'], interpolation=cv2.INTER_LINEAR)
+                cv2.resize(coarse['v'], (w, h), dst=b['v'], interpolation=cv2.INTER_LINEAR)
+                b['u'] *= 2
+                b['v'] *= 2
+
+            self._solve_level(b)
+
+        self._swap()
+        return self.levels[0]['u'], self.levels[0]['v']
+
+    def _solve_level(self, b):
+        # Warp the next frame with the current flow
+        np.add(b['grid_x'], b['u'], out=b['map_x'])
+        np.add(b['grid_y'], b['v'], out=b['map_y'])
+        cv2.remap(b['next'], b['map_x'], b['map_y'], cv2.INTER_LINEAR, dst=b['warped'],
+                  borderMode=cv2.BORDER_REPLICATE)
+
+        # Derivatives
+        np.add(b['prev'], b['warped'], out=b['avg'])
+        b['avg'] *= 0.5
+        cv2.filter2D(b['avg'], cv2.CV_32F, DX_KERNEL, dst=b['Ix'], borderType=cv2.BORDER_REPLICATE)
+        cv2.filter2D(b['avg'], cv2.CV_32F, DY_KERNEL, dst=b['Iy'], borderType=cv2.BORDER_REPLICATE)
+        np.subtract(b['warped'], b['prev'], out=b['It'])
+
+        # alpha^2 + Ix^2 + Iy^2
+        np.multiply(b['Ix'], b['Ix'], out=b['denom'])
+        np.multiply(b['Iy'], b['Iy'], out=b['tmp'])
+        b['denom'] += b['tmp']
+        b['denom'] += self.alpha2
+
+        # Jacobi iterations for the flow increment
+        b['du'].fill(0)
+        b['dv'].fill(0)
+        for _ in range(self.n_iter):
+            cv2.filter2D(b['du'], cv2.CV_32F, AVERAGING_KERNEL, dst=b['du_avg'], borderType=cv2.BORDER_REPLICATE)
+            cv2.filter2D(b['dv'], cv2.CV_32F, AVERAGING_KERNEL, dst=b['dv_avg'], borderType=cv2.BORDER_REPLICATE)
+
+            # common = (Ix * du_avg + Iy * dv_avg + It) / denom
+            np.multiply(b['Ix'], b['du_avg'], out=b['common'])
+            np.multiply(b['Iy'], b['dv_avg'], out=b['tmp'])
+            b['common'] += b['tmp']
+            b['common'] += b['It']
+            b['common'] /= b['denom']
+
+            # du = du_avg - Ix * common, dv = dv_avg - Iy * common
+            np.multiply(b['Ix'], b['common'], out=b['tmp'])
+            np.subtract(b['du_avg'], b['tmp'], out=b['du'])
+            np.multiply(b['Iy'], b['common'], out=b['tmp'])
+            np.subtract(b['dv_avg'], b['tmp'], out=b['dv'])
+
+        b['u'] += b['du']
+        b['v'] += b['dv']
+
+    def _swap(self):
+        # The current frame is the previous one of the next update
+        for b in self.levels:
+            b['prev'], b['next'] = b['next'], b['prev']
+
+
+def flow_summary(u, v, n_bins=8):
+    """
+    Mean and dominant flow vectors of a dense flow field. The dominant vector is the mean of the
+    vectors in the direction bin with the largest total magnitude.
+    :param u: horizontal flow
+    :param v: vertical flow
+    :param n_bins: number of direction bins
+    :return: (mean_u, mean_v), (dominant_u, dominant_v)
+    """
+    mean = (float(u.mean()), float(v.mean()))
+
+    magnitude = np.sqrt(u * u + v * v).ravel()
+    direction = np.arctan2(v, u).ravel()
+    bins = ((direction + np.pi) * (n_bins / (2 * np.pi))).astype(np.int32) % n_bins
+    weights = np.bincount(bins, weights=magnitude, minlength=n_bins)
+
+    selected = bins == np.argmax(weights)
+    if weights.max() == 0 or not selected.any():
+        return mean, (0., 0.)
+    return mean, (float(u.ravel()[selected].mean()), float(v.ravel()[selected].mean()))
@@ -0,0 +1,221 @@
+"""
+INSTRUMENTATION
+@Description: Logging and timing of the processing stages.
+- get_logger: leveled logging for the modules of lib (level from "instrumentation/log_level" in
+  params.json) instead of prints.
+- StageTimer: accumulated time per section of the hot path (decode, crop, cvtColor, lk, ...) and
+  histogram of the processing time per frame. Sections can be timed from several threads (e.g.
+  decoding in FrameReader).
+- Profiler: optional cProfile / tracemalloc hooks (see "instrumentation" in params.json).
+The timings of a run are saved as a JSON report next to the outputs of the stage ([stage]_report.json).
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from lib.config import get_config
+
+# Bins of the frame time histogram (seconds): 10 us to 10 s, log spaced
+LATENCY_EDGES = np.logspace(-5, 1, 61)
+
+REPORT_FILE = '%s_report.json'
+
+
+def load_instrumentation_params():
+    return get_config()['instrumentation']
+
+
+def get_logger(name):
+    """
+    Logger of a module. The first call sets up the handler of the "lib" logger.
+    :param name: name of the module (__name__)
+    :return: logging.Logger
+    """
+    base = logging.getLogger('lib')
+    if not base.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('[  %(levelname)s  ] %(message)s'))
+        base.addHandler(handler)
+        base.setLevel(load_instrumentation_params()['log_level'])
+        base.propagate = False
+    return logging.getLogger(name)
+
+
+class StageTimer(object):
+    """
+    Time spent per section and per frame.
+    Usage:
+        timer = StageTimer('optical_flow')
+        for frame in frames:
+            with timer.frame():
+                with timer.section('lk'):
+                    ...
+        timer.write_report(folder)
+    """
+
+    def __init__(self, stage):
+        """
+        :param stage: name of the stage (e.g. 'optical_flow')
+        """
+        self.stage = stage
+        self.sections = {}
+        self.frame_times = np.zeros(len(LATENCY_EDGES) + 1, dtype=np.int64)  # + under/overflow bins
+        self.n_frames = 0
+        self.start_time = time.time()
+        self.extra = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        """
+        Adds time to a section.
+        """
+        with self._lock:
+            total, n = self.sections.get(name, (0., 0))
+            self.sections[name] = (total + seconds, n + count)
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    @contextmanager
+    def frame(self):
+        """
+        Times the processing of one frame (added to the frame time histogram).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_frame(time.perf_counter() - start)
+
+    def add_frame(self, seconds):
+        with self._lock:
+            self.frame_times[np.searchsorted(LATENCY_EDGES, seconds, side='right')] += 1
+            self.n_frames += 1
+
+    def frame_percentile(self, q):
+        """
+        Percentile of the frame time (upper edge of the bin, seconds).
+        """
+        if self.n_frames == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.frame_times), q / 100. * self.n_frames, side='left'))
+        return float(LATENCY_EDGES[min(i, len(LATENCY_EDGES) - 1)])
+
+    def report(self):
+        """
+        :return: dict with the wall time, time per section (total, count and mean) and frame times
+        """
+        wall_time = time.time() - self.start_time
+        return {
+            'stage': self.stage,
+            'wall_time': wall_time,
+            'n_frames': self.n_frames,
+            'fps': self.n_frames / wall_time if wall_time > 0 else 0.,
+            'sections': {name: {'total': total, 'count': n, 'mean': total / n if n else 0.}
+                         for name, (total, n) in sorted(self.sections.items())},
+            'frame_time': {
+                'p50': self.frame_percentile(50), 'p95': self.frame_percentile(95), 'p99': self.frame_percentile(99),
+                'histogram': {'edges': LATENCY_EDGES.tolist(), 'counts': self.frame_times.tolist()}
+            },
+            'extra': self.extra
+        }
+
+    def write_report(self, folder):
+        """
+        Saves the report in "[stage]_report.json" inside a folder (the output folder of the stage).
+        :return: path to the report
+        """
+        report = self.report()
+        filename = os.path.join(folder, REPORT_FILE % self.stage)
+        with open(filename, 'w') as json_file:
+            json.dump(report, json_file, sort_keys=True, indent=4)
+
+        logger = get_logger(__name__)
+        logger.info('%s: %d frames in %.2f s (%.1f fps)' % (self.stage, report['n_frames'], report['wall_time'],
+                                                           report['fps']))
+        for name, section in report['sections'].items():
+            logger.debug('\t%s: %.3f s (%d calls)' % (name, section['total'], section['count']))
+        return filename
+
+
+class NullTimer(object):
+    """
+    Same interface as StageTimer, without timing anything (default of the instrumented functions).
+    """
+
+    def add(self, name, seconds, count=1):
+        pass
+
+    @contextmanager
+    def section(self, name):
+        yield
+
+    @contextmanager
+    def frame(self):
+        yield
+
+    def add_frame(self, seconds):
+        pass
+
+
+class Profiler(object):
+    """
+    Optional cProfile and tracemalloc hooks around a stage (see "instrumentation" in params.json).
+    The results are added to the report of a StageTimer, and the cProfile stats are saved in
+    [folder]/[stage].prof (e.g. for snakeviz).
+    """
+
+    def __init__(self, timer, folder, profile=None, trace_memory=None):
+        """
+        :param timer: StageTimer of the stage
+        :param folder: output folder of the stage
+        :param profile: run cProfile. If None, "instrumentation/profile" from params.json is used
+        :param trace_memory: run tracemalloc. If None, "instrumentation/tracemalloc" from params.json is used
+        """
+        params = load_instrumentation_params() if profile is None or trace_memory is None else {}
+        self.timer = timer
+        self.folder = folder
+        self.profile = params['profile'] if profile is None else profile
+        self.trace_memory = params['tracemalloc'] if trace_memory is None else trace_memory
+        self._profiler = None
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._profiler is not None:
+            self._profiler.disable()
+            prof_file = os.path.join(self.folder, self.timer.stage + '.prof')
+            self._profiler.dump_stats(prof_file)
+
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+            self.timer.extra['profile'] = {'file': prof_file, 'top': stream.getvalue().splitlines()}
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            self.timer.extra['memory'] = {'current_mb': current / 1e6, 'peak_mb': peak / 1e6,
+                                          'top': [str(stat) for stat in top]}
+        return False
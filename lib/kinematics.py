@@ -0,0 +1,162 @@
+"""
+KINEMATICS
+@Description: Velocity and acceleration of the optical flow tracks. Derivatives are computed per
+track (feature_id) with the true time between frames, using vectorized NumPy operations over the
+samples sorted by (track, frame). Differences are never taken across different tracks.
+
+Methods:
+    None                : backward differences (x[t] - x[t-1]) / dt
+    'finite_difference' : central differences (x[t+1] - x[t-1]) / (2 dt). Backward/forward
+                          differences at the ends of each track
+    'savgol'            : Savitzky-Golay derivative filter over runs of consecutive frames. Samples
+                          closer than window // 2 to a gap or to the end of a track are NaN
+"""
+
+import numpy as np
+from scipy.signal import savgol_coeffs
+
+SMOOTHING = (None, 'finite_difference', 'savgol')
+
+
+def sort_tracks(frame, feature_id):
+    """
+    Sorts the samples by track and frame.
+    :param frame: frame of each sample
+    :param feature_id: track of each sample
+    :return: order (indices that sort the samples) and a mask that is True where the sample
+    belongs to the same track as the previous one (in sorted order)
+    """
+    order = np.lexsort((frame, feature_id))
+    same_track = np.zeros(len(order), dtype=bool)
+    same_track[1:] = feature_id[order][1:] == feature_id[order][:-1]
+    return order, same_track
+
+
+def backward_difference(values, t, same_track):
+    """
+    Backward difference per track: (values[i] - values[i - 1]) / (t[i] - t[i - 1]).
+    NaN for the first sample of each track.
+    """
+    derivative = np.full(len(values), np.nan)
+    derivative[1:] = np.diff(values) / np.diff(t)
+    derivative[~same_track] = np.nan
+    return derivative
+
+
+def central_difference(values, t, same_track):
+    """
+    Central difference per track: (values[i + 1] - values[i - 1]) / (t[i + 1] - t[i - 1]).
+    At the ends of a track the backward/forward difference is used.
+    """
+    n = len(values)
+    has_prev = same_track
+    has_next = np.zeros(n, dtype=bool)
+    has_next[:-1] = same_track[1:]
+
+    prev_idx = np.where(has_prev, np.arange(n) - 1, np.arange(n))
+    next_idx = np.where(has_next, np.arange(n) + 1, np.arange(n))
+    prev_idx = np.clip(prev_idx, 0, n - 1)
+    next_idx = np.clip(next_idx, 0, n - 1)
+
+    dt = t[next_idx] - t[prev_idx]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        derivative = (values[next_idx] - values[prev_idx]) / dt
+    derivative[dt == 0] = np.nan  # Tracks with a single sample
+    return derivative
+
+
+def savgol_derivative(values, frame, same_track, fps, window=7, polyorder=2, deriv=1):
+    """
+    Savitzky-Golay derivative per run of consecutive frames of a track.
+    :param values: samples (sorted by track and frame)
+    :param frame: frame of each sample (sorted by track and frame)
+    :param same_track: see sort_tracks
+    :param fps: frames per second
+    :param window: window length (odd)
+    :param polyorder: order of the polynomial
+    :param deriv: order of the derivative
+    :return: derivative of the samples (NaN when the window does not fit in the run)
+    """
+    n = len(values)
+    half = window // 2
+    derivative = np.full(n, np.nan)
+    if n < window:
+        return derivative
+
+    # Runs of consecutive frames of the same track
+    new_run = ~same_track
+    new_run[1:] |= np.diff(frame) != 1
+    run_start = np.maximum.accumulate(np.where(new_run, np.arange(n), 0))
+    run_id = np.cumsum(new_run) - 1
+    run_end = np.flatnonzero(np.r_[new_run[1:], True])[run_id]  # Last sample of each run
+
+    coeffs = savgol_coeffs(window, polyorder, deriv=deriv, delta=1. / fps, use='conv')
+    filtered = np.convolve(np.nan_to_num(values), coeffs, mode='same')
+
+    position = np.arange(n)
+    valid = (position - run_start >= half) & (run_end - position >= half)
+    derivative[valid] = filtered[valid]
+    return derivative
+
+
+def kinematics(frame, feature_id, x, y, fps, smoothing=None, window=7, polyorder=2):
+    """
+    Velocity and acceleration of the tracks.
+    :param frame: frame of each sample
+    :param feature_id: track of each sample
+    :param x: x position of each sample
+    :param y: y position of each sample
+    :param fps: frames per second
+    :param smoothing: None, 'finite_difference' or 'savgol' (see the description of the module)
+    :param window: window length of the Savitzky-Golay filter
+    :param polyorder: order of the polynomial of the Savitzky-Golay filter
+    :return: x_vel, y_vel, x_accel, y_accel (in the same order as the input samples)
+    """
+    if smoothing not in SMOOTHING:
+        raise ValueError('Unknown smoothing "%s". It must be one of: %s' % (smoothing, SMOOTHING))
+
+    frame = np.asarray(frame)
+    feature_id = np.asarray(feature_id)
+    order, same_track = sort_tracks(frame, feature_id)
+
+    frame_sorted = frame[order].astype(np.float64)
+    t = frame_sorted / fps
+
+    results = []
+    for values in (np.asarray(x, dtype=np.float64)[order], np.asarray(y, dtype=np.float64)[order]):
+        if smoothing is None:
+            vel = backward_difference(values, t, same_track)
+            accel = backward_difference(vel, t, same_track)
+        elif smoothing == 'finite_difference':
+            vel = central_difference(values, t, same_track)
+            accel = central_difference(vel, t, same_track)
+        else:
+            vel = savgol_derivative(values, frame_sorted, same_track, fps, window, polyorder, deriv=1)
+            accel = savgol_derivative(values, frame_sorted, same_track, fps, window, polyorder, deriv=2)
+        results.append((vel, accel))
+
+    # Back to the input order
+    unsorted = []
+    for derivative in (results[0][0], results[1][0], results[0][1], results[1][1]):
+        out = np.empty_like(derivative)
+        out[order] = derivative
+        unsorted.append(out)
+
+    return tuple(unsorted)
+
+
+def add_kinematics(df, fps, smoothing=None, window=7, polyorder=2):
+    """
+    Adds the velocity and acceleration columns (x_vel, y_vel, x_accel, y_accel) to a DataFrame
+    of tracks (frame, feature_id, x_pos, y_pos).
+    :param df: DataFrame of tracks
+    :param fps: frames per second
+    :param smoothing: see kinematics
+    :param window: see kinematics
+    :param polyorder: see kinematics
+    :return: the same DataFrame
+    """
+    df['x_vel'], df['y_vel'], df['x_accel'], df['y_accel'] = kinematics(
+        df['frame'].values, df['feature_id'].values, df['x_pos'].values, df['y_pos'].values,
+        fps, smoothing, window, polyorder)
+    return df
@@ -0,0 +1,222 @@
+"""
+LK SWEEP
+@Description: Evaluates a grid of Lucas-Kenade / Shi-Tomasi parameters on the eye ROIs of a video,
+to choose the fastest settings that are still accurate enough. The ROI frames of an excerpt of the
+video are read from the ROI store of the video (see lib/roi_store.py) or, if there is none, decoded
+once into a temporary one. The store is memory-mapped by every worker (shared through the page cache),
+and each parameter set is tracked in a pool of processes. Metrics per parameter set:
+- ms_per_frame      : time of the optical flow and feature detection per frame (both eyes, no decoding)
+- survival          : fraction of the tracked features that are found in the next frame
+- mean_track_length : mean number of frames a feature is tracked
+- fb_error_median / fb_error_p95 : forward-backward error (pixels): the features are tracked to
+  the next frame and back, the distance to their original position measures the stability of the
+  output (computed every "lk_sweep/fb_every" frames, not included in the time)
+The grid and the accuracy bar are set in "lk_sweep" in params.json (grid keys are the ones of
+"opt_flow/shi_tomasi", "opt_flow/lucas_kanade" and "min_features").
+"""
+
+import os
+import time
+import shutil
+import itertools
+import tempfile
+from multiprocessing import Pool, cpu_count
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from lib.config import get_config
+from lib.eyes_extraction import load_eyes_detection
+from lib.instrumentation import get_logger
+from lib.optical_flow import check_folder, feature_params, lk_params
+from lib.roi_store import RoiFrameStore, load_roi_store, write_roi_frames
+from lib.roi_tracking import load_roi_track
+from lib.track_table import TrackTable
+
+logger = get_logger(__name__)
+
+EYE_KEYS = ('left_eye', 'right_eye')
+
+METRICS = ('n_frames', 'ms_per_frame', 'survival', 'mean_track_length', 'n_tracks', 'fb_error_median',
+           'fb_error_p95')
+
+
+def parameter_grid(grid, base=None):
+    """
+    Every combination of the values of a grid.
+    :param grid: dict {parameter: list of values} (keys of "opt_flow/shi_tomasi", "opt_flow/lucas_kanade"
+    or "min_features")
+    :param base: "opt_flow" section of the configuration with the rest of the parameters. If None,
+    the current configuration is used
+    :return: list of dicts {parameter: value} (only the parameters of the grid)
+    """
+    base = base or get_config()['opt_flow']
+    known = set(base['shi_tomasi']) | set(base['lucas_kanade']) | {'min_features'}
+    unknown = set(grid) - known
+    if unknown:
+        raise ValueError('Unknown parameters in the grid: %s' % ', '.join(sorted(unknown)))
+
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def opt_flow_section(params, base=None):
+    """
+    "opt_flow" section of the configuration with the parameters of a grid point.
+    :param params: dict {parameter: value} (see parameter_grid)
+    :param base: "opt_flow" section of the configuration. If None, the current configuration is used
+    :return: dict
+    """
+    base = base or get_config()['opt_flow']
+    section = dict(base, shi_tomasi=dict(base['shi_tomasi']), lucas_kanade=dict(base['lucas_kanade']))
+    for key, value in params.items():
+        if key == 'min_features':
+            section['min_features'] = value
+        elif key in section['shi_tomasi']:
+            section['shi_tomasi'][key] = value
+        else:
+            section['lucas_kanade'][key] = value
+    return section
+
+
+def evaluate(args):
+    """
+    Tracks the cached ROI frames with one parameter set (worker function of run_sweep).
+    :param args: tuple (folder, first, n_frames, params, opt_flow_params, fb_every):
+        folder, first, n_frames: ROI store and rows of the excerpt (see lib/roi_store.py)
+        params: parameters of the grid point (see parameter_grid)
+        opt_flow_params: "opt_flow" section of the configuration with the rest of the parameters
+        fb_every: the forward-backward error is computed every fb_every frames
+    :return: dict with the parameters and METRICS
+    """
+    folder, first, n_frames, params, opt_flow_params, fb_every = args
+    section = opt_flow_section(params, opt_flow_params)
+    shi_tomasi, lucas_kanade = feature_params(section), lk_params(section)
+
+    store = RoiFrameStore(folder)
+    frame_index = store.frame_index[first: first + n_frames]
+    elapsed = 0.
+    found, attempted = 0, 0
+    fb_errors, lengths = [], []
+
+    for eye in EYE_KEYS:
+        frames = store.frames(eye)[first: first + n_frames]
+        table = TrackTable(shi_tomasi, section['min_features'])
+
+        start = time.perf_counter()
+        table.seed(np.asarray(frames[0]), frame_index[0])
+        elapsed += time.perf_counter() - start
+
+        for i in range(1, len(frames)):
+            prev_gray, gray = np.asarray(frames[i - 1]), np.asarray(frames[i])
+
+            start = time.perf_counter()
+            p0 = table.points
+            if len(p0):
+                p1, st, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, p0, None, **lucas_kanade)
+                alive = table.update(p1, st, frame_index[i])
+            if table.needs_seeding():
+                table.seed(gray, frame_index[i])
+            elapsed += time.perf_counter() - start
+
+            if len(p0):
+                found += int(alive.sum())
+                attempted += len(alive)
+
+                # Forward-backward error (not timed)
+                if i % fb_every == 0 and alive.any():
+                    back, st_back, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, p1[alive], None, **lucas_kanade)
+                    valid = st_back.ravel() == 1
+                    fb_errors.append(np.linalg.norm((back - p0[alive]).reshape(-1, 2)[valid], axis=1))
+
+        lifetimes = table.lifetimes()
+        death = lifetimes['death'].where(lifetimes['death'] >= 0, frame_index[len(frames) - 1] + 1)
+        lengths.append((death - lifetimes['birth']).values)
+
+    fb_errors = np.concatenate(fb_errors) if fb_errors else np.empty(0)
+    lengths = np.concatenate(lengths)
+    metrics = {
+        'n_frames': n_frames,
+        'ms_per_frame': 1e3 * elapsed / max(n_frames, 1),
+        'survival': found / float(attempted) if attempted else np.nan,
+        'mean_track_length': lengths.mean() if len(lengths) else np.nan,
+        'n_tracks': len(lengths),
+        'fb_error_median': np.median(fb_errors) if len(fb_errors) else np.nan,
+        'fb_error_p95': np.percentile(fb_errors, 95) if len(fb_errors) else np.nan
+    }
+    return dict(params, **metrics)
+
+
+def init_worker():
+    # One OpenCV thread per process (the pool already uses every CPU)
+    cv2.setNumThreads(1)
+
+
+def best_parameters(results, max_fb_error, min_survival):
+    """
+    Fastest parameter set that meets the accuracy bar.
+    :param results: DataFrame returned by run_sweep
+    :param max_fb_error: maximum median forward-backward error (pixels)
+    :param min_survival: minimum survival
+    :return: row of results (Series), None if no parameter set meets the bar
+    """
+    accurate = results[(results['fb_error_median'] <= max_fb_error) & (results['survival'] >= min_survival)]
+    if accurate.empty:
+        return None
+    return accurate.sort_values('ms_per_frame').iloc[0]
+
+
+def run_sweep(video_file, grid=None, n_frames=None, n_workers=None):
+    """
+    Evaluates a grid of optical flow parameters on an excerpt of a video (see the description of
+    the module) and saves the results in "optical_flow/lk_sweep.csv".
+    :param video_file: path to the video (the eyes must be detected, see eye_extraction)
+    :param grid: dict {parameter: list of values}. If None, "lk_sweep/grid" from params.json is used
+    :param n_frames: number of frames of the excerpt. If None, "lk_sweep/n_frames" from params.json is used
+    :param n_workers: number of worker processes. If None, "lk_sweep/n_workers" from params.json is used
+    (0 means one per CPU)
+    :return: DataFrame with one row per parameter set (grid parameters and METRICS), fastest first
+    """
+    jf = get_config()
+    params = jf['lk_sweep']
+    grid = params['grid'] if grid is None else grid
+    n_frames = params['n_frames'] if n_frames is None else n_frames
+    n_workers = (params['n_workers'] if n_workers is None else n_workers) or cpu_count()
+
+    points = parameter_grid(grid, jf['opt_flow'])
+    rois = load_eyes_detection(video_file)
+    start = rois['frame_start'] + 100  # Same excerpt as the optical flow
+    folder_output = os.path.join(os.path.dirname(video_file), 'optical_flow')
+    check_folder(folder_output)
+
+    # ROI frames: from the ROI store of the video or decoded once into a temporary store
+    store = load_roi_store(video_file, rois) if jf['roi_store']['enabled'] else None
+    temporary = None
+    if store is None or not store.covers(start):
+        temporary = tempfile.mkdtemp(prefix='lk_sweep_', dir=folder_output)
+    try:
+        if temporary is not None:
+            logger.info('Decoding %d frames of the eye ROIs' % n_frames)
+            store = write_roi_frames(video_file, temporary, rois, load_roi_track(video_file), start, n_frames,
+                                     jf['reader']['queue_size'])
+
+        first, last = store.rows(start)
+        n = min(n_frames, last - first)
+        if n < 2:
+            raise IOError('Not enough frames to track in: %s' % video_file)
+
+        logger.info('Evaluating %d parameter sets on %d frames (%d workers)' % (len(points), n, n_workers))
+        tasks = [(store.folder, first, n, point, jf['opt_flow'], params['fb_every']) for point in points]
+        pool = Pool(min(n_workers, len(tasks)), initializer=init_worker)
+        try:
+            results = pool.map(evaluate, tasks)
+        finally:
+            pool.terminate()
+    finally:
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    df = pd.DataFrame(results, columns=sorted(grid) + list(METRICS)).sort_values('ms_per_frame')
+    df.to_csv(os.path.join(folder_output, 'lk_sweep.csv'), index=False)
+    return df.reset_index(drop=True)
@@ -0,0 +1,548 @@
+"""
+OPTICAL FLOW
+@Description: This module calculates the optical flow for a region of interest (ROI)
+"""
+
+import os
+import shutil
+from multiprocessing import Pool, current_process
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from lib.config import get_config
+from lib.eyes_extraction import crop_roi, load_eyes_detection
+from lib.frame_index import video_frame_count
+from lib.frame_source import open_reader
+from lib.histograms import QUANTITIES, PhasePlaneHistogram, phase_plane_file
+from lib.horn_schunck import HornSchunck, flow_summary
+from lib.instrumentation import NullTimer, Profiler, StageTimer, get_logger
+from lib.kinematics import add_kinematics
+from lib.preview import Preview
+from lib.roi_store import load_roi_store
+from lib.roi_tracking import load_roi_track
+from lib.track_store import is_track_store, read_tracks, write_tracks
+from lib.track_table import TrackTable, stitch_tracks, track_lifetimes
+
+logger = get_logger(__name__)
+
+
+def feature_params(opt_flow_params=None):
+    """
+    Parameters of the ShiTomasi corner detection (cv2.goodFeaturesToTrack).
+    :param opt_flow_params: "opt_flow" section of the configuration (see lib/config.py). If None,
+    the current configuration is used
+    :return: dict of keyword arguments
+    """
+    params = (opt_flow_params or get_config()['opt_flow'])['shi_tomasi']
+    return dict(maxCorners=params['max_corners'],
+                qualityLevel=params['quality_level'],
+                minDistance=params['min_distance'],
+                blockSize=params['block_size'])
+
+
+def lk_params(opt_flow_params=None):
+    """
+    Parameters of the Lucas-Kenade optical flow (cv2.calcOpticalFlowPyrLK).
+    :param opt_flow_params: "opt_flow" section of the configuration (see lib/config.py). If None,
+    the current configuration is used
+    :return: dict of keyword arguments
+    """
+    params = (opt_flow_params or get_config()['opt_flow'])['lucas_kanade']
+    return dict(winSize=(params['win_size'], params['win_size']),
+                maxLevel=params['max_level'],
+                criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, params['max_iter'], params['epsilon']))
+
+
+def check_folder(folder):
+    """
+    This function checks if a folder exists, and deletes the folder if it does
+    :param folder: path to the folder to be checked
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+
+def check_eye(eye):
+    """
+    Checks the eye parameter and returns the key of the eye in the eyes detection data.
+    :param eye: 'left' or 'right'
+    :return: 'left_eye' or 'right_eye'
+    """
+    if eye == 'left':
+        return 'left_eye'
+    elif eye == 'right':
+        return 'right_eye'
+    else:
+        logger.error('[eye] parameter is not correct. It must be "left" or "right"')
+        raise ValueError
+
+
+def open_frames(video_file, eye_keys, rois, roi_track=None, start=None, stop=None, queue_size=32,
+                keep_frame=False, timer=None):
+    """
+    Frames of the eye ROIs, read from the ROI store of the video when it is up to date and has
+    the frames (see lib/roi_store.py and "roi_store/enabled" in params.json), otherwise decoded from
+    the video (see open_reader in lib/frame_source.py).
+    :param video_file: path to the video
+    :param eye_keys: list of eyes ('left_eye' and/or 'right_eye')
+    :param rois: eyes detection data (as returned by eye_extraction)
+    :param roi_track: RoiTrack with the eye ROIs per frame (None for fixed ROIs)
+    :param start: frames after start are read (as the start of FrameReader)
+    :param stop: index of the last frame to be read (None for the end)
+    :param queue_size: number of frames decoded in advance (video only)
+    :param keep_frame: also return the original frame (the video is always decoded)
+    :param timer: StageTimer (see lib/instrumentation.py)
+    :return: iterable of (frame_index, {eye: gray ROI}, frame) with a close method
+    """
+    if get_config()['roi_store']['enabled'] and not keep_frame:
+        store = load_roi_store(video_file, rois, eye_keys)
+        if store is not None and store.covers(start):
+            logger.info('Reading the eye ROIs from: %s' % store.folder)
+            return store.read(eye_keys, start, stop)
+
+    return open_reader(video_file, rois={eye: rois[eye] for eye in eye_keys}, start=start, stop=stop,
+                       queue_size=queue_size, keep_frame=keep_frame, roi_track=roi_track, timer=timer)
+
+
+def opt_flow(video_file, eye, visualize=True, rois=None):
+    """
+    This function performs an optical flow calculation based on the Lucas-Kenade algorithm.
+    It saves a file called "left_eye_optical_flow.csv" / "right_eye_optical_flow.csv" (or a track store
+    "left_eye" / "right_eye", see "opt_flow/format" in params.json) inside a folder called "optical_flow"
+    in the video path.
+    :param video_file: :type str: path to the video
+    :param eye: 'left' or 'right'
+    :param visualize: show the tracked features while processing (in a separate thread). If False,
+    it runs headless
+    :param rois: eyes detection data (as returned by eye_extraction). If None, it is loaded
+    from "eyes_detection.json"
+    :return: DataFrame with data obtained from the optical flow (pos, vel, accel)
+    """
+    return opt_flow_multi(video_file, [eye], visualize=visualize, rois=rois)[eye]
+
+
+def opt_flow_multi(video_file, eyes=('left', 'right'), visualize=True, rois=None, roi_track=None):
+    """
+    Optical flow for several ROIs at once. Each frame of the video is decoded only once and the
+    optical flow is calculated on every eye ROI, either with Lucas-Kenade (sparse features) or
+    Horn-Schunck (dense, see "opt_flow/method" in params.json). It saves the same files as
+    opt_flow (one per eye) and, for Lucas-Kenade, the birth and death frame of each track in
+    "left_eye_tracks.csv" / "right_eye_tracks.csv". The phase plane histograms of each eye are
+    saved too (see lib/histograms.py).
+    :param video_file: :type str: path to the video
+    :param eyes: list of eyes to be tracked ('left' and/or 'right')
+    :param visualize: show the tracked features while processing (in a separate thread). If False,
+    it runs headless
+    :param rois: eyes detection data (as returned by eye_extraction). If None, it is loaded
+    from "eyes_detection.json"
+    :param roi_track: RoiTrack with the eye ROIs per frame (see lib/roi_tracking.py). If None, it is
+    loaded from "roi_track.csv" when it exists, otherwise the ROIs of rois are used for every frame.
+    With a ROI track, positions (x_pos, y_pos) are frame coordinates, so the moves of the ROI are not seen as
+    motion. With fixed ROIs they are relative to the ROI
+    :return: dict {eye: DataFrame} with data obtained from the optical flow (pos, vel, accel)
+    """
+
+    # Check eye parameter
+    eye_keys = [check_eye(eye) for eye in eyes]
+
+    # Define the folder output
+    folder_output = os.path.join(os.path.dirname(video_file), 'optical_flow')
+
+    # Check and create folder
+    check_folder(folder_output)
+
+    # Load parameters
+    jf = get_config()
+    fps = jf['camera']['fps']
+    opt_flow_csv = jf['opt_flow']['csv_file']
+    output_format = jf['opt_flow']['format']
+    kinematics_params = jf['kinematics']
+    queue_size = jf['reader']['queue_size']
+    method = jf['opt_flow']['method']
+    min_features = jf['opt_flow']['min_features']
+    n_workers = jf['opt_flow']['n_workers']
+    chunk_frames = jf['opt_flow']['chunk_frames']
+    chunk_overlap = jf['opt_flow']['chunk_overlap']
+    hs_params = jf['horn_schunck']
+    phase_plane_params = jf['phase_plane']
+
+    # Load ROI
+    if rois is None:
+        rois = load_eyes_detection(video_file)
+
+    frame_start = rois['frame_start']
+
+    if roi_track is None:
+        roi_track = load_roi_track(video_file)
+
+    timer = StageTimer('optical_flow')
+    with Profiler(timer, folder_output):
+        # Time chunks tracked in parallel (Lucas-Kenade only, without preview and not inside a worker process)
+        chunks = []
+        if uses_chunks(jf['opt_flow'], visualize):
+            chunks = split_chunks(video_file, frame_start + 100, chunk_frames, chunk_overlap)
+
+        if len(chunks) > 1:
+            logger.info('Tracking %d chunks of %d frames with %d workers' % (len(chunks), chunk_frames, n_workers))
+            timer.extra['chunks'] = len(chunks)
+            with timer.section('tracking'):
+                features, lifetimes = track_lk_chunks(video_file, eye_keys, rois, roi_track, chunks, n_workers,
+                                                      queue_size, min_features)
+        else:
+            # Start the preview (if any). Without preview no GUI call is done, so it runs headless
+            preview = Preview().start() if visualize and method == 'lk' else None
+
+            # Define a frame reader: eye ROIs from the ROI store or cropped and converted to gray while decoding
+            reader = open_frames(video_file, eye_keys, rois, roi_track, start=frame_start + 100,
+                                 queue_size=queue_size, keep_frame=preview is not None, timer=timer)
+
+            logger.info('Checking first frame')
+            try:
+                if method == 'lk':
+                    features, lifetimes = track_lk(reader, eye_keys, rois, roi_track, preview, min_features, timer)
+                elif method == 'hs':
+                    features, lifetimes = track_hs(reader, eye_keys, hs_params, roi_track, timer), {}
+                else:
+                    raise ValueError('Unknown optical flow method "%s". It must be "lk" or "hs"' % method)
+            finally:
+                if preview is not None:
+                    preview.close()
+                reader.close()
+
+        position_dfs = {}
+        for eye_name, eye in zip(eyes, eye_keys):
+            with timer.section('kinematics'):
+                position_df = pd.DataFrame(features[eye], columns=['frame', 'feature_id', 'x_pos', 'y_pos'])
+                position_df['feature_id'] = position_df['feature_id'].astype(np.int32)
+                position_df = add_kinematics(position_df, fps, **kinematics_params)
+
+            with timer.section('save'):
+                save_opt_flow_data(folder_output, eye, position_df, opt_flow_csv, output_format)
+                if eye in lifetimes:
+                    lifetimes[eye].to_csv(os.path.join(folder_output, eye + '_tracks.csv'), index=False)
+
+            # Phase plane histograms (fixed bins, see lib/histograms.py). They are built from the whole DataFrame
+            # of the eye, as velocities and accelerations are only known once the tracks are complete
+            with timer.section('histograms'):
+                for quantity in QUANTITIES:
+                    histogram = PhasePlaneHistogram.from_params(phase_plane_params, quantity).update_df(position_df)
+                    histogram.save(phase_plane_file(video_file, eye_name, quantity))
+
+            logger.info('Done! %s: %d frames processed, %d features extracted'
+                        % (eye, position_df['frame'].max() - frame_start, position_df['feature_id'].nunique()))
+            position_dfs[eye_name] = position_df
+
+    timer.write_report(folder_output)
+    return position_dfs
+
+
+def track_lk(frames, eye_keys, rois, roi_track=None, preview=None, min_features=20, timer=None):
+    """
+    Lucas-Kenade optical flow of the features (Shi-Tomasi corners) of each eye ROI. Features keep
+    their ID while they are tracked, and new ones are detected when fewer than min_features are
+    left (see lib/track_table.py).
+    Positions are relative to the ROI for fixed ROIs. With a ROI track they are frame coordinates
+    (the ROI origin of each frame is added), so the moves of the ROI are not seen as motion.
+    :param frames: iterable of (frame_index, {eye: gray ROI}, frame) (see FrameReader)
+    :param eye_keys: list of eyes ('left_eye' and/or 'right_eye')
+    :param rois: eyes detection data (as returned by eye_extraction)
+    :param roi_track: RoiTrack with the eye ROIs per frame (None for fixed ROIs)
+    :param preview: Preview where the tracks are drawn (None to run headless)
+    :param min_features: minimum number of tracked features before detecting new ones
+    :param timer: StageTimer (see lib/instrumentation.py). If None, nothing is timed
+    :return: dict {eye: list of [frame, feature_id, x_pos, y_pos]} and dict {eye: DataFrame with
+    the birth and death frame of each track}
+    """
+    timer = timer or NullTimer()
+    shi_tomasi = feature_params()
+    lucas_kanade = lk_params()
+
+    # Create some random colors
+    color = np.random.randint(0, 255, (100, 3))
+
+    # Take first frame and find corners in it
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        raise IOError('Cannot read the first frame')
+    first_index, first_crops = first[:2]
+
+    def origin(roi):
+        # Offset of the saved positions (frame coordinates when the ROI moves)
+        return (roi['x_min'], roi['y_min']) if roi_track is not None else (0, 0)
+
+    # Tracking state per eye:
+    # ROI of the previous frame in gray scale: roi_ff_gray
+    # Tracked features: table
+    tracks = {}
+    for eye in eye_keys:
+        roi_ff_gray = first_crops[eye]
+        table = TrackTable(shi_tomasi, min_features)
+        ids, points = table.seed(roi_ff_gray, first_index)
+
+        roi = rois[eye] if roi_track is None else roi_track.roi(eye, first_index)
+        x0, y0 = origin(roi)
+        tracks[eye] = {
+            'roi': roi,
+            'roi_ff_gray': roi_ff_gray,
+            'table': table,
+            'mask': np.zeros(roi_ff_gray.shape + (3,), np.uint8),  # Mask image for drawing purposes
+            'features': [[first_index, i, a + x0, b + y0] for i, (a, b) in zip(ids, points.reshape(-1, 2))]
+        }
+
+    for current_frame, crops, frame in frames:
+        with timer.frame():
+            for eye in eye_keys:
+                track = tracks[eye]
+                table = track['table']
+
+                # ROI of the current frame (in gray)
+                roi_frame_gray = crops[eye]
+
+                if roi_track is not None:
+                    roi = roi_track.roi(eye, current_frame)
+                    shift = np.float32([track['roi']['x_min'] - roi['x_min'], track['roi']['y_min'] - roi['y_min']])
+                    track['roi'] = roi
+                x0, y0 = origin(track['roi'])
+
+                # calculate optical flow
+                if len(table):
+                    p0 = table.points
+                    with timer.section('lk'):
+                        if roi_track is not None:
+                            # The ROI may have moved: start the search at the previous points in the new ROI
+                            # coordinates
+                            p1, st, err = cv2.calcOpticalFlowPyrLK(track['roi_ff_gray'], roi_frame_gray, p0,
+                                                                   p0 + shift, flags=cv2.OPTFLOW_USE_INITIAL_FLOW,
+                                                                   **lucas_kanade)
+                        else:
+                            p1, st, err = cv2.calcOpticalFlowPyrLK(track['roi_ff_gray'], roi_frame_gray, p0, None,
+                                                                   **lucas_kanade)
+
+                    # Keep the good points (the lost ones are removed from the table)
+                    alive = table.update(p1, st, current_frame)
+                    good_old = p0[alive].reshape(-1, 2)
+                    for i, (a, b) in zip(table.ids, table.points.reshape(-1, 2)):
+                        track['features'].append([current_frame, i, a + x0, b + y0])
+
+                    # draw the tracks (only when there is a preview)
+                    if preview is not None:
+                        with timer.section('draw'):
+                            roi_frame = crop_roi(frame, track['roi'])
+                            for i, new, old in zip(table.ids, table.points.reshape(-1, 2), good_old):
+                                a, b = new
+                                c, d = old
+                                track['mask'] = cv2.line(track['mask'], (int(a), int(b)), (int(c), int(d)),
+                                                         color[i % len(color)].tolist(), 2)
+                                roi_frame = cv2.circle(roi_frame, (int(a), int(b)), 5,
+                                                       color[i % len(color)].tolist(), -1)
+                            preview.show(eye, cv2.add(roi_frame, track['mask']))
+
+                # Detect new features when too many were lost
+                if table.needs_seeding():
+                    with timer.section('seed'):
+                        ids, points = table.seed(roi_frame_gray, current_frame)
+                    for i, (a, b) in zip(ids, points.reshape(-1, 2)):
+                        track['features'].append([current_frame, i, a + x0, b + y0])
+
+                # Now update the previous frame
+                track['roi_ff_gray'] = roi_frame_gray
+
+        # Check for interruption (pressing 'q' on the preview)
+        if preview is not None and preview.stopped:
+            break
+
+    features = {eye: tracks[eye]['features'] for eye in eye_keys}
+    lifetimes = {eye: tracks[eye]['table'].lifetimes() for eye in eye_keys}
+    return features, lifetimes
+
+
+def uses_chunks(opt_flow_params, visualize=False):
+    """
+    Checks if the optical flow is tracked in time chunks (see track_lk_chunks): Lucas-Kenade with
+    more than one worker, without preview and not inside a worker process (e.g. batch mode).
+    :param opt_flow_params: "opt_flow" section of the configuration
+    :param visualize: the tracked features are shown while processing
+    """
+    return (opt_flow_params['n_workers'] > 1 and opt_flow_params['method'] == 'lk' and not visualize and
+            not current_process().daemon)
+
+
+def split_chunks(video_file, start, chunk_frames, overlap):
+    """
+    Splits the frames of a video (from start to the end) in time chunks.
+    :param video_file: path to the video
+    :param start: frame to start tracking from (as the start of FrameReader)
+    :param chunk_frames: number of frames per chunk
+    :param overlap: number of frames before each chunk that are also tracked by the previous chunk,
+    to match the tracks of both chunks (at least 1, so consecutive chunks share their boundary frame)
+    :return: list of (reader start, reader stop, boundary frame) per chunk. The boundary frame is
+    the last frame of the previous chunk (None for the first chunk), and stop is None for the last one
+    """
+    if overlap < 1:
+        raise ValueError('The chunk overlap must be at least 1 frame')
+
+    frame_count = video_frame_count(video_file)
+
+    edges = list(range(int(start), frame_count, chunk_frames))
+    chunks = []
+    for i, edge in enumerate(edges):
+        stop = edges[i + 1] if i + 1 < len(edges) else None
+        if i == 0:
+            chunks.append((edge, stop, None))
+        else:
+            chunks.append((max(edge - overlap, int(start)), stop, edge))
+    return chunks
+
+
+def track_chunk(args):
+    """
+    Tracks one time chunk (worker function of track_lk_chunks).
+    :param args: tuple (video_file, eye_keys, rois, roi_track, start, stop, queue_size, min_features)
+    :return: dict {eye: array (n, 4) with the samples [frame, feature_id, x_pos, y_pos]}
+    """
+    video_file, eye_keys, rois, roi_track, start, stop, queue_size, min_features = args
+
+    reader = open_frames(video_file, eye_keys, rois, roi_track, start=start, stop=stop, queue_size=queue_size)
+    try:
+        features, _ = track_lk(reader, eye_keys, rois, roi_track, min_features=min_features)
+    finally:
+        reader.close()
+    return {eye: np.array(features[eye], dtype=np.float64).reshape(-1, 4) for eye in eye_keys}
+
+
+def track_lk_chunks(video_file, eye_keys, rois, roi_track, chunks, n_workers, queue_size=32, min_features=20):
+    """
+    Lucas-Kenade optical flow of a video split in time chunks, each one tracked in its own process.
+    Every chunk starts a few frames earlier (overlap), and the tracks are stitched by their
+    trajectories over the overlap (see stitch_tracks in lib/track_table.py). This is close to, but
+    not the same as, one continuous run: tracks without a match break at the boundary frames.
+    :param video_file: path to the video
+    :param eye_keys: list of eyes ('left_eye' and/or 'right_eye')
+    :param rois: eyes detection data (as returned by eye_extraction)
+    :param roi_track: RoiTrack with the eye ROIs per frame (None for fixed ROIs)
+    :param chunks: list of (start, stop, boundary frame) (see split_chunks)
+    :param n_workers: number of worker processes
+    :param queue_size: number of frames decoded in advance (per worker)
+    :param min_features: minimum number of tracked features before detecting new ones
+    :return: same as track_lk
+    """
+    tasks = [(video_file, eye_keys, rois, roi_track, start, stop, queue_size, min_features)
+             for start, stop, _ in chunks]
+    starts = [start for start, _, _ in chunks[1:]]
+    boundaries = [boundary for _, _, boundary in chunks[1:]]
+
+    pool = Pool(min(n_workers, len(chunks)))
+    try:
+        results = pool.map(track_chunk, tasks)
+    finally:
+        pool.terminate()
+
+    features, lifetimes = {}, {}
+    for eye in eye_keys:
+        features[eye] = stitch_tracks([result[eye] for result in results], boundaries, starts)
+        last_frame = features[eye][:, 0].max() if len(features[eye]) else 0
+        lifetimes[eye] = track_lifetimes(features[eye], last_frame)
+    return features, lifetimes
+
+
+def track_hs(frames, eye_keys, hs_params, roi_track=None, timer=None):
+    """
+    Horn-Schunck dense optical flow of each eye ROI. The flow of each frame is summarized in two
+    vectors, saved as two features whose positions are the accumulated displacement (so the
+    velocity is the flow times the frame rate):
+        feature_id 0: mean flow vector
+        feature_id 1: dominant flow vector (see lib/horn_schunck.py)
+    :param frames: iterable of (frame_index, {eye: gray ROI}, frame) (see FrameReader)
+    :param eye_keys: list of eyes ('left_eye' and/or 'right_eye')
+    :param hs_params: Horn-Schunck parameters (see "horn_schunck" in params.json)
+    :param roi_track: RoiTrack with the eye ROIs per frame (None for fixed ROIs). The moves of the
+    ROI are added to the displacement, so they are not seen as motion
+    :param timer: StageTimer (see lib/instrumentation.py). If None, nothing is timed
+    :return: dict {eye: list of [frame, feature_id, x_pos, y_pos]}
+    """
+    timer = timer or NullTimer()
+    solvers = {}
+    positions = {eye: np.zeros((2, 2)) for eye in eye_keys}
+    features = {eye: [] for eye in eye_keys}
+    previous_rois = {}
+
+    for current_frame, crops, _ in frames:
+        with timer.frame():
+            for eye in eye_keys:
+                if eye not in solvers:
+                    solvers[eye] = HornSchunck(crops[eye].shape, **hs_params)
+
+                with timer.section('hs'):
+                    flow = solvers[eye].update(crops[eye])
+                if flow is not None:
+                    mean, dominant = flow_summary(*flow)
+                    positions[eye] += (mean, dominant)
+
+                if roi_track is not None:
+                    roi = roi_track.roi(eye, current_frame)
+                    if eye in previous_rois:
+                        positions[eye] += (roi['x_min'] - previous_rois[eye]['x_min'],
+                                           roi['y_min'] - previous_rois[eye]['y_min'])
+                    previous_rois[eye] = roi
+
+                for feature_id, (x, y) in enumerate(positions[eye]):
+                    features[eye].append([current_frame, feature_id, x, y])
+
+    return features
+
+
+def save_opt_flow_data(folder_output, eye, position_df, opt_flow_csv, output_format='npy'):
+    """
+    Saves the optical flow of one eye, either as a *.csv file or as a columnar track store
+    (see lib/track_store.py). The output of the other format is deleted, so there is only one.
+    :param folder_output: path to the "optical_flow" folder
+    :param eye: 'left_eye' or 'right_eye'
+    :param position_df: DataFrame with data obtained from the optical flow (pos, vel, accel). Positions
+    (x_pos, y_pos) are frame coordinates if the eye was tracked with a ROI track, otherwise they are
+    relative to the fixed ROI of the eye
+    :param opt_flow_csv: name of the *.csv file (see params.json)
+    :param output_format: 'csv' or 'npy'
+    """
+    csv_file = os.path.join(folder_output, eye + '_' + opt_flow_csv)
+    store_folder = os.path.join(folder_output, eye)
+
+    if output_format == 'csv':
+        logger.info('Saving file %s' % csv_file)
+        position_df.to_csv(csv_file)
+        if os.path.isdir(store_folder):
+            shutil.rmtree(store_folder)
+    elif output_format == 'npy':
+        logger.info('Saving track store %s' % store_folder)
+        write_tracks(store_folder, position_df)
+        if os.path.isfile(csv_file):
+            os.remove(csv_file)
+    else:
+        raise ValueError('Unknown optical flow format "%s". It must be "csv" or "npy"' % output_format)
+
+
+def get_opt_flow_data(video_file, eye, columns=None):
+    """
+    Loads the data generated from the optical flow analysis of one eye. The track store
+    (see lib/track_store.py) is used if it exists, otherwise the *.csv file.
+    :param video_file: path to the video
+    :param eye: 'left' or 'right'
+    :param columns: list of columns to be loaded (None for all)
+    :return: DataFrame with data obtained from the optical flow (pos, vel, accel)
+    """
+
+    # Check eye
+    eye = check_eye(eye)
+
+    # Set Optical flow folder directory
+    opt_flow_folder = os.path.join(os.path.dirname(video_file), 'optical_flow')
+
+    store_folder = os.path.join(opt_flow_folder, eye)
+    if is_track_store(store_folder):
+        return read_tracks(store_folder, columns)
+
+    opt_flow_csv = eye + '_' + get_config()['opt_flow']['csv_file']
+
+    return pd.read_csv(os.path.join(opt_flow_folder, opt_flow_csv), usecols=columns)
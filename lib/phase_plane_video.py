@@ -0,0 +1,184 @@
+"""
+PHASE PLANE VIDEO
+@Description: Renders the evolution of the velocity/acceleration phase plane of an eye as a video
+(one image per frame of the original video, no intermediate images). Each image shows the samples
+of the last seconds (or every sample up to that frame) rasterized into a NumPy buffer: each pixel
+is a bin of the phase plane (magnitudes, ranges from "phase_plane" in params.json), acceleration
+on the vertical axis (upwards). Blocks of frames are rendered in parallel (pool of processes) and
+written in order to an MP4 file.
+"""
+
+import collections
+from multiprocessing import Pool, cpu_count
+
+import cv2
+import numpy as np
+
+from lib.instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+
+def pixel_index(vel, accel, vel_range, accel_range, size):
+    """
+    Pixel (flat index of a size x size image) of each sample of the phase plane.
+    :param vel: velocity magnitude of each sample
+    :param accel: acceleration magnitude of each sample
+    :param vel_range: (min, max) velocity (horizontal axis)
+    :param accel_range: (min, max) acceleration (vertical axis, upwards)
+    :param size: size of the image (pixels)
+    :return: flat index of each sample and mask of the samples inside the image
+    """
+    with np.errstate(invalid='ignore'):
+        col = np.floor((vel - vel_range[0]) / float(vel_range[1] - vel_range[0]) * size)
+        row = size - 1 - np.floor((accel - accel_range[0]) / float(accel_range[1] - accel_range[0]) * size)
+        valid = np.isfinite(col) & np.isfinite(row) & (col >= 0) & (col < size) & (row >= 0) & (row < size)
+    return (row[valid] * size + col[valid]).astype(np.int64), valid
+
+
+def colorize(counts, size, label=None):
+    """
+    Image of the counts of the phase plane (log scale, jet colormap).
+    :param counts: flat counts (size * size)
+    :param size: size of the image (pixels)
+    :param label: text written on the top-left corner (e.g. the frame)
+    :return: BGR image
+    """
+    img = np.log1p(counts.reshape(size, size).astype(np.float32))
+    if img.max() > 0:
+        img *= 255. / img.max()
+    img = cv2.applyColorMap(img.astype(np.uint8), cv2.COLORMAP_JET)
+    if label is not None:
+        cv2.putText(img, label, (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    return img
+
+
+def render_block(args):
+    """
+    Renders the images of a block of frames (worker function of render_video).
+    :param args: tuple (frame, pixel, initial, start, stop, window, size):
+        frame, pixel: frame and pixel of the samples (sorted by frame) from start - window
+        (or from start if window is None) to stop
+        initial: counts before start (None for an empty phase plane)
+        start, stop: range of frames to be rendered [start, stop)
+        window: number of frames shown in each image (None for every sample up to the frame)
+        size: size of the images (pixels)
+    :return: array (stop - start, size, size, 3) with the images
+    """
+    frame, pixel, initial, start, stop, window, size = args
+    counts = np.zeros(size * size, dtype=np.int64) if initial is None else initial.copy()
+
+    def samples(first, last):
+        return pixel[np.searchsorted(frame, first, side='left'): np.searchsorted(frame, last, side='right')]
+
+    if window:
+        np.add.at(counts, samples(start - window, start - 1), 1)
+
+    images = np.empty((stop - start, size, size, 3), dtype=np.uint8)
+    for i, f in enumerate(range(start, stop)):
+        np.add.at(counts, samples(f, f), 1)
+        if window:
+            np.subtract.at(counts, samples(f - window, f - window), 1)
+        images[i] = colorize(counts, size, 'frame %d' % f)
+    return images
+
+
+def block_tasks(frame, pixel, first, last, block_frames, window, size):
+    """
+    Tasks of render_block, one per block of frames. They are built lazily: without window, the
+    counts before each block are accumulated as the blocks are generated, so only the counts of
+    the blocks in flight are kept in memory.
+    :param frame, pixel: frame and pixel of the samples (sorted by frame)
+    :param first, last: first and last frame to be rendered
+    :param block_frames: number of frames per block
+    :param window: number of frames shown in each image (None for every sample up to the frame)
+    :param size: size of the images (pixels)
+    :return: generator of tasks (see render_block)
+    """
+    counts = np.zeros(size * size, dtype=np.int64)
+    for start in range(first, last + 1, block_frames):
+        stop = min(start + block_frames, last + 1)
+        lo = np.searchsorted(frame, start - (window or 0), side='left')
+        hi = np.searchsorted(frame, stop - 1, side='right')
+        if window:
+            yield frame[lo: hi], pixel[lo: hi], None, start, stop, window, size
+        else:
+            yield frame[lo: hi], pixel[lo: hi], counts.copy(), start, stop, None, size
+            counts += np.bincount(pixel[lo: hi], minlength=size * size)
+
+
+def write_images(writer, images):
+    for image in images:
+        writer.write(image)
+    return len(images)
+
+
+def render_video(frame, vel, accel, output_file, vel_range, accel_range, fps=120, size=400, window=None,
+                 block_frames=120, n_workers=None):
+    """
+    Renders the phase plane of every frame and writes them to a video.
+    :param frame: frame of each sample
+    :param vel: velocity magnitude of each sample
+    :param accel: acceleration magnitude of each sample
+    :param output_file: path to the video (*.mp4)
+    :param vel_range: (min, max) velocity
+    :param accel_range: (min, max) acceleration
+    :param fps: frame rate of the video
+    :param size: size of the images (pixels)
+    :param window: number of frames shown in each image (None for every sample up to the frame)
+    :param block_frames: number of frames rendered per task
+    :param n_workers: number of worker processes (None or 0 for one per CPU)
+    :return: number of frames written
+    """
+    frame = np.asarray(frame).astype(np.int64)
+    pixel, valid = pixel_index(np.asarray(vel, dtype=np.float64), np.asarray(accel, dtype=np.float64),
+                               vel_range, accel_range, size)
+    frame = frame[valid]
+    order = np.argsort(frame, kind='stable')
+    frame, pixel = frame[order], pixel[order]
+    if len(frame) == 0:
+        raise ValueError('No samples inside the phase plane')
+
+    first, last = int(frame[0]), int(frame[-1])
+    n_workers = n_workers or cpu_count()
+
+    writer = cv2.VideoWriter(output_file, cv2.VideoWriter_fourcc(*'mp4v'), fps, (size, size))
+    if not writer.isOpened():
+        raise IOError('Cannot write: %s' % output_file)
+
+    # Blocks are written in order. Tasks are generated as they are submitted and only a few blocks
+    # per worker are in flight (bounded memory)
+    n_frames = 0
+    pool = Pool(n_workers)
+    try:
+        pending = collections.deque()
+        for task in block_tasks(frame, pixel, first, last, block_frames, window, size):
+            pending.append(pool.apply_async(render_block, (task,)))
+            if len(pending) > 2 * n_workers:
+                n_frames += write_images(writer, pending.popleft().get())
+        while pending:
+            n_frames += write_images(writer, pending.popleft().get())
+    finally:
+        pool.terminate()
+        writer.release()
+
+    return n_frames
+
+
+def render_phase_plane_video(df, output_file, params, fps=120):
+    """
+    Renders the phase plane video of the optical flow of one eye.
+    :param df: DataFrame of tracks (frame, x_vel, y_vel, x_accel, y_accel)
+    :param output_file: path to the video (*.mp4)
+    :param params: phase plane parameters (see "phase_plane" in params.json)
+    :param fps: frame rate of the original video
+    :return: number of frames written
+    """
+    video = params['video']
+    window = int(round(video['window'] * fps)) if video['window'] else None
+
+    logger.info('Rendering phase plane video: %s' % output_file)
+    return render_video(df['frame'].values, np.hypot(df['x_vel'].values, df['y_vel'].values),
+                        np.hypot(df['x_accel'].values, df['y_accel'].values), output_file,
+                        params['vel_mag'][:2], params['accel_mag'][:2], fps=fps, size=video['size'],
+                        window=window, block_frames=video['block_frames'], n_workers=video['n_workers'])
@@ -0,0 +1,183 @@
+"""
+PIPELINE
+@Description: Runs the ocular motion processing pipeline in a single process:
+    1) Eye detection
+    2) Tracking of the eye ROIs along the video (re-detection every N frames)
+    3) Storage of the gray eye ROIs of every frame (decoded once, see lib/roi_store.py), if enabled
+    4) Calculation of the optical flow (Lucas Kenade algorithm)
+    5) Plotting of the phase-space for velocity and acceleration
+
+Data is passed between stages in memory. Stages that are not selected, or whose result is cached
+for the same video and parameters (see lib/cache.py), are loaded from the files written by a
+previous run (eyes_detection.json / roi_track.csv / roi_frames / optical flow tracks).
+"""
+
+import os
+import time
+
+from lib.cache import StageCache
+from lib.config import get_config
+from lib.eyes_extraction import eye_extraction, load_eyes_detection
+from lib.instrumentation import get_logger
+from lib.optical_flow import opt_flow_multi, get_opt_flow_data
+from lib.plots import plot_phase_planes
+from lib.roi_store import build_roi_store
+from lib.roi_tracking import load_roi_track, roi_track_file, track_eye_rois
+
+logger = get_logger(__name__)
+
+STAGES = ('detection', 'roi_tracking', 'roi_frames', 'optical_flow', 'phase_plane')
+EYES = ('left', 'right')
+
+
+def run_video(video_file, stages=STAGES, visualize=False, use_cache=None):
+    """
+    Runs the per-video stages (eye detection, ROI tracking, ROI frame store and optical flow) of the pipeline.
+    Stages whose result for the same video and parameters is cached (see lib/cache.py) are loaded
+    from disk instead of being run again.
+    :param video_file: path to the video
+    :param stages: stages to be run (see STAGES)
+    :param visualize: show the detections and tracked features while processing (otherwise it runs headless)
+    :param use_cache: reuse cached results. If None, "cache/enabled" from params.json is used
+    :return: dict with the results of each stage ('detection', 'roi_tracking', 'roi_frames', 'optical_flow'), the
+    time spent on each of them in seconds ('timings') and the stages loaded from the cache ('cached')
+    """
+    video_file = os.path.normpath(video_file)
+    result = {'video_file': video_file, 'timings': {}, 'cached': []}
+
+    jf = get_config()
+    if use_cache is None:
+        use_cache = jf['cache']['enabled']
+
+    # Only the per-video stages are cached (the video is not hashed if none of them is run)
+    per_video = any(stage in stages for stage in ('detection', 'roi_tracking', 'roi_frames', 'optical_flow'))
+    cache = StageCache(video_file, jf, visualize) if use_cache and per_video else None
+    keys = {}
+
+    # 1. Eyes detection
+    if cache is not None:
+        keys['detection'] = cache.key('detection')
+
+    if 'detection' in stages:
+        if cache is not None and cache.is_valid('detection', keys['detection']):
+            logger.info('Eye extraction (cached) for: %s' % video_file)
+            result['detection'] = load_eyes_detection(video_file)
+            result['cached'].append('detection')
+        else:
+            logger.info('Eye extraction for: %s' % video_file)
+            start = time.time()
+            result['detection'] = eye_extraction(video_file, show_plot=False, visualize=visualize)
+            result['timings']['detection'] = time.time() - start
+
+            if not result['detection']:
+                raise RuntimeError('Eyes not detected in: %s' % video_file)
+            if cache is not None:
+                cache.store('detection', keys['detection'])
+
+    if 'detection' not in result and any(stage in stages for stage in ('roi_tracking', 'roi_frames', 'optical_flow')):
+        result['detection'] = load_eyes_detection(video_file)
+
+    # 2. ROI tracking
+    if cache is not None:
+        keys['roi_tracking'] = cache.key('roi_tracking', keys['detection'])
+
+    if 'roi_tracking' in stages:
+        if cache is not None and cache.is_valid('roi_tracking', keys['roi_tracking']):
+            logger.info('Tracking eye ROIs (cached) for: %s' % video_file)
+            result['roi_tracking'] = load_roi_track(video_file)
+            result['cached'].append('roi_tracking')
+        else:
+            logger.info('Tracking eye ROIs for: %s' % video_file)
+            start = time.time()
+            result['roi_tracking'] = track_eye_rois(video_file, rois=result['detection'])
+            result['timings']['roi_tracking'] = time.time() - start
+            if cache is not None:
+                cache.store('roi_tracking', keys['roi_tracking'])
+
+    # 3. ROI frame store (gray eye ROIs decoded once, read by the optical flow). It is skipped if the
+    # store is disabled, as nothing would read it
+    store_enabled = jf['roi_store']['enabled']
+    if cache is not None:
+        upstream = keys['roi_tracking'] if os.path.isfile(roi_track_file(video_file)) else keys['detection']
+        if store_enabled:
+            keys['roi_frames'] = cache.key('roi_frames', upstream)
+
+    if 'roi_frames' in stages and not store_enabled:
+        logger.info('ROI frames skipped (roi_store/enabled is false) for: %s' % video_file)
+    elif 'roi_frames' in stages:
+        if cache is not None and cache.is_valid('roi_frames', keys['roi_frames']):
+            logger.info('ROI frames (cached) for: %s' % video_file)
+            result['cached'].append('roi_frames')
+        else:
+            logger.info('Storing ROI frames for: %s' % video_file)
+            start = time.time()
+            build_roi_store(video_file, rois=result['detection'], roi_track=result.get('roi_tracking'))
+            result['timings']['roi_frames'] = time.time() - start
+            if cache is not None:
+                cache.store('roi_frames', keys['roi_frames'])
+
+    # 4. Optical Flow Calculation (it reads the ROI track and the ROI frames if there are)
+    if cache is not None:
+        keys['optical_flow'] = cache.key('optical_flow', upstream)
+
+    if 'optical_flow' in stages:
+        if cache is not None and cache.is_valid('optical_flow', keys['optical_flow']):
+            logger.info('Optical flow (cached) for: %s' % video_file)
+            result['optical_flow'] = {eye: get_opt_flow_data(video_file, eye) for eye in EYES}
+            result['cached'].append('optical_flow')
+        else:
+            logger.info('Calculating optical flow for: %s' % video_file)
+            start = time.time()
+            result['optical_flow'] = opt_flow_multi(video_file, EYES, visualize=visualize,
+                                                    rois=result['detection'], roi_track=result.get('roi_tracking'))
+            result['timings']['optical_flow'] = time.time() - start
+            if cache is not None:
+                cache.store('optical_flow', keys['optical_flow'])
+
+    return result
+
+
+def run_pipeline(video_files, stages=STAGES, visualize=False, use_cache=None):
+    """
+    Runs the pipeline over a control and a CP video (in that order).
+    :param video_files: list with the path to the control video and the CP video
+    :param stages: stages to be run (see STAGES)
+    :param visualize: show the detections and tracked features while processing (otherwise it runs headless)
+    :param use_cache: reuse cached results (see run_video)
+    :return: list with the results of each video (see run_video). The phase plane timing
+    is reported in the results of the last video.
+    """
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError('Unknown stage "%s". It must be one of: %s' % (stage, ', '.join(STAGES)))
+    if 'phase_plane' in stages and len(video_files) != 2:
+        raise ValueError('The phase plane stage needs a control and a CP video')
+
+    results = [run_video(video_file, stages, visualize, use_cache) for video_file in video_files]
+
+    # 5. Plot results
+    if 'phase_plane' in stages:
+        start = time.time()
+        opt_flow_data = []
+        for result in results:
+            if 'optical_flow' not in result:
+                result['optical_flow'] = {eye: get_opt_flow_data(result['video_file'], eye) for eye in EYES}
+            opt_flow_data.append(result['optical_flow'])
+
+        plot_phase_planes(opt_flow_data[0], opt_flow_data[1], EYES)
+        results[-1]['timings']['phase_plane'] = time.time() - start
+
+    print_timings(results)
+    return results
+
+
+def print_timings(results):
+    """
+    Prints the time spent on each stage per video.
+    :param results: list of results (see run_video)
+    """
+    print('[  INFO  ] Stage timings:')
+    for result in results:
+        for stage in STAGES:
+            if stage in result['timings']:
+                print('\t%s - %s: %.2f s' % (result['video_file'], stage, result['timings'][stage]))
@@ -1,13 +1,19 @@
 import os
 
 import numpy as np
-import pandas as pd
 
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 import matplotlib.colors as col
 from mpl_toolkits.mplot3d import Axes3D
 
+from lib.config import get_config
+from lib.histograms import PhasePlaneHistogram, phase_plane_file
+from lib.optical_flow import get_opt_flow_data
+
+# Columns of the optical flow data used by the phase planes
+KINEMATIC_COLUMNS = ['x_vel', 'y_vel', 'x_accel', 'y_accel']
+
 
 def mag_and_phase_from_xy(x, y, normalized=False):
     mag = np.sqrt(x ** 2 + y ** 2)
@@ -63,20 +69,115 @@ def hist3d_whole_video(x, y):
     # plt.ion()
 
 
-def hist2d_whole_video(video_files):
+def load_phase_plane_params():
+    return get_config()['phase_plane']
+
+
+def get_phase_plane(video_file, eye, quantity='magnitude', params=None):
+    """
+    Loads the phase plane histogram of an eye (see lib/histograms.py). If it was not saved by
+    the optical flow stage (or its bins differ from params.json), it is computed from the tracks and saved.
+    :param video_file: path to the video
+    :param eye: 'left' or 'right'
+    :param quantity: 'magnitude' or 'phase'
+    :param params: phase plane parameters (if None, they are loaded from params.json)
+    :return: PhasePlaneHistogram
+    """
+    histogram = PhasePlaneHistogram.from_params(params or load_phase_plane_params(), quantity)
+
+    filename = phase_plane_file(video_file, eye, quantity)
+    if os.path.isfile(filename):
+        saved = PhasePlaneHistogram.load(filename)
+        if saved.compatible(histogram):
+            return saved
+
+    histogram.update_df(get_opt_flow_data(video_file, eye, columns=KINEMATIC_COLUMNS))
+    histogram.save(filename)
+    return histogram
+
+
+def cohort_phase_plane(video_files, eyes=('left', 'right'), quantity='magnitude'):
+    """
+    Phase plane of a group of subjects (both eyes of every video merged).
+    :param video_files: list of paths to the videos of the cohort
+    :param eyes: eyes to be merged
+    :param quantity: 'magnitude' or 'phase'
+    :return: PhasePlaneHistogram
+    """
+    params = load_phase_plane_params()
+    return PhasePlaneHistogram.merge(get_phase_plane(video_file, eye, quantity, params)
+                                     for video_file in video_files for eye in eyes)
+
+
+def plot_histogram(ax, histogram):
+    """
+    Plots a phase plane histogram (log scale) on its bins.
+    :param ax: matplotlib axes
+    :param histogram: PhasePlaneHistogram
+    """
+    ax.pcolormesh(histogram.vel_edges, histogram.accel_edges, np.log1p(histogram.density().T), cmap=plt.cm.jet)
+
+
+def hist2d_whole_video(video_files, quantity='phase'):
     plt.style.use('ggplot')
     fig, axarr = plt.subplots(len(video_files), 2, sharex=True, sharey=True)
 
+    params = load_phase_plane_params()
     for i, video_file in enumerate(video_files):
-        for j in range(0, 2):
-            if j == 0:
-                df = pd.read_csv(os.path.join(os.path.dirname(video_file), 'optical_flow', 'left_eye_optical_flow.csv'))
-            elif j == 1:
-                df = pd.read_csv(os.path.join(os.path.dirname(video_file), 'optical_flow', 'right_eye_optical_flow.csv'))
-
-            x = mag_and_phase_from_xy(df['x_vel'], df['y_vel'], normalized=True)[1]
-            y = mag_and_phase_from_xy(df['x_accel'], df['y_accel'], normalized=True)[1]
-            axarr[i, j].hist2d(x, y, bins=50, cmap=plt.cm.jet)
+        for j, eye in enumerate(['left', 'right']):
+            plot_histogram(axarr[i, j], get_phase_plane(video_file, eye, quantity, params))
+
+
+def plot_phase_planes(opt_flow_nc, opt_flow_cp, eyes=('left', 'right')):
+    """
+    Plots the velocity/acceleration phase planes of a control and a CP subject (one row per eye).
+    :param opt_flow_nc: dict {'left': DataFrame, 'right': DataFrame} with the optical flow of the control subject
+    :param opt_flow_cp: dict {'left': DataFrame, 'right': DataFrame} with the optical flow of the CP subject
+    :param eyes: eyes to be plotted
+    :return: phase plane plot (needs plt.show() to work)
+    """
+    plt.style.use('ggplot')
+    plt.figure()
+
+    params = load_phase_plane_params()
+    for i, eye in enumerate(eyes):
+        df_nc = opt_flow_nc[eye]
+        df_cp = opt_flow_cp[eye]
+
+        # Fixed-bin phase planes (the same grid for both subjects)
+        var_nc = PhasePlaneHistogram.from_params(params).update_df(df_nc).density().var()
+        var_cp = PhasePlaneHistogram.from_params(params).update_df(df_cp).density().var()
+
+        # Create velocity and acceleration vectors
+        vel_mag_nc = mag_and_phase_from_xy(df_nc['x_vel'], df_nc['y_vel'], normalized=True)[0]
+        accel_mag_nc = mag_and_phase_from_xy(df_nc['x_accel'], df_nc['y_accel'], normalized=True)[0]
+
+        vel_mag_cp = mag_and_phase_from_xy(df_cp['x_vel'], df_cp['y_vel'], normalized=True)[0]
+        accel_mag_cp = mag_and_phase_from_xy(df_cp['x_accel'], df_cp['y_accel'], normalized=True)[0]
+
+        # Plot the results
+        plt.subplot(2, 2, 2 * i + 1)
+        plt.scatter(vel_mag_nc, accel_mag_nc)
+        if i == 0:
+            plt.title('Control Patient')
+            plt.ylabel('%s eye acceleration' % eye.title())
+        elif i == 1:
+            plt.ylabel('%s eye acceleration' % eye.title())
+            plt.xlabel('Eye velocity')
+        plt.ylim([-0.2, 1.2])
+        plt.legend(('Var = %.2E' % var_nc,), loc='lower right')
+        plt.ticklabel_format(style='sci', axis='y', scilimits=(0, 0))
+
+        plt.subplot(2, 2, 2 * (i + 1))
+        plt.scatter(vel_mag_cp, accel_mag_cp, color='blue')
+        if i == 0:
+            plt.title('CP Patient')
+        elif i == 1:
+            plt.xlabel('Eye velocity')
+
+        plt.ylim([-0.2, 1])
+        plt.legend(('Var = %.2E' % var_cp,), loc='lower right')
+        plt.ticklabel_format(style='sci', axis='y', scilimits=(0, 0))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""
+PREVIEW
+@Description: Live preview of the processing in a separate thread. Only the latest frame of each
+window is kept (stale frames are dropped), so showing the frames never throttles the processing.
+"""
+
+import threading
+
+import cv2
+
+
+class Preview(object):
+    """
+    Shows images with cv2.imshow from a background thread.
+    Usage:
+        preview = Preview().start()
+        preview.show('left_eye', img)  # Never blocks
+        if preview.stopped:  # 'q' was pressed
+            ...
+        preview.close()
+    """
+
+    def __init__(self, refresh_ms=30):
+        """
+        :param refresh_ms: time to wait for key events between window refreshes (milliseconds)
+        """
+        self.refresh_ms = refresh_ms
+        self.stopped = False
+
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._new_frame = threading.Event()
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='preview')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def show(self, window_name, img):
+        """
+        Replaces the image to be shown in a window. The image must not be modified afterwards.
+        :param window_name: name of the window
+        :param img: image to be shown
+        """
+        with self._lock:
+            self._frames[window_name] = img
+        self._new_frame.set()
+
+    def close(self):
+        """
+        Stops the preview thread and closes its windows.
+        """
+        self._closing.set()
+        self._new_frame.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._closing.is_set():
+            self._new_frame.wait(self.refresh_ms / 1000.)
+            self._new_frame.clear()
+
+            # Take only the latest frame of each window
+            with self._lock:
+                frames, self._frames = self._frames, {}
+
+            for window_name, img in frames.items():
+                cv2.imshow(window_name, img)
+
+            # Check for interruption
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.stopped = True
+
+        cv2.destroyAllWindows()
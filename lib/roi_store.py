@@ -0,0 +1,225 @@
+"""
+ROI STORE
+@Description: Gray scale crops of the eye ROIs of every frame, decoded once (right after the eye
+detection / ROI tracking) so the following stages read them at disk speed instead of decoding the
+whole video again. Each eye is saved as a raw uint8 array (frames, h, w) that is memory-mapped when
+loaded (slicing does not copy), with a frame index sidecar and a JSON file with the metadata:
+
+    [video folder]/roi_frames/left_eye.u8
+    [video folder]/roi_frames/right_eye.u8
+    [video folder]/roi_frames/frame_index.npy : frame index of each row (as given by FrameReader)
+    [video folder]/roi_frames/roi_frames.json : shape and ROI of each eye, and signature (size and
+                                                modification time) of the video and ROI track
+
+A store is only used when it was written from the same video, ROIs and ROI track (see load_roi_store).
+"""
+
+import os
+import json
+import shutil
+
+import numpy as np
+
+from lib.config import get_config
+from lib.eyes_extraction import load_eyes_detection
+from lib.frame_index import file_signature
+from lib.frame_source import open_reader
+from lib.instrumentation import NullTimer, StageTimer, get_logger
+from lib.roi_tracking import load_roi_track, roi_track_file
+
+logger = get_logger(__name__)
+
+EYE_KEYS = ('left_eye', 'right_eye')
+METADATA_FILE = 'roi_frames.json'
+FRAME_INDEX_FILE = 'frame_index.npy'
+
+
+def roi_store_folder(video_file):
+    """
+    :param video_file: path to the video
+    :return: path to the ROI store folder of the video
+    """
+    return os.path.join(os.path.dirname(video_file), 'roi_frames')
+
+
+class RoiFrameStore(object):
+    """
+    Memory-mapped ROI frames.
+    Usage:
+        store = RoiFrameStore(folder)
+        left = store.frames('left_eye')          # array (n_frames, h, w), nothing is read yet
+        for frame_index, crops, _ in store.read(['left_eye', 'right_eye'], start=100):
+            ...                                  # same items as FrameReader (without the frame)
+    """
+
+    def __init__(self, folder):
+        """
+        :param folder: path to the store folder
+        """
+        self.folder = folder
+        with open(os.path.join(folder, METADATA_FILE), 'r') as json_file:
+            self.metadata = json.load(json_file)
+        self.frame_index = np.load(os.path.join(folder, FRAME_INDEX_FILE))
+        self._frames = {}
+
+    def __len__(self):
+        return len(self.frame_index)
+
+    def frames(self, eye):
+        """
+        :param eye: 'left_eye' or 'right_eye'
+        :return: read-only memory-mapped array (n_frames, h, w)
+        """
+        if eye not in self._frames:
+            meta = self.metadata['eyes'][eye]
+            self._frames[eye] = np.memmap(os.path.join(self.folder, meta['file']), dtype=np.uint8, mode='r',
+                                          shape=tuple(meta['shape']))
+        return self._frames[eye]
+
+    def rows(self, start=None, stop=None):
+        """
+        Rows of the frames after start up to stop (same as the start and stop of FrameReader).
+        :return: first and last (exclusive) row
+        """
+        first = 0 if start is None else int(np.searchsorted(self.frame_index, start, side='right'))
+        last = len(self.frame_index) if stop is None else int(np.searchsorted(self.frame_index, stop, side='right'))
+        return first, max(first, last)
+
+    def covers(self, start=None):
+        """
+        Checks if the store has every frame after start (the video is stored from the eye detection on).
+        """
+        return len(self.frame_index) > 0 and (start is None or start + 1 >= self.frame_index[0])
+
+    def read(self, eye_keys, start=None, stop=None):
+        """
+        Iterates over the ROI frames (views of the memory-mapped arrays, no copy).
+        :param eye_keys: list of eyes ('left_eye' and/or 'right_eye')
+        :param start: frames after start are read (as the start of FrameReader, None for all)
+        :param stop: index of the last frame to be read (None for the end)
+        :return: generator of (frame_index, {eye: gray ROI}, None)
+        """
+        frames = {eye: self.frames(eye) for eye in eye_keys}
+        first, last = self.rows(start, stop)
+        for row in range(first, last):
+            yield self.frame_index[row], {eye: frames[eye][row] for eye in eye_keys}, None
+
+    def matches(self, video_file, rois, eye_keys=EYE_KEYS):
+        """
+        Checks if the store was written from the current video and ROI track, with the same ROIs.
+        :param video_file: path to the video
+        :param rois: eyes detection data (as returned by eye_extraction)
+        :param eye_keys: eyes to be checked
+        """
+        return (self.metadata['video'] == file_signature(video_file) and
+                self.metadata['roi_track'] == file_signature(roi_track_file(video_file)) and
+                all(self.metadata['eyes'][eye]['roi'] == {k: int(v) for k, v in rois[eye].items()}
+                    for eye in eye_keys))
+
+
+def write_roi_frames(video_file, folder, rois, roi_track=None, start=None, n_frames=None, queue_size=32,
+                     timer=None):
+    """
+    Decodes the eye ROIs of a video into a ROI store (previous content of the folder is deleted).
+    :param video_file: path to the video
+    :param folder: path to the store folder
+    :param rois: eyes detection data (as returned by eye_extraction)
+    :param roi_track: RoiTrack with the eye ROIs per frame (None for fixed ROIs)
+    :param start: frames after start are stored (as the start of FrameReader, None for all)
+    :param n_frames: maximum number of frames (None for the whole video)
+    :param queue_size: number of frames decoded in advance
+    :param timer: StageTimer (see lib/instrumentation.py). If None, nothing is timed
+    :return: RoiFrameStore
+    """
+    timer = timer or NullTimer()
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+    eyes = {}
+    for eye in EYE_KEYS:
+        roi = {k: int(v) for k, v in rois[eye].items()}
+        eyes[eye] = {'file': eye + '.u8', 'roi': roi,
+                     'shape': [0, roi['y_max'] - roi['y_min'], roi['x_max'] - roi['x_min']]}
+
+    reader = open_reader(video_file, rois={eye: rois[eye] for eye in EYE_KEYS}, start=start,
+                         stop=None if start is None or n_frames is None else start + n_frames,
+                         queue_size=queue_size, roi_track=roi_track, timer=timer)
+    files = {eye: open(os.path.join(folder, eyes[eye]['file']), 'wb') for eye in EYE_KEYS}
+    frame_index = []
+    try:
+        for index, crops, _ in reader:
+            if n_frames is not None and len(frame_index) == n_frames:
+                break
+            with timer.frame():
+                for eye in EYE_KEYS:
+                    if crops[eye].shape != tuple(eyes[eye]['shape'][1:]):
+                        raise ValueError('ROI of the %s out of the frame at frame %d' % (eye, index))
+                    files[eye].write(np.ascontiguousarray(crops[eye]).data)
+            frame_index.append(index)
+    finally:
+        reader.close()
+        for file_out in files.values():
+            file_out.close()
+
+    if not frame_index:
+        raise IOError('No frames stored from: %s' % video_file)
+
+    for eye in EYE_KEYS:
+        eyes[eye]['shape'][0] = len(frame_index)
+    np.save(os.path.join(folder, FRAME_INDEX_FILE), np.array(frame_index, dtype=np.int64))
+
+    # The metadata is written last: a store without it is incomplete
+    metadata = {'eyes': eyes, 'n_frames': len(frame_index), 'video': file_signature(video_file),
+                'roi_track': file_signature(roi_track_file(video_file)) if roi_track is not None else None}
+    with open(os.path.join(folder, METADATA_FILE), 'w') as json_file:
+        json.dump(metadata, json_file, sort_keys=True, indent=4)
+
+    return RoiFrameStore(folder)
+
+
+def build_roi_store(video_file, rois=None, roi_track=None):
+    """
+    ROI store stage: stores the eye ROIs of the whole video (from the frame where the eyes were detected)
+    in "roi_frames" (see the description of the module).
+    :param video_file: path to the video
+    :param rois: eyes detection data (as returned by eye_extraction). If None, it is loaded
+    from "eyes_detection.json"
+    :param roi_track: RoiTrack with the eye ROIs per frame. If None, it is loaded from "roi_track.csv"
+    when it exists, otherwise the ROIs of rois are used for every frame
+    :return: RoiFrameStore
+    """
+    if rois is None:
+        rois = load_eyes_detection(video_file)
+    if roi_track is None:
+        roi_track = load_roi_track(video_file)
+
+    folder = roi_store_folder(video_file)
+    timer = StageTimer('roi_frames')
+    store = write_roi_frames(video_file, folder, rois, roi_track, start=rois['frame_start'] - 1,
+                             queue_size=get_config()['reader']['queue_size'], timer=timer)
+
+    logger.info('ROI frames saved: %d frames' % len(store))
+    timer.extra['bytes'] = sum(os.path.getsize(os.path.join(folder, store.metadata['eyes'][eye]['file']))
+                               for eye in EYE_KEYS)
+    timer.write_report(folder)
+    return store
+
+
+def load_roi_store(video_file, rois, eye_keys=EYE_KEYS):
+    """
+    Loads the ROI store of a video if it is up to date (see RoiFrameStore.matches).
+    :param video_file: path to the video
+    :param rois: eyes detection data (as returned by eye_extraction)
+    :param eye_keys: eyes that are needed
+    :return: RoiFrameStore, None if there is no store (or it is out of date)
+    """
+    folder = roi_store_folder(video_file)
+    if not os.path.isfile(os.path.join(folder, METADATA_FILE)):
+        return None
+
+    store = RoiFrameStore(folder)
+    if not store.matches(video_file, rois, eye_keys):
+        logger.warning('ROI store out of date (decoding the video instead): %s' % folder)
+        return None
+    return store
@@ -0,0 +1,225 @@
+"""
+ROI TRACKING
+@Description: Follows the eye ROIs along the whole video (from the frame where the eyes were detected).
+The eyes are re-detected every N frames (see "roi_tracking/redetect_every" in params.json) and, in
+between, each box is propagated by template matching inside a small search window around its
+previous position. Re-detections that jump more than "roi_tracking/max_jump" pixels from the
+tracked box are ignored unless the next re-detection confirms them. The size of the boxes is the
+one of the first detection, so the crops keep the same shape along the video. Saves as result:
+- roi_track.csv : ROI of each eye per frame (inside the "eyes_detection" folder)
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from lib.config import get_config
+from lib.eyes_extraction import crop_roi, detect_eyes, load_cascades, load_eyes_detection, select_eyes
+from lib.frame_source import FrameReader
+from lib.instrumentation import StageTimer, get_logger
+
+logger = get_logger(__name__)
+
+EYE_KEYS = ('left_eye', 'right_eye')
+BOUNDARIES = ('x_min', 'x_max', 'y_min', 'y_max')
+
+
+class RoiTrack(object):
+    """
+    ROI of each eye per frame.
+    """
+
+    def __init__(self, frames, boxes):
+        """
+        :param frames: frame indices (sorted)
+        :param boxes: dict {eye: array (n_frames, 4)} with the boundaries (x_min, x_max, y_min, y_max)
+        """
+        self.frames = np.asarray(frames)
+        self.boxes = {eye: np.asarray(box, dtype=np.int32) for eye, box in boxes.items()}
+
+    def roi(self, eye, frame_index):
+        """
+        ROI of an eye in a frame (the last known ROI for frames that are not in the track).
+        :param eye: 'left_eye' or 'right_eye'
+        :param frame_index: frame index
+        :return: dict with the boundaries of the ROI ('x_min', 'x_max', 'y_min', 'y_max')
+        """
+        i = np.searchsorted(self.frames, frame_index, side='right') - 1
+        i = min(max(i, 0), len(self.frames) - 1)
+        return dict(zip(BOUNDARIES, (int(v) for v in self.boxes[eye][i])))
+
+    def save(self, filename):
+        df = pd.DataFrame({'frame': self.frames})
+        for eye, box in self.boxes.items():
+            for j, boundary in enumerate(BOUNDARIES):
+                df[eye + '_' + boundary] = box[:, j]
+        df.to_csv(filename, index=False)
+
+    @classmethod
+    def load(cls, filename):
+        df = pd.read_csv(filename)
+        boxes = {eye: df[[eye + '_' + boundary for boundary in BOUNDARIES]].values
+                 for eye in EYE_KEYS if eye + '_x_min' in df}
+        return cls(df['frame'].values, boxes)
+
+
+def roi_track_file(video_file):
+    """
+    :param video_file: path to the video
+    :return: path to the ROI track file of the video
+    """
+    return os.path.join(os.path.dirname(video_file), 'eyes_detection', 'roi_track.csv')
+
+
+def load_roi_track(video_file):
+    """
+    Loads the ROI track of a video (see track_eye_rois).
+    :param video_file: path to the video
+    :return: RoiTrack or None if the video has no ROI track
+    """
+    filename = roi_track_file(video_file)
+    if not os.path.isfile(filename):
+        return None
+    return RoiTrack.load(filename)
+
+
+def clamp_box(x, y, w, h, frame_shape):
+    """
+    Keeps a box (top-left corner x, y and size w, h) inside the frame.
+    """
+    x = int(min(max(x, 0), frame_shape[1] - w))
+    y = int(min(max(y, 0), frame_shape[0] - h))
+    return x, y
+
+
+def box_distance(a, b):
+    """
+    Distance (pixels, largest of both axes) between the top-left corners (x, y) of two boxes.
+    """
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+
+def match_template(gray, template, x, y, search_margin):
+    """
+    Looks for a template around its previous position.
+    :param gray: gray frame
+    :param template: gray image of the eye
+    :param x: previous x position (top-left corner)
+    :param y: previous y position (top-left corner)
+    :param search_margin: size of the search window around the box (fraction of the box size)
+    :return: new position (x, y) and matching score (normalized correlation)
+    """
+    h, w = template.shape
+    margin_x, margin_y = int(search_margin * w), int(search_margin * h)
+    x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+    x1, y1 = min(x + w + margin_x, gray.shape[1]), min(y + h + margin_y, gray.shape[0])
+
+    result = cv2.matchTemplate(gray[y0: y1, x0: x1], template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (best_x, best_y) = cv2.minMaxLoc(result)
+    return x0 + best_x, y0 + best_y, score
+
+
+def track_eye_rois(video_file, rois=None):
+    """
+    Tracks the eye ROIs along the video and saves them in "roi_track.csv".
+    :param video_file: path to the video
+    :param rois: eyes detection data (as returned by eye_extraction). If None, it is loaded
+    from "eyes_detection.json"
+    :return: RoiTrack
+    """
+    jf = get_config()
+    params = jf['roi_tracking']
+    detection = jf['detection']
+    queue_size = jf['reader']['queue_size']
+
+    if rois is None:
+        rois = load_eyes_detection(video_file)
+    frame_start = rois['frame_start']
+
+    eye_cascade, face_cascade = load_cascades(detection['mode'])
+
+    # Size of the boxes (fixed) and position of their top-left corner
+    sizes = {eye: (rois[eye]['x_max'] - rois[eye]['x_min'], rois[eye]['y_max'] - rois[eye]['y_min'])
+             for eye in EYE_KEYS}
+    positions = {eye: (rois[eye]['x_min'], rois[eye]['y_min']) for eye in EYE_KEYS}
+    templates = {}
+
+    # Re-detections far from the tracked box (rejected unless the next re-detection confirms them)
+    rejected = {eye: None for eye in EYE_KEYS}
+
+    frames = []
+    boxes = {eye: [] for eye in EYE_KEYS}
+
+    # Start at the frame where the eyes were detected (same gray conversion as the detection)
+    timer = StageTimer('roi_tracking')
+    reader = FrameReader(video_file, start=frame_start - 1, queue_size=queue_size,
+                         color_conversion=cv2.COLOR_RGB2GRAY, timer=timer)
+
+    logger.info('Tracking eye ROIs from frame: %d' % frame_start)
+    for frame_index, crops, _ in reader:
+        frame_time = time.perf_counter()
+        gray = crops['frame']
+        n = int(frame_index - frame_start)
+
+        # Re-detect the eyes every N frames (keeping the size of the boxes). A re-detection that
+        # jumps more than max_jump pixels from the tracked box is only accepted when the next
+        # re-detection confirms it (e.g. the template lost the eye)
+        redetected = set()
+        if n > 0 and n % params['redetect_every'] == 0:
+            with timer.section('detect'):
+                data = select_eyes(detect_eyes(gray, eye_cascade, face_cascade, detection['face_scale'],
+                                               detection['upper_face'], detection['scale_factor'],
+                                               detection['min_neighbors']), reader.frame_height)
+            if data:
+                for eye in EYE_KEYS:
+                    w, h = sizes[eye]
+                    center_x = (data[eye]['x_min'] + data[eye]['x_max']) / 2.
+                    center_y = (data[eye]['y_min'] + data[eye]['y_max']) / 2.
+                    detected = clamp_box(center_x - w / 2., center_y - h / 2., w, h, gray.shape)
+
+                    confirmed = (rejected[eye] is not None and
+                                 box_distance(detected, rejected[eye]) <= params['max_jump'])
+                    if box_distance(detected, positions[eye]) <= params['max_jump'] or confirmed:
+                        positions[eye] = detected
+                        rejected[eye] = None
+                        redetected.add(eye)
+                    else:
+                        logger.debug('Re-detection of the %s rejected at frame %d: %s (tracked: %s)'
+                                     % (eye, frame_index, detected, positions[eye]))
+                        rejected[eye] = detected
+
+        # Propagate the boxes in between
+        if n > 0:
+            for eye in EYE_KEYS:
+                if eye in redetected:
+                    continue
+                with timer.section('match'):
+                    x, y, score = match_template(gray, templates[eye], positions[eye][0], positions[eye][1],
+                                                 params['search_margin'])
+                if score >= params['min_score']:
+                    positions[eye] = (x, y)
+
+        frames.append(frame_index)
+        for eye in EYE_KEYS:
+            w, h = sizes[eye]
+            x, y = positions[eye]
+            box = {'x_min': x, 'x_max': x + w, 'y_min': y, 'y_max': y + h}
+            boxes[eye].append([box[boundary] for boundary in BOUNDARIES])
+
+            # Templates are taken from the detections only (no drift between re-detections)
+            if n == 0 or eye in redetected:
+                templates[eye] = crop_roi(gray, box).copy()
+        timer.add_frame(time.perf_counter() - frame_time)
+
+    reader.close()
+
+    roi_track = RoiTrack(frames, boxes)
+    filename = roi_track_file(video_file)
+    roi_track.save(filename)
+    logger.info('ROI track saved: %d frames' % len(frames))
+    timer.write_report(os.path.dirname(filename))
+
+    return roi_track
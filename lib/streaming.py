@@ -0,0 +1,290 @@
+"""
+STREAMING
+@Description: Live version of the pipeline for a camera (or a video file replayed at real-time rate).
+Each stage is a generator that consumes the samples of the previous one, so every frame goes
+through detection, optical flow, kinematics and the phase plane as soon as it is captured:
+
+    capture -> detect_eyes_stage -> track_stage -> kinematics_stage -> phase_plane_stage
+
+For cameras (and real-time replays) the capture keeps only the latest frames (bounded buffer,
+oldest frames are dropped), so the latency is bounded even if the processing falls behind. The latency of each
+frame (time from capture to kinematic sample) is reported by LatencyMonitor.
+"""
+
+import collections
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from lib.eyes_extraction import crop_roi, detect_eyes, load_cascades, select_eyes
+from lib.histograms import PhasePlaneHistogram
+from lib.instrumentation import get_logger
+from lib.track_table import TrackTable
+
+logger = get_logger(__name__)
+
+EYE_KEYS = ('left_eye', 'right_eye')
+
+
+class LiveSource(object):
+    """
+    Captures frames in a background thread and keeps only the latest ones.
+    Yields (frame_index, capture_time, frame).
+    """
+
+    def __init__(self, source, realtime=False, buffer_size=4, fps=None):
+        """
+        :param source: camera index (int) or path to a video file
+        :param realtime: replay a video file at its frame rate (cameras are always real-time)
+        :param buffer_size: number of frames kept. For cameras and real-time replays, older frames
+        are dropped when it is full. Otherwise the capture waits for room
+        :param fps: frame rate (if None, it is taken from the capture)
+        """
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError('Cannot open: %s' % source)
+
+        self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS)
+        self.realtime = realtime
+        self.drop_frames = realtime or isinstance(source, int)
+        self.dropped = 0
+
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._available = threading.Condition()
+        self._finished = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='live_source')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        try:
+            while True:
+                with self._available:
+                    while not self._buffer and not self._finished:
+                        self._available.wait(0.1)
+                    if not self._buffer:
+                        break
+                    item = self._buffer.popleft()
+                    self._available.notify()
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.cap.release()
+
+    def _run(self):
+        frame_index = 0
+        start = time.time()
+        while not self._stop.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            frame_index += 1
+
+            # Replay a file at the frame rate of the video
+            if self.realtime and self.fps:
+                delay = start + frame_index / self.fps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            with self._available:
+                while not self.drop_frames and len(self._buffer) == self._buffer.maxlen and not self._stop.is_set():
+                    self._available.wait(0.1)
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.dropped += 1
+                self._buffer.append((frame_index, time.time(), frame))
+                self._available.notify()
+
+        with self._available:
+            self._finished = True
+            self._available.notify()
+
+
+def detect_eyes_stage(frames, detection):
+    """
+    Looks for the eyes until a valid pair is found. From then on, the eye ROIs (fixed) of each
+    frame are yielded in gray scale.
+    :param frames: iterable of (frame_index, capture_time, frame)
+    :param detection: detection parameters (see "detection" in params.json)
+    :return: generator of (frame_index, capture_time, {eye: gray ROI})
+    """
+    eye_cascade, face_cascade = load_cascades(detection['mode'])
+    rois = None
+
+    for frame_index, capture_time, frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if rois is None:
+            eyes = detect_eyes(gray, eye_cascade, face_cascade, detection['face_scale'], detection['upper_face'],
+                               detection['scale_factor'], detection['min_neighbors'])
+            rois = select_eyes(eyes, gray.shape[0]) or None
+            if rois is None:
+                continue
+            logger.info('Eyes found at frame: %d' % frame_index)
+
+        yield frame_index, capture_time, {eye: crop_roi(gray, rois[eye]) for eye in EYE_KEYS}
+
+
+def track_stage(samples, feature_params, lk_params, min_features=20):
+    """
+    Lucas-Kanade optical flow on each eye ROI. Features keep their ID while they are tracked,
+    and new features are detected when fewer than min_features are left (see lib/track_table.py).
+    :param samples: iterable of (frame_index, capture_time, {eye: gray ROI})
+    :param feature_params: parameters of cv2.goodFeaturesToTrack
+    :param lk_params: parameters of cv2.calcOpticalFlowPyrLK
+    :param min_features: minimum number of tracked features before detecting new ones
+    :return: generator of (frame_index, capture_time, {eye: (ids, points)})
+    """
+    state = {}
+
+    for frame_index, capture_time, rois in samples:
+        tracked = {}
+        for eye, gray in rois.items():
+            if eye not in state:
+                state[eye] = {'gray': gray, 'table': TrackTable(feature_params, min_features)}
+                state[eye]['table'].seed(gray, frame_index)
+                continue
+
+            table = state[eye]['table']
+            if len(table):
+                p1, st, err = cv2.calcOpticalFlowPyrLK(state[eye]['gray'], gray, table.points, None, **lk_params)
+                table.update(p1, st, frame_index)
+                tracked[eye] = (table.ids, table.points.reshape(-1, 2))
+
+            if table.needs_seeding():
+                table.seed(gray, frame_index)
+            state[eye]['gray'] = gray
+
+        if tracked:
+            yield frame_index, capture_time, tracked
+
+
+def kinematics_stage(samples, fps):
+    """
+    Velocity and acceleration of each feature (backward differences with the time between frames).
+    Features without a previous sample have NaN velocity/acceleration.
+    :param samples: iterable of (frame_index, capture_time, {eye: (ids, points)})
+    :param fps: frames per second
+    :return: generator of (frame_index, capture_time, {eye: (ids, points, vel, accel)})
+    """
+    previous = {}
+
+    for frame_index, capture_time, tracked in samples:
+        kinematics = {}
+        for eye, (ids, points) in tracked.items():
+            vel = np.full(points.shape, np.nan)
+            accel = np.full(points.shape, np.nan)
+
+            if eye in previous:
+                prev_frame, prev_ids, prev_points, prev_vel = previous[eye]
+                dt = (frame_index - prev_frame) / float(fps)
+                _, current_idx, prev_idx = np.intersect1d(ids, prev_ids, assume_unique=True, return_indices=True)
+                vel[current_idx] = (points[current_idx] - prev_points[prev_idx]) / dt
+                accel[current_idx] = (vel[current_idx] - prev_vel[prev_idx]) / dt
+
+            previous[eye] = (frame_index, ids, points, vel)
+            kinematics[eye] = (ids, points, vel, accel)
+
+        yield frame_index, capture_time, kinematics
+
+
+def phase_plane_stage(samples, vel_edges, accel_edges):
+    """
+    Accumulates the velocity/acceleration magnitude phase plane of each eye (fixed bins, see
+    lib/histograms.py). The histograms are updated in place in the dict yielded with each sample.
+    :param samples: iterable of (frame_index, capture_time, {eye: (ids, points, vel, accel)})
+    :param vel_edges: bin edges of the velocity magnitude
+    :param accel_edges: bin edges of the acceleration magnitude
+    :return: generator of (frame_index, capture_time, kinematics, {eye: PhasePlaneHistogram})
+    """
+    histograms = {}
+
+    for frame_index, capture_time, kinematics in samples:
+        for eye, (ids, points, vel, accel) in kinematics.items():
+            if eye not in histograms:
+                histograms[eye] = PhasePlaneHistogram(vel_edges, accel_edges)
+            histograms[eye].update(vel[:, 0], vel[:, 1], accel[:, 0], accel[:, 1])
+
+        yield frame_index, capture_time, kinematics, histograms
+
+
+class LatencyMonitor(object):
+    """
+    Latency (time from capture to result) of the processed frames.
+    """
+
+    def __init__(self, report_every=1.):
+        """
+        :param report_every: seconds between reports (printed)
+        """
+        self.report_every = report_every
+        self.latencies = []
+        self._window = []
+        self._last_report = time.time()
+
+    def update(self, capture_time):
+        latency = time.time() - capture_time
+        self.latencies.append(latency)
+        self._window.append(latency)
+
+        if time.time() - self._last_report >= self.report_every:
+            logger.info('Latency: mean %.1f ms, max %.1f ms (%d frames)'
+                        % (1e3 * np.mean(self._window), 1e3 * np.max(self._window), len(self._window)))
+            self._window = []
+            self._last_report = time.time()
+        return latency
+
+    def summary(self):
+        """
+        :return: dict with the number of frames and the mean, 95th percentile and max latency (seconds)
+        """
+        if not self.latencies:
+            return {'n_frames': 0}
+        latencies = np.array(self.latencies)
+        return {'n_frames': len(latencies), 'mean': latencies.mean(),
+                'p95': np.percentile(latencies, 95), 'max': latencies.max()}
+
+
+def render_phase_plane(histogram, size=400):
+    """
+    Renders a phase plane histogram as an image (log scale), e.g. for the preview.
+    :param histogram: PhasePlaneHistogram
+    :param size: size of the image (pixels)
+    :return: BGR image
+    """
+    img = np.log1p(histogram.counts.T[::-1])  # Acceleration on the vertical axis (upwards)
+    if img.max() > 0:
+        img = img / img.max()
+    img = cv2.resize((255 * img).astype(np.uint8), (size, size), interpolation=cv2.INTER_NEAREST)
+    return cv2.applyColorMap(img, cv2.COLORMAP_JET)
+
+
+def stream(source, detection, feature_params, lk_params, fps, vel_edges, accel_edges,
+           realtime=False, buffer_size=4, min_features=20):
+    """
+    Chains the live stages.
+    :param source: camera index (int) or path to a video file
+    :param detection: detection parameters (see "detection" in params.json)
+    :param feature_params: parameters of cv2.goodFeaturesToTrack
+    :param lk_params: parameters of cv2.calcOpticalFlowPyrLK
+    :param fps: frames per second (used if the capture does not report it)
+    :param vel_edges: bin edges of the velocity magnitude
+    :param accel_edges: bin edges of the acceleration magnitude
+    :param realtime: replay a video file at its frame rate
+    :param buffer_size: number of captured frames kept (see LiveSource)
+    :param min_features: minimum number of tracked features before detecting new ones (see "opt_flow/min_features")
+    :return: LiveSource and generator of (frame_index, capture_time, kinematics, histograms)
+    """
+    source = LiveSource(source, realtime=realtime, buffer_size=buffer_size)
+    fps = source.fps or fps
+
+    samples = detect_eyes_stage(source, detection)
+    samples = track_stage(samples, feature_params, lk_params, min_features)
+    samples = kinematics_stage(samples, fps)
+    return source, phase_plane_stage(samples, vel_edges, accel_edges)
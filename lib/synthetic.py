@@ -0,0 +1,227 @@
+"""
+SYNTHETIC VIDEOS
+@Description: Deterministic synthetic videos of a face with moving eyes, e.g. for benchmarks. A
+face-like image (skin, eyebrows, nose, mouth) is drawn once; the irises (random texture, fixed seed)
+move inside the eyes along a known trajectory made of saccades, smooth pursuit and tremor, with
+sub-pixel translations. The whole face can also move (head motion), and the eyes can be closed during
+the first frames (so the eye detection scans a known number of frames). Saves as results:
+- video.mp4                : synthetic video
+- trajectory.csv           : iris offset of each eye and head offset per frame (pixels)
+- eyes_detection/eyes_detection.json : ground truth eye ROIs (same format as eye_extraction)
+"""
+
+import os
+import json
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from lib.config import get_config
+from lib.instrumentation import get_logger
+
+EYE_KEYS = ('left_eye', 'right_eye')
+
+logger = get_logger(__name__)
+
+
+def eye_trajectory(n_frames, fps=120, amplitude=8., seed=0):
+    """
+    Iris offset (x, y) per frame: saccades (fast, smooth steps between fixations), smooth pursuit
+    (sinusoid) and tremor (small noise).
+    :param n_frames: number of frames
+    :param fps: frames per second
+    :param amplitude: maximum offset (pixels)
+    :param seed: random seed
+    :return: array (n_frames, 2)
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(n_frames) / float(fps)
+
+    # Saccades: a new fixation every 0.3-1 s, reached in ~40 ms (logistic transition)
+    fixations = np.zeros((n_frames, 2))
+    current = np.zeros(2)
+    start = 0
+    while start < n_frames:
+        target = rng.uniform(-0.6, 0.6, 2) * amplitude
+        transition = 1. / (1. + np.exp(-(np.arange(n_frames - start) / float(fps) - 0.02) / 0.006))
+        fixations[start:] = current + np.outer(transition, target - current)
+        current = target
+        start += int(rng.uniform(0.3, 1.) * fps)
+
+    # Smooth pursuit and tremor
+    pursuit = 0.3 * amplitude * np.column_stack([np.sin(2 * np.pi * 0.5 * t), np.sin(2 * np.pi * 0.3 * t)])
+    tremor = rng.normal(0, 0.05, (n_frames, 2))
+
+    return np.clip(fixations + pursuit + tremor, -amplitude, amplitude)
+
+
+def head_trajectory(n_frames, fps=120, amplitude=0., seed=1):
+    """
+    Head offset (x, y) per frame (slow drift).
+    :param n_frames: number of frames
+    :param fps: frames per second
+    :param amplitude: maximum offset (pixels)
+    :param seed: random seed
+    :return: array (n_frames, 2)
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(n_frames) / float(fps)
+    phase = rng.uniform(0, 2 * np.pi, 2)
+    return amplitude * np.column_stack([np.sin(2 * np.pi * 0.1 * t + phase[0]),
+                                        np.sin(2 * np.pi * 0.07 * t + phase[1])])
+
+
+def draw_face(width, height, seed=0):
+    """
+    Static part of the synthetic face. The features are drawn with soft edges (blurred), so the
+    Haar cascades of the eye detection find the face and the eyes.
+    :param width: width of the video
+    :param height: height of the video
+    :param seed: random seed (texture of the irises)
+    :return: face image (BGR), face image with closed eyes (BGR), eye ROIs ({eye: {'x_min', 'x_max',
+    'y_min', 'y_max'}}), iris layer (BGR) and mask (float32) per eye, and sclera mask (float32) per eye
+    """
+    rng = np.random.RandomState(seed)
+    img = np.full((height, width, 3), (90, 100, 110), dtype=np.uint8)
+    sigma = max(width / 640., 1.)
+
+    # Face (upper part of the frame) and its features
+    cx, cy = width // 2, int(height * 0.45)
+    face_w, face_h = int(width * 0.18), int(height * 0.38)
+    cv2.ellipse(img, (cx, cy), (face_w, face_h), 0, 0, 360, (140, 170, 210), -1)
+    cv2.ellipse(img, (cx, cy + int(face_h * 0.55)), (int(face_w * 0.35), int(face_h * 0.08)), 0, 0, 180,
+                (80, 80, 150), -1)
+    cv2.line(img, (cx, cy - int(face_h * 0.05)), (cx, cy + int(face_h * 0.25)), (110, 140, 180), 3)
+
+    eye_w = int(face_w * 0.25)
+    eye_h = int(eye_w * 0.45)
+    iris_r = int(eye_h * 0.95)
+    rois, layers, masks, scleras = {}, {}, {}, {}
+    closed = img.copy()
+
+    # The left eye is on the right of the image (as in select_eyes)
+    for eye, sign in zip(EYE_KEYS, (1, -1)):
+        ex, ey = cx + sign * int(face_w * 0.45), cy - int(face_h * 0.2)
+
+        # Eyebrow (also with closed eyes) and closed eyelid
+        for image in (img, closed):
+            cv2.ellipse(image, (ex, ey - int(1.7 * eye_h)), (int(eye_w * 1.1), int(eye_h * 0.8)), 0, 200, 340,
+                        (50, 60, 80), max(eye_h // 3, 2))
+        cv2.ellipse(closed, (ex, ey), (eye_w, eye_h // 3), 0, 0, 180, (90, 110, 150), max(eye_h // 6, 1))
+
+        # Sclera and upper eyelid
+        cv2.ellipse(img, (ex, ey), (eye_w, eye_h), 0, 0, 360, (220, 225, 225), -1)
+        cv2.ellipse(img, (ex, ey), (eye_w, eye_h), 0, 180, 360, (40, 40, 60), max(eye_h // 4, 2))
+
+        # ROI: square box around the eye (as the detections of the eye cascade)
+        half = int(1.2 * eye_w)
+        roi = {'x_min': ex - half, 'x_max': ex + half, 'y_min': ey - half, 'y_max': ey + half}
+        h, w = roi['y_max'] - roi['y_min'], roi['x_max'] - roi['x_min']
+        center = (ex - roi['x_min'], ey - roi['y_min'])
+
+        sclera = np.zeros((h, w), dtype=np.float32)
+        cv2.ellipse(sclera, center, (eye_w - max(eye_h // 4, 2), eye_h - max(eye_h // 4, 2)), 0, 0, 360, 1., -1)
+
+        # Iris: textured disk with a pupil (it is translated on every frame)
+        texture = rng.randint(30, 80, (h, w)).astype(np.uint8)
+        texture = cv2.GaussianBlur(texture, (3, 3), 0)
+        layer = cv2.cvtColor(texture, cv2.COLOR_GRAY2BGR)
+        layer[..., 0] = np.clip(layer[..., 0].astype(np.int32) - 20, 0, 255)
+        cv2.circle(layer, center, int(eye_h * 0.4), (15, 15, 15), -1)
+        mask = np.zeros((h, w), dtype=np.float32)
+        cv2.circle(mask, center, iris_r, 1., -1)
+
+        rois[eye], layers[eye] = roi, layer
+        masks[eye] = cv2.GaussianBlur(mask, (0, 0), sigma)
+        scleras[eye] = cv2.GaussianBlur(sclera, (0, 0), sigma)
+
+    return (cv2.GaussianBlur(img, (0, 0), sigma), cv2.GaussianBlur(closed, (0, 0), sigma), rois, layers, masks,
+            scleras)
+
+
+def translate(img, dx, dy, border=cv2.BORDER_CONSTANT):
+    """
+    Sub-pixel translation of an image.
+    """
+    m = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(img, m, (img.shape[1], img.shape[0]), flags=cv2.INTER_LINEAR, borderMode=border)
+
+
+def generate_video(folder, n_frames=1200, fps=120, width=1280, height=720, eye_amplitude=8.,
+                   head_amplitude=0., closed_frames=0, seed=0):
+    """
+    Generates a synthetic video (see the description of the module). The same parameters always
+    give the same video.
+    :param folder: output folder (video.mp4 and the rest of the results are saved in it)
+    :param n_frames: number of frames
+    :param fps: frames per second
+    :param width: width of the video
+    :param height: height of the video
+    :param eye_amplitude: maximum iris offset (pixels)
+    :param head_amplitude: maximum head offset (pixels)
+    :param closed_frames: number of frames with closed eyes at the beginning of the video
+    :param seed: random seed
+    :return: path to the video
+    """
+    if not 0 <= closed_frames < n_frames:
+        raise ValueError('The number of frames with closed eyes must be in [0, %d)' % n_frames)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    video_file = os.path.join(folder, 'video.mp4')
+
+    face, closed, rois, layers, masks, scleras = draw_face(width, height, seed)
+    eye_offsets = {eye: eye_trajectory(n_frames, fps, eye_amplitude, seed + i) for i, eye in enumerate(EYE_KEYS)}
+    head_offsets = head_trajectory(n_frames, fps, head_amplitude, seed + 10)
+
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise IOError('Cannot write: %s' % video_file)
+
+    logger.info('Generating synthetic video: %s (%d frames, %dx%d)' % (video_file, n_frames, width, height))
+    frame = np.empty_like(face)
+    for i in range(n_frames):
+        np.copyto(frame, face if i >= closed_frames else closed)
+        for eye in EYE_KEYS if i >= closed_frames else ():
+            roi = rois[eye]
+            dx, dy = eye_offsets[eye][i]
+            iris = translate(layers[eye], dx, dy).astype(np.float32)
+            alpha = (translate(masks[eye], dx, dy) * scleras[eye])[..., None]
+
+            region = frame[roi['y_min']: roi['y_max'], roi['x_min']: roi['x_max']]
+            region[:] = (alpha * iris + (1 - alpha) * region).astype(np.uint8)
+
+        if head_amplitude:
+            frame = translate(frame, head_offsets[i][0], head_offsets[i][1], cv2.BORDER_REPLICATE)
+        writer.write(frame)
+    writer.release()
+
+    # Ground truth
+    trajectory = pd.DataFrame({'frame': np.arange(1, n_frames + 1)})
+    for eye in EYE_KEYS:
+        trajectory[eye + '_x'], trajectory[eye + '_y'] = eye_offsets[eye][:, 0], eye_offsets[eye][:, 1]
+    trajectory['head_x'], trajectory['head_y'] = head_offsets[:, 0], head_offsets[:, 1]
+    trajectory.to_csv(os.path.join(folder, 'trajectory.csv'), index=False)
+    write_eyes_detection(video_file, rois, frame_start=closed_frames + 1.)
+
+    return video_file
+
+
+def write_eyes_detection(video_file, rois, frame_start=1.):
+    """
+    Saves the ground truth eye ROIs as the eyes detection file (see eye_extraction), so the following
+    stages can be run without the detection.
+    :param video_file: path to the video
+    :param rois: dict {eye: {'x_min', 'x_max', 'y_min', 'y_max'}}
+    :param frame_start: frame where the eyes are detected
+    """
+    eyes_file = get_config()['eye_detection_json']
+
+    folder = os.path.join(os.path.dirname(video_file), 'eyes_detection')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    data = {eye: {k: int(v) for k, v in rois[eye].items()} for eye in EYE_KEYS}
+    data['frame_start'] = frame_start
+    with open(os.path.join(folder, eyes_file), 'w') as json_file:
+        json.dump(data, json_file, sort_keys=True, indent=4)
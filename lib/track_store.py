@@ -0,0 +1,72 @@
+"""
+TRACK STORE
+@Description: Typed columnar storage for the optical flow tracks. Each column is saved as a
+NumPy array (*.npy) inside a folder per subject and eye:
+
+    [video folder]/optical_flow/left_eye/frame.npy
+    [video folder]/optical_flow/left_eye/x_vel.npy
+    ...
+
+Only the columns that are used are read from disk. They can also be memory-mapped (only the pages
+that are used are read), as plain arrays: a DataFrame would copy them into memory.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Columns of the optical flow tracks and their types
+DTYPES = {
+    'frame': np.int32,
+    'feature_id': np.int32,
+    'x_pos': np.float32,
+    'y_pos': np.float32,
+    'x_vel': np.float32,
+    'y_vel': np.float32,
+    'x_accel': np.float32,
+    'y_accel': np.float32
+}
+COLUMNS = ('frame', 'feature_id', 'x_pos', 'y_pos', 'x_vel', 'y_vel', 'x_accel', 'y_accel')
+
+
+def write_tracks(folder, df):
+    """
+    Saves a DataFrame of tracks as one *.npy file per column (previous content of the folder is deleted).
+    :param folder: path to the store folder (e.g. [video folder]/optical_flow/left_eye)
+    :param df: DataFrame with the tracks (see COLUMNS)
+    """
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+    for column in df.columns:
+        values = df[column].values
+        np.save(os.path.join(folder, column + '.npy'), values.astype(DTYPES.get(column, values.dtype)))
+
+
+def read_tracks(folder, columns=None, mmap=False):
+    """
+    Loads the tracks saved with write_tracks.
+    :param folder: path to the store folder
+    :param columns: list of columns to be loaded (None for all)
+    :param mmap: memory-map the columns instead of reading them into memory
+    :return: DataFrame with the tracks, or dict {column: memory-mapped array} if mmap is True
+    """
+    if columns is None:
+        available = [f[:-4] for f in os.listdir(folder) if f.endswith('.npy')]
+        columns = [c for c in COLUMNS if c in available] + sorted(c for c in available if c not in COLUMNS)
+
+    if mmap:
+        return {column: np.load(os.path.join(folder, column + '.npy'), mmap_mode='r') for column in columns}
+    return pd.DataFrame({column: np.load(os.path.join(folder, column + '.npy')) for column in columns},
+                        columns=columns)
+
+
+def is_track_store(folder):
+    """
+    Checks if a folder contains a track store.
+    :param folder: path to the folder
+    """
+    return os.path.isfile(os.path.join(folder, 'frame.npy'))
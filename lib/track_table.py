@@ -0,0 +1,226 @@
+"""
+TRACK TABLE
+@Description: Features tracked by the optical flow, with persistent IDs. Each feature keeps its ID
+(feature_id) while it is tracked, lost features are removed and new features are detected
+(Shi-Tomasi corners, away from the tracked ones) when the number of tracked features drops below
+a threshold. The birth and death frame of every track are recorded.
+Tracks of consecutive chunks of a video (tracked in parallel) are joined with stitch_tracks.
+"""
+
+import cv2
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+class TrackTable(object):
+    """
+    Tracked features of one ROI.
+    Usage:
+        table = TrackTable(feature_params, min_features=20)
+        table.seed(first_gray, first_frame)
+        for frame_index, gray in frames:
+            p1, st, err = cv2.calcOpticalFlowPyrLK(prev_gray, gray, table.points, None)
+            table.update(p1, st, frame_index)
+            if table.needs_seeding():
+                table.seed(gray, frame_index)
+    """
+
+    def __init__(self, feature_params, min_features=20):
+        """
+        :param feature_params: parameters of cv2.goodFeaturesToTrack (maxCorners is the maximum
+        number of tracked features)
+        :param min_features: new features are detected when fewer features are tracked
+        """
+        self.feature_params = feature_params
+        self.min_features = min_features
+
+        self.ids = np.empty(0, dtype=np.int32)
+        self.points = np.empty((0, 1, 2), dtype=np.float32)
+        self.next_id = 0
+
+        self._births = []
+        self._deaths = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def needs_seeding(self):
+        return len(self.ids) < self.min_features
+
+    def seed(self, gray, frame_index):
+        """
+        Detects new features (away from the tracked ones) until there are maxCorners features.
+        :param gray: gray ROI
+        :param frame_index: frame index (birth of the new tracks)
+        :return: ids and points (n, 1, 2) of the new features
+        """
+        max_corners = self.feature_params['maxCorners'] - len(self.ids)
+        if max_corners <= 0:  # maxCorners <= 0 means no limit in OpenCV
+            return self.ids[:0], self.points[:0]
+
+        # Do not detect features on top of the tracked ones
+        mask = np.full(gray.shape[:2], 255, dtype=np.uint8)
+        radius = max(int(self.feature_params.get('minDistance', 1)), 1)
+        for x, y in self.points.reshape(-1, 2):
+            cv2.circle(mask, (int(x), int(y)), radius, 0, -1)
+
+        params = dict(self.feature_params, maxCorners=max_corners)
+        new_points = cv2.goodFeaturesToTrack(gray, mask=mask, **params)
+        if new_points is None:
+            return self.ids[:0], self.points[:0]
+
+        new_points = new_points.astype(np.float32).reshape(-1, 1, 2)
+        new_ids = np.arange(self.next_id, self.next_id + len(new_points), dtype=np.int32)
+        self.next_id += len(new_points)
+
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.points = np.concatenate([self.points, new_points])
+        self._births.append(np.column_stack([new_ids, np.full(len(new_ids), frame_index)]))
+        return new_ids, new_points
+
+    def update(self, points, status, frame_index):
+        """
+        Updates the positions of the tracked features and removes the lost ones.
+        :param points: new positions (as returned by cv2.calcOpticalFlowPyrLK)
+        :param status: status of each feature (1 if it was found)
+        :param frame_index: frame index (death of the lost tracks)
+        :return: mask of the features (before the update) that are still tracked
+        """
+        alive = status.ravel() == 1
+        lost = self.ids[~alive]
+        if len(lost):
+            self._deaths.append(np.column_stack([lost, np.full(len(lost), frame_index)]))
+
+        self.ids = self.ids[alive]
+        self.points = points.reshape(-1, 1, 2)[alive]
+        return alive
+
+    def lifetimes(self):
+        """
+        :return: DataFrame with the birth and death frame of each track (feature_id, birth, death).
+        Death is the first frame where the feature was lost (-1 for features tracked until the end)
+        """
+        births = np.concatenate(self._births) if self._births else np.empty((0, 2))
+        deaths = np.concatenate(self._deaths) if self._deaths else np.empty((0, 2))
+
+        df = pd.DataFrame({'feature_id': births[:, 0].astype(np.int32), 'birth': births[:, 1]})
+        death = pd.Series(deaths[:, 1], index=deaths[:, 0].astype(np.int32))
+        df['death'] = df['feature_id'].map(death).fillna(-1)
+        return df
+
+
+def track_lifetimes(tracks, last_frame):
+    """
+    Birth and death frame of each track from the tracked samples (e.g. after stitching chunks).
+    :param tracks: array (n, 4) with the samples [frame, feature_id, x_pos, y_pos]
+    :param last_frame: last frame that was tracked (tracks that reach it have no death)
+    :return: DataFrame with the birth and death frame of each track (see TrackTable.lifetimes)
+    """
+    df = pd.DataFrame({'frame': tracks[:, 0], 'feature_id': tracks[:, 1].astype(np.int32)})
+    grouped = df.groupby('feature_id')['frame']
+    lifetimes = pd.DataFrame({'birth': grouped.min(), 'death': grouped.max() + 1}).reset_index()
+    lifetimes.loc[lifetimes['death'] > last_frame, 'death'] = -1
+    return lifetimes
+
+
+def match_tracks(previous, current, start, boundary, tolerance):
+    """
+    Matches the tracks of two consecutive chunks by their trajectories over the overlap window
+    (frames from start to boundary, tracked by both chunks). Candidates are tracks of both chunks
+    alive at the boundary frame, and the cost of a pair is the mean distance between their positions
+    over the frames both of them were tracked. Pairs are matched greedily by cost (each track at most once).
+    :param previous: array (n, 4) with the samples [frame, feature_id, x_pos, y_pos] of the previous chunk
+    :param current: array (n, 4) with the samples of the current chunk (IDs are local to the chunk)
+    :param start: first frame of the current chunk
+    :param boundary: boundary frame (last frame of the previous chunk)
+    :param tolerance: maximum mean distance (pixels) between matched trajectories
+    :return: DataFrame with the matched pairs (current_id, previous_id) and the mean offset (dx, dy)
+    from the current to the previous trajectory
+    """
+    columns = ['current_id', 'previous_id', 'dx', 'dy']
+    previous_at = previous[previous[:, 0] == boundary]
+    current_at = current[current[:, 0] == boundary]
+    if not len(previous_at) or not len(current_at):
+        return pd.DataFrame(columns=columns)
+
+    # Candidate pairs: close at the boundary frame
+    k = min(4, len(previous_at))
+    distance, nearest = cKDTree(previous_at[:, 2:4]).query(current_at[:, 2:4], k=k,
+                                                            distance_upper_bound=2 * tolerance)
+    distance, nearest = distance.reshape(len(current_at), k), nearest.reshape(len(current_at), k)
+    rows, cols = np.nonzero(np.isfinite(distance))
+    if not len(rows):
+        return pd.DataFrame(columns=columns)
+    pairs = pd.DataFrame({'current_id': current_at[rows, 1], 'previous_id': previous_at[nearest[rows, cols], 1]})
+
+    # Distance between the trajectories of each pair over the overlap window
+    window = (previous[:, 0] >= start) & (previous[:, 0] <= boundary)
+    previous_df = pd.DataFrame(previous[window], columns=['frame', 'previous_id', 'px', 'py'])
+    current_df = pd.DataFrame(current[current[:, 0] <= boundary], columns=['frame', 'current_id', 'cx', 'cy'])
+    samples = pairs.merge(current_df, on='current_id').merge(previous_df, on=['previous_id', 'frame'])
+    samples['dx'] = samples['px'] - samples['cx']
+    samples['dy'] = samples['py'] - samples['cy']
+    samples['distance'] = np.hypot(samples['dx'], samples['dy'])
+    costs = samples.groupby(['current_id', 'previous_id'])[['dx', 'dy', 'distance']].mean().reset_index()
+    costs = costs[costs['distance'] <= tolerance].sort_values('distance', kind='stable')
+
+    used_current, used_previous, matched = set(), set(), []
+    for row in costs.itertuples(index=False):
+        if row.current_id in used_current or row.previous_id in used_previous:
+            continue
+        used_current.add(row.current_id)
+        used_previous.add(row.previous_id)
+        matched.append((row.current_id, row.previous_id, row.dx, row.dy))
+    return pd.DataFrame(matched, columns=columns)
+
+
+def stitch_tracks(chunks, boundaries, starts=None, tolerance=2.0):
+    """
+    Joins the tracks of consecutive chunks of a video. Chunk k is tracked from a few frames before
+    the boundary frame (the last frame of chunk k - 1), and its tracks are matched to the ones of
+    chunk k - 1 by their trajectories over those frames (see match_tracks). Matched tracks keep the
+    ID of the previous chunk and are shifted by their mean offset, so the positions do not jump at
+    the boundary. Samples of chunk k up to the boundary frame are dropped.
+    The result is not the same as one continuous run: chunk k detects new features at the start
+    of its overlap, so tracks of chunk k - 1 without a match end at the boundary frame and the new
+    tracks of chunk k start there (their velocity is not defined for the first frames).
+    :param chunks: list of arrays (n, 4) with the samples [frame, feature_id, x_pos, y_pos] of each chunk
+    (IDs are local to the chunk)
+    :param boundaries: boundary frame between each pair of consecutive chunks (len(chunks) - 1)
+    :param starts: start of each chunk after the first one (len(chunks) - 1, see split_chunks in
+    lib/optical_flow.py). If None, the first frame of the samples of the chunk
+    :param tolerance: maximum mean distance (pixels) between the trajectories of matched tracks. The
+    features of a chunk are detected at integer positions, so it is about the minimum distance
+    between features ("opt_flow/shi_tomasi/min_distance")
+    :return: array (n, 4) with the stitched samples
+    """
+    previous = chunks[0]
+    stitched = [previous]
+    next_id = int(previous[:, 1].max()) + 1 if len(previous) else 0
+    if starts is None:
+        starts = [chunk[:, 0].min() if len(chunk) else boundary for chunk, boundary in zip(chunks[1:], boundaries)]
+
+    for current, boundary, start in zip(chunks[1:], boundaries, starts):
+        local_ids = np.unique(current[:, 1])
+        global_ids = np.full(len(local_ids), -1.)
+        offsets = np.zeros((len(local_ids), 2))
+
+        matched = match_tracks(previous, current, start, boundary, tolerance)
+        if len(matched):
+            i = np.searchsorted(local_ids, matched['current_id'].values)
+            global_ids[i] = matched['previous_id'].values
+            offsets[i] = matched[['dx', 'dy']].values
+
+        new = global_ids < 0
+        global_ids[new] = np.arange(next_id, next_id + new.sum())
+        next_id += int(new.sum())
+
+        current = current[current[:, 0] > boundary].copy()
+        i = np.searchsorted(local_ids, current[:, 1])
+        current[:, 1] = global_ids[i]
+        current[:, 2:4] += offsets[i]
+        stitched.append(current)
+        previous = current
+
+    return np.concatenate(stitched)
@@ -1,9 +1,7 @@
 import os
 import sys
-import json
 import shutil
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 
@@ -11,9 +9,15 @@ from mpl_toolkits.mplot3d import Axes3D
 # video_file = os.path.join(os.getcwd(), 'media', '1', 'video.mp4')
 
 # Define Root folder and set plot style
-root = os.path.join(os.getcwd(), '..', '..')
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
 plt.style.use('ggplot')
 
+sys.path.append(os.path.join(root))
+from lib.config import get_config
+from lib.optical_flow import get_opt_flow_data
+from lib.phase_plane_video import render_phase_plane_video
+from lib.plots import KINEMATIC_COLUMNS
+
 
 def check_folder(folder):
     """
@@ -27,35 +31,6 @@ def check_folder(folder):
         os.makedirs(folder)
 
 
-def get_opt_flow_data(video_file, eye):
-    """
-    Loads the *.csv file generated from the optical flow analysis of one eye.
-    :param video_file: path to the video
-    :param eye: 'left' or 'right'
-    :return: DataFrame with data obtained from the optical flow (pos, vel, accel)
-    """
-
-    # Check eye
-    if eye == 'left':
-        eye = 'left_eye_'
-    elif eye == 'right':
-        eye = 'right_eye_'
-
-    # Set Optical flow folder directory
-    opt_flow_folder = os.path.join(os.path.dirname(video_file), 'optical_flow')
-
-    params_file = os.path.join(root, 'params', 'params.json')
-    print('Loading parameters file: %s' % params_file)
-
-    # Load params file
-    with open(params_file, 'r') as json_file:
-        jf = json.load(json_file)
-        fps = jf['camera']['fps']
-        opt_flow_csv = eye + jf['opt_flow']['csv_file']
-
-    return pd.read_csv(os.path.join(opt_flow_folder, opt_flow_csv))
-
-
 def mag_and_phase_from_xy(x, y, normalized=False):
     mag = np.sqrt(x ** 2 + y ** 2)
     phase = np.arctan(y / x)
@@ -76,6 +51,10 @@ if __name__ == '__main__':
     # Eye
     eyes = ['left', 'right']
 
+    # Load parameters
+    fps = get_config()['camera']['fps']
+    phase_plane_params = get_config()['phase_plane']
+
     # Set filename per each subject
     video_cp = os.path.join(root, 'test', 'media', '1', 'video.mp4')
     video_nc = os.path.join(root, 'test', 'media', '0', 'video.mp4')
@@ -84,8 +63,8 @@ if __name__ == '__main__':
 
     for i, eye in enumerate(eyes):
         # Load velocity and acceleration into a DataFrame
-        df_cp = get_opt_flow_data(video_cp, eye)
-        df_nc = get_opt_flow_data(video_nc, eye)
+        df_cp = get_opt_flow_data(video_cp, eye, columns=['frame'] + KINEMATIC_COLUMNS)
+        df_nc = get_opt_flow_data(video_nc, eye, columns=['frame'] + KINEMATIC_COLUMNS)
 
         # Define the range of frames to be analysed
         # (for controls nc_* and for cerebral palsy cp_*)
@@ -106,6 +85,10 @@ if __name__ == '__main__':
         check_folder(nc_folder)
         check_folder(cp_folder)
 
+        # Render the phase planes per frame (one video per subject, see lib/phase_plane_video.py)
+        render_phase_plane_video(df_nc, os.path.join(nc_folder, 'phase_plane.mp4'), phase_plane_params, fps)
+        render_phase_plane_video(df_cp, os.path.join(cp_folder, 'phase_plane.mp4'), phase_plane_params, fps)
+
         # Create velocity and acceleration vectors
         vel_mag_nc = mag_and_phase_from_xy(df_nc['x_vel'], df_nc['y_vel'], normalized=True)[0]
         accel_mag_nc = mag_and_phase_from_xy(df_nc['x_accel'], df_nc['y_accel'], normalized=True)[0]
@@ -130,19 +113,3 @@ if __name__ == '__main__':
         ax.set_zlabel('Time')
 
         plt.show()
-
-        # Draw phase planes per frame
-        # seconds = 5
-        # df = df_cp
-        # index = np.logical_and(df['frame'].astype(int) >= cp_initial_frame, df['frame'].astype(int) <= cp_initial_frame + seconds * 120)
-        # vel_data = vel_mag_cp[index]
-        # accel_data = accel_mag_cp[index]
-        #
-        # plt.subplot(1, 2, 1)
-        # plt.title('Info during %d seconds' % seconds )
-        # plt.scatter(vel_data, accel_data)
-        # plt.show()
-
-
-
-
@@ -0,0 +1,46 @@
+__description__ = """
+FEATURE MATRIX
+Builds (or updates) the matrix of kinematic descriptors of every subject and eye of a dataset
+(see lib/features.py). Only the videos whose optical flow changed since the last run are processed.
+
+USAGE:
+    python 04_feature_matrix.py [dataset folder] -j [number of workers]
+
+If no folder is given, "dataset_folder" from params.json is used.
+"""
+
+import os
+import sys
+import argparse
+from argparse import RawTextHelpFormatter
+
+# Define the root folder
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
+
+sys.path.append(os.path.join(root))
+from lib.config import add_config_arguments, apply_config_arguments, get_config
+from lib.features import build_feature_matrix, feature_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__description__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument('dataset_folder', nargs='?', default=None,
+                        help='Path to the dataset folder (default: "dataset_folder" in params.json)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='Number of worker processes (default: params.json)')
+    add_config_arguments(parser)
+    return parser.parse_args()
+
+
+# MAIN FUNCTION
+if __name__ == '__main__':
+    args = parse_args()
+    apply_config_arguments(args)
+
+    dataset_folder = args.dataset_folder or get_config()['dataset_folder']
+
+    matrix, index = build_feature_matrix(dataset_folder, n_workers=args.workers)
+
+    # Mean of the features per eye
+    if len(index['rows']):
+        print(feature_table(dataset_folder).groupby('eye').mean(numeric_only=True))
@@ -0,0 +1,89 @@
+__description__ = """
+Live ocular motion processing: eye detection, optical flow, kinematics and phase plane
+while the video is being recorded (see lib/streaming.py). The latency of each frame is reported.
+
+USAGE:
+    python live.py -c [camera index]
+    python live.py -v [path to a video] --realtime
+
+Example:
+    python live.py -c 0 --visualize
+    python live.py -v video.mp4 --realtime -o samples.csv
+"""
+
+import os
+import sys
+import argparse
+from argparse import RawTextHelpFormatter
+
+# Define the root folder
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
+
+sys.path.append(os.path.join(root))
+from lib.config import add_config_arguments, apply_config_arguments, get_config
+from lib.histograms import phase_plane_edges
+from lib.optical_flow import feature_params, lk_params
+from lib.preview import Preview
+from lib.streaming import LatencyMonitor, render_phase_plane, stream
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__description__, formatter_class=RawTextHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-c', '--camera', type=int, help='Camera index')
+    source.add_argument('-v', '--video', help='Path to a video file')
+    parser.add_argument('--realtime', action='store_true', help='Replay the video file at its frame rate')
+    parser.add_argument('--visualize', action='store_true', help='Show the phase planes while processing')
+    parser.add_argument('-o', '--output', help='Save the kinematic samples to a *.csv file')
+    add_config_arguments(parser)
+    return parser.parse_args()
+
+
+# MAIN FUNCTION
+if __name__ == '__main__':
+    args = parse_args()
+    apply_config_arguments(args)
+    jf = get_config()
+
+    vel_edges, accel_edges = phase_plane_edges(jf['phase_plane'], 'magnitude')
+
+    source, samples = stream(args.camera if args.video is None else args.video,
+                             jf['detection'], feature_params(), lk_params(), jf['camera']['fps'],
+                             vel_edges, accel_edges, realtime=args.realtime,
+                             buffer_size=jf['streaming']['buffer_size'], min_features=jf['opt_flow']['min_features'])
+
+    latency = LatencyMonitor()
+    preview = Preview().start() if args.visualize else None
+    output = open(args.output, 'w') if args.output else None
+    if output is not None:
+        output.write('frame,eye,feature_id,x_pos,y_pos,x_vel,y_vel,x_accel,y_accel\n')
+
+    try:
+        for frame_index, capture_time, kinematics, histograms in samples:
+            if output is not None:
+                for eye, (ids, points, vel, accel) in kinematics.items():
+                    for row in zip(ids, points, vel, accel):
+                        output.write('%d,%s,%d,%f,%f,%f,%f,%f,%f\n' % ((frame_index, eye, row[0]) + tuple(row[1])
+                                                                       + tuple(row[2]) + tuple(row[3])))
+
+            latency.update(capture_time)
+
+            if preview is not None:
+                for eye, histogram in histograms.items():
+                    preview.show('%s phase plane' % eye, render_phase_plane(histogram))
+                if preview.stopped:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        if preview is not None:
+            preview.close()
+        if output is not None:
+            output.close()
+
+    summary = latency.summary()
+    if summary['n_frames']:
+        print('[  OK  ] %d frames processed (%d dropped). Latency: mean %.1f ms, p95 %.1f ms, max %.1f ms'
+              % (summary['n_frames'], source.dropped, 1e3 * summary['mean'], 1e3 * summary['p95'],
+                 1e3 * summary['max']))
@@ -0,0 +1,64 @@
+__description__ = """
+Lucas-Kenade parameter sweep (see lib/lk_sweep.py): the eye ROIs of an excerpt of the video are
+decoded once and every combination of the grid ("lk_sweep/grid" in params.json) is tracked in a
+pool of processes. Prints the time per frame, survival and forward-backward error of each parameter
+set, and the fastest one that meets the accuracy bar ("lk_sweep/max_fb_error" and "lk_sweep/min_survival").
+The eyes of the video must be detected first (see 01_eyes_detection.py).
+
+USAGE:
+    python lk_sweep.py [path to the video]
+
+Example:
+    python lk_sweep.py video.mp4 -n 600 -j 8
+    python lk_sweep.py video.mp4 --set 'lk_sweep.grid={"win_size": [7, 10], "max_level": [2, 3]}'
+"""
+
+import os
+import sys
+import argparse
+from argparse import RawTextHelpFormatter
+
+import pandas as pd
+
+# Define the root folder
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
+
+sys.path.append(os.path.join(root))
+from lib.config import add_config_arguments, apply_config_arguments, get_config
+from lib.lk_sweep import best_parameters, run_sweep
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__description__, formatter_class=RawTextHelpFormatter)
+    parser.add_argument('video', help='Path to the video')
+    parser.add_argument('-n', '--frames', type=int, default=None,
+                        help='Number of frames of the excerpt (default: params.json)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='Number of worker processes (default: params.json)')
+    add_config_arguments(parser)
+    return parser.parse_args()
+
+
+# MAIN FUNCTION
+if __name__ == '__main__':
+    args = parse_args()
+    apply_config_arguments(args)
+    params = get_config()['lk_sweep']
+
+    results = run_sweep(args.video, n_frames=args.frames, n_workers=args.workers)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(results)
+
+    best = best_parameters(results, params['max_fb_error'], params['min_survival'])
+    if best is None:
+        print('[  WARNING  ] No parameter set meets the accuracy bar (fb_error_median <= %.2f, survival >= %.2f)'
+              % (params['max_fb_error'], params['min_survival']))
+    else:
+        opt_flow = get_config()['opt_flow']
+        print('[  OK  ] Fastest parameters that meet the accuracy bar (%.3f ms per frame):'
+              % best['ms_per_frame'])
+        for key in sorted(params['grid']):
+            section = 'shi_tomasi' if key in opt_flow['shi_tomasi'] else 'lucas_kanade'
+            name = key if key == 'min_features' else section + '.' + key
+            print('\t--set opt_flow.%s=%g' % (name, best[key]))
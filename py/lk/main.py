@@ -5,14 +5,30 @@ This software compares two videos (healthy and non-healty subjects) and
 performs a pipeline for ocular motion processing as follows:\n\n
 
     1) Eye detection
-    2) Calculation of the optical flow (Lucas Kenade algorithm)
-    3) Plotting of the phase-space for velocity and acceleration
+    2) Tracking of the eye ROIs along the video
+    3) Storage of the gray eye ROIs (decoded once, re-analysis reads them from disk)
+    4) Calculation of the optical flow (Lucas Kenade algorithm)
+    5) Plotting of the phase-space for velocity and acceleration
+
+All the stages run in this process (see lib/pipeline.py). Use -s to select the stages
+to be run, the skipped ones are loaded from the results of a previous run. Stages whose
+results are cached for the same video and parameters are not run again (see --no-cache).
 
 USAGE: just excecute as follows:
     python main.py -hv [path to the healthy video] -dv [path to the disease/condition video]
 
 Example:
     python main.py -hv healthy.mp4 -dv disease.mp4
+    python main.py -hv healthy.mp4 -dv disease.mp4 -s optical_flow phase_plane
+
+BATCH: stages 1) to 4) for every video in a dataset folder (one video per folder),
+using a pool of processes:
+    python main.py -b [dataset folder] -j [number of workers]
+
+If no folder is given, "dataset_folder" from params.json is used.
+
+Any parameter of params.json can be overridden for one run (see lib/config.py):
+    python main.py -b -j 8 --set opt_flow.n_workers=1 --set detection.scale_factor=1.2
 """
 
 
@@ -22,14 +38,36 @@ import argparse
 from argparse import RawTextHelpFormatter
 from os.path import join, dirname, realpath
 
+import matplotlib.pyplot as plt
+
 current_dir = dirname(realpath(__file__))
 
+# Define the root folder (DO NOT TOUCH)
+root = join(current_dir, '..', '..')
+
+sys.path.append(os.path.join(root))
+from lib.batch import run_batch
+from lib.config import add_config_arguments, apply_config_arguments
+from lib.pipeline import STAGES, run_pipeline
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description=__description__, formatter_class=RawTextHelpFormatter)
     parser.add_argument('-hv', #metavar='--healthy-vid',
                         help='Path for healthy video')
     parser.add_argument('-dv', #metavar='--disease-vid',
                         help='Path to non-healthy video')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='Stages to be run (default: all)')
+    parser.add_argument('--visualize', action='store_true',
+                        help='Show a live preview of the detection and tracking (default: headless)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Run the selected stages even if their results are cached')
+    parser.add_argument('-b', '--batch', nargs='?', const='', default=None, metavar='DATASET_FOLDER',
+                        help='Process every video in a dataset folder (default: "dataset_folder" in params.json)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='Number of worker processes for the batch mode (default: params.json)')
+    add_config_arguments(parser)
     if len(sys.argv)==1:
         parser.print_help(sys.stderr)
         sys.exit(1)
@@ -37,23 +75,16 @@ def parse_args():
     return parser.parse_args()
 
 
-# Define the root folder (DO NOT TOUCH)
-root = os.path.join(os.getcwd(), '..', '..')
-
-# Check operating System
-if os.name == 'nt':
-    # python = os.path.normpath('C:/Users/' + os.environ['USERNAME'] + '/Anaconda2/python.exe')
-    python = 'C:/Users/sssilvar/AppData/Local/Programs/Python/Python36/python.exe'
-elif os.name == 'Linux':
-    python = 'python 2.7'
-else:
-    python = 'python'
-
-
 # MAIN FUNCTION
 if __name__ == '__main__':
     # Get videos from args
     args = parse_args()
+    apply_config_arguments(args)
+
+    # Batch mode
+    if args.batch is not None:
+        summary = run_batch(args.batch or None, n_workers=args.workers)
+        sys.exit(1 if summary['n_failed'] else 0)
 
     # Define the list of videos:
     video_files = [
@@ -63,18 +94,9 @@ if __name__ == '__main__':
 
     # =========================================
     # Start pipeline processing (DO NOT TOUCH)
-    for video_file in video_files:
-        # 0. Normalize path (compatibility Windows and Linux)
-        video_file = os.path.normpath(video_file)
-
-        # # 1. Eyes detection
-        script = join(current_dir, '01_eyes_detection.py')
-        os.system(python + ' %s %s' % (script, video_file))
-        #
-        # 2. Optical Flow Calculation
-        script = join(current_dir, '02_optical_flow_hs.py')
-        os.system(python + ' %s %s' % (script, video_file))
-
-# Plot results
-script = join(current_dir, '03_phase_plane_all_video.py')
-os.system(python + ' %s %s %s' % (script, video_files[0], video_files[1]))
\ No newline at end of file
+    run_pipeline(video_files, stages=args.stages, visualize=args.visualize,
+                 use_cache=False if args.no_cache else None)
+
+    # Plot results
+    if 'phase_plane' in args.stages:
+        plt.show()
@@ -0,0 +1,211 @@
+"""
+BENCHMARK
+@Description: Throughput (frames per second) and peak memory of the processing stages on a
+synthetic video (see lib/synthetic.py), so it runs without any private video. The eyes are closed
+during the first frames, so the eye extraction is timed over a known number of scanned frames (the
+frames until the eyes open). Each stage runs in
+its own process (peak memory per stage). Results are appended to "benchmarks/results.json" and
+compared with the previous run with the same settings.
+
+USAGE:
+    python benchmark.py
+    python benchmark.py --frames 2400 --width 3840 --height 2160
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from multiprocessing import Process, Queue
+
+# Define the root folder
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+sys.path.append(os.path.join(root))
+from lib.config import add_config_arguments, apply_config_arguments, get_config
+from lib.eyes_extraction import eye_extraction, load_eyes_detection
+from lib.optical_flow import get_opt_flow_data, opt_flow_multi
+from lib.histograms import PhasePlaneHistogram
+from lib.phase_plane_video import render_phase_plane_video
+from lib.roi_store import build_roi_store
+from lib.roi_tracking import track_eye_rois
+from lib.synthetic import generate_video, write_eyes_detection
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('eye_extraction', 'roi_tracking', 'roi_frames', 'optical_flow', 'phase_plane_histogram',
+          'phase_plane_video')
+EYE_KEYS = ('left_eye', 'right_eye')
+
+# Minimum overlap (intersection over union) between the detected and the ground truth eye ROIs
+MIN_ROI_OVERLAP = 0.5
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of this process (MB), None if it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024. * 1024.) if sys.platform == 'darwin' else peak / 1024.
+
+
+def roi_overlap(a, b):
+    """
+    Intersection over union of two ROIs ({'x_min', 'x_max', 'y_min', 'y_max'}).
+    """
+    w = min(a['x_max'], b['x_max']) - max(a['x_min'], b['x_min'])
+    h = min(a['y_max'], b['y_max']) - max(a['y_min'], b['y_min'])
+    intersection = max(w, 0) * max(h, 0)
+    area = lambda roi: (roi['x_max'] - roi['x_min']) * (roi['y_max'] - roi['y_min'])
+    return intersection / float(area(a) + area(b) - intersection)
+
+
+def run_stage(stage, video_file, n_frames):
+    """
+    Runs one stage.
+    :param stage: see STAGES
+    :param video_file: path to the synthetic video
+    :param n_frames: number of frames of the video
+    :return: number of frames processed
+    """
+    jf = get_config()
+
+    if stage == 'eye_extraction':
+        rois = load_eyes_detection(video_file)  # Ground truth (overwritten by the detection)
+        data = eye_extraction(video_file, show_plot=False)
+        write_eyes_detection(video_file, {eye: rois[eye] for eye in EYE_KEYS}, rois['frame_start'])
+
+        # The detection must find the eyes of the synthetic face (otherwise only the failure path is measured)
+        if not data:
+            raise AssertionError('Eyes not detected in the synthetic video')
+        if data['frame_start'] < rois['frame_start']:
+            raise AssertionError('Eyes detected in frame %d, while they are closed until frame %d'
+                                 % (data['frame_start'], rois['frame_start'] - 1))
+        for eye in EYE_KEYS:
+            overlap = roi_overlap(data[eye], rois[eye])
+            if overlap < MIN_ROI_OVERLAP:
+                raise AssertionError('Detected %s %s does not match the ground truth %s (overlap %.2f)'
+                                     % (eye, data[eye], rois[eye], overlap))
+        return int(data['frame_start'])
+
+    if stage == 'roi_tracking':
+        return len(track_eye_rois(video_file).frames)
+
+    if stage == 'roi_frames':
+        return len(build_roi_store(video_file))
+
+    if stage == 'optical_flow':
+        dfs = opt_flow_multi(video_file, ['left', 'right'], visualize=False)
+        return int(max(df['frame'].max() - df['frame'].min() + 1 for df in dfs.values()))
+
+    df = get_opt_flow_data(video_file, 'left')
+    n_frames = int(df['frame'].max() - df['frame'].min() + 1)
+    if stage == 'phase_plane_histogram':
+        for quantity in ('magnitude', 'phase'):
+            PhasePlaneHistogram.from_params(jf['phase_plane'], quantity).update_df(df)
+    elif stage == 'phase_plane_video':
+        render_phase_plane_video(df, os.path.join(os.path.dirname(video_file), 'phase_plane.mp4'),
+                                 jf['phase_plane'], jf['camera']['fps'])
+    return n_frames
+
+
+def stage_worker(stage, video_file, n_frames, queue):
+    start = time.time()
+    try:
+        n_frames = run_stage(stage, video_file, n_frames)
+        queue.put({'stage': stage, 'n_frames': n_frames, 'time': time.time() - start,
+                   'peak_memory_mb': peak_memory_mb(), 'error': None})
+    except Exception as e:
+        queue.put({'stage': stage, 'n_frames': 0, 'time': time.time() - start,
+                   'peak_memory_mb': peak_memory_mb(), 'error': repr(e)})
+
+
+def measure(stage, video_file, n_frames):
+    """
+    Runs a stage in its own process.
+    :return: dict with the number of frames, time, frames per second and peak memory of the stage
+    """
+    queue = Queue()
+    process = Process(target=stage_worker, args=(stage, video_file, n_frames, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    result['fps'] = result['n_frames'] / result['time'] if result['time'] > 0 else 0.
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(defaults):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--frames', type=int, default=defaults['n_frames'], help='Number of frames')
+    parser.add_argument('--width', type=int, default=defaults['width'], help='Width of the video')
+    parser.add_argument('--height', type=int, default=defaults['height'], help='Height of the video')
+    parser.add_argument('--head', type=float, default=defaults['head_amplitude'],
+                        help='Amplitude of the head motion (pixels)')
+    parser.add_argument('--closed', type=int, default=defaults['closed_frames'],
+                        help='Number of frames with closed eyes at the beginning of the video')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='Stages to be measured (default: all)')
+    add_config_arguments(parser)
+    return parser.parse_args()
+
+
+# MAIN FUNCTION
+if __name__ == '__main__':
+    args = parse_args(get_config()['benchmark'])
+    apply_config_arguments(args)
+    jf = get_config()
+
+    settings = {'n_frames': args.frames, 'width': args.width, 'height': args.height, 'head_amplitude': args.head,
+                'closed_frames': args.closed, 'fps': jf['camera']['fps']}
+    if args.set:
+        settings['overrides'] = sorted(args.set)
+    folder = os.path.join(root, 'test', 'benchmarks', 'synthetic_%dx%d_%d' % (args.width, args.height, args.frames))
+    video_file = generate_video(folder, args.frames, jf['camera']['fps'], args.width, args.height,
+                                head_amplitude=args.head, closed_frames=args.closed)
+
+    results = {}
+    for stage in args.stages:
+        print('[  INFO  ] Benchmark: %s' % stage)
+        results[stage] = measure(stage, video_file, args.frames)
+
+    run = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(), 'machine': platform.node(),
+           'settings': settings, 'results': results}
+
+    # Save and compare with the previous run (same settings)
+    results_file = os.path.join(root, 'test', 'benchmarks', 'results.json')
+    runs = []
+    if os.path.isfile(results_file):
+        with open(results_file, 'r') as json_file:
+            runs = json.load(json_file)
+    previous = [r for r in runs if r['settings'] == settings]
+    runs.append(run)
+    with open(results_file, 'w') as json_file:
+        json.dump(runs, json_file, sort_keys=True, indent=4)
+
+    print('[  OK  ] Benchmark (%d frames, %dx%d):' % (args.frames, args.width, args.height))
+    for stage, result in results.items():
+        line = '\t%s: %.1f fps, %.2f s' % (stage, result['fps'], result['time'])
+        if result['peak_memory_mb'] is not None:
+            line += ', peak memory %.0f MB' % result['peak_memory_mb']
+        if result['error'] is not None:
+            line += ' [ERROR: %s]' % result['error']
+        if previous and stage in previous[-1]['results'] and previous[-1]['results'][stage]['fps']:
+            line += ' (%+.1f%% vs %s)' % (100. * (result['fps'] / previous[-1]['results'][stage]['fps'] - 1),
+                                         previous[-1]['commit'] or previous[-1]['time'])
+        print(line)